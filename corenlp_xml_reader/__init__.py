@@ -1 +1,5 @@
 from annotated_text import AnnotatedText, Token, Sentence
+from corpus import (
+    CorpusLoader, iter_corpus, iter_pair_contents, load, find_corpus_pairs
+)
+from archives import iter_archive, iter_archive_pairs
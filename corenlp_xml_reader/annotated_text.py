@@ -1,12 +1,98 @@
+from bisect import bisect_right
 from collections import Counter
+import copy_reg
+import cPickle
+import hashlib
 import json
+from multiprocessing import Pool
 import re
-from bs4 import BeautifulSoup as Soup
 import time
+import weakref
+from coreference_index import CoreferenceIndex
+from instrumentation import Collector, as_collector
+from labels import VOCABULARIES
+from memory import memory_report, DEFAULT_LARGE_OBJECT_THRESHOLD
+from sources import (
+    decompose_soup, parse_soup, read_all, read_bytes, read_path, open_mmap
+)
 
 CLOSING_BRACKET = re.compile(r'\)+( |$)')
 # Article that made this necessary: wj_article_6794.txt.xml
 
+# Used to locate the <sentences> block and the individual <sentence> elements
+# within it, without running the whole document through BeautifulSoup.
+MATCH_SENTENCES_BLOCK = re.compile(r'<sentences>(.*)</sentences>', re.DOTALL)
+MATCH_SENTENCE_ELEMENT = re.compile(
+    r'<sentence\b[^>]*>.*?</sentence>', re.DOTALL)
+
+
+def _strong(obj):
+    '''
+    The counterpart of weakref.proxy, for restoring strong links.
+    '''
+    return obj
+
+
+def _referent(obj):
+    '''
+    The object that `obj` points to, if it is a weak proxy to a part of a
+    document (see _Referent), or else `obj` itself.
+    '''
+    if isinstance(obj, weakref.ProxyTypes):
+        return obj._referent()
+    return obj
+
+
+def _is_same(obj, other):
+    '''
+    Identity test that also treats weak proxies to `obj` as `obj` itself.
+    '''
+    return id(obj) == id(_referent(other))
+
+
+def _reduce_proxy(proxy):
+    '''
+    Weak proxies can't be pickled or deep-copied, so the weak links of
+    cycle-free documents are copied as the objects they point to.  The
+    copies are weakened again when the document is unpickled (see
+    AnnotatedText.__setstate__), and the original document is left as it
+    is.
+    '''
+    try:
+        return _strong, (_referent(proxy),)
+    except AttributeError:
+        raise TypeError('can\'t pickle weak proxies to %r' % proxy)
+
+copy_reg.pickle(weakref.ProxyType, _reduce_proxy)
+
+
+def require_picklable(function, name):
+    '''
+    Raise ValueError if `function` (the option called `name`) can't be
+    sent to worker processes, as happens with lambdas and closures.
+    '''
+    try:
+        cPickle.dumps(function, cPickle.HIGHEST_PROTOCOL)
+    except (cPickle.PicklingError, TypeError):
+        raise ValueError(
+            '%s must be a module-level function to be used in worker '
+            'processes.' % name
+        )
+
+
+def _read_sentence_range(args):
+    '''
+    Worker for parallel parsing.  Builds the Sentence objects for a 
+    contiguous range of <sentence> elements.  This needs to be a module-level
+    function so that it can be sent to worker processes.
+    '''
+    options, sentences_xml, instrumented = args
+    collector = Collector() if instrumented else None
+    reader = AnnotatedText(instrumentation=collector, **options)
+    reader.soup = parse_soup('<sentences>' + sentences_xml + '</sentences>')
+    reader._read_all_sentences()
+    return reader.sentences, collector
+
 
 class AnnotatedText(object):
 
@@ -31,6 +117,47 @@ class AnnotatedText(object):
     LEGAL_DEPENDENCY_TYPES = set([
         'collapsed-ccprocessed', 'collapsed', 'basic'
     ])
+    LEGAL_INPUT_FORMATS = set(['xml', 'json'])
+
+    # The token attributes read from CoreNLP's output, which can be limited
+    # using `token_fields`, and the names they have in the xml and json
+    TOKEN_FIELDS = [
+        'word', 'lemma', 'pos', 'ner', 'character_offset_begin',
+        'character_offset_end', 'speaker'
+    ]
+    OFFSET_FIELDS = set(['character_offset_begin', 'character_offset_end'])
+    XML_TOKEN_TAGS = {
+        'word': 'word',
+        'lemma': 'lemma',
+        'pos': 'pos',
+        'ner': 'ner',
+        'character_offset_begin': 'characteroffsetbegin',
+        'character_offset_end': 'characteroffsetend',
+        'speaker': 'Speaker',
+    }
+    JSON_TOKEN_KEYS = {
+        'word': 'word',
+        'lemma': 'lemma',
+        'pos': 'pos',
+        'ner': 'ner',
+        'character_offset_begin': 'characterOffsetBegin',
+        'character_offset_end': 'characterOffsetEnd',
+        'speaker': 'speaker',
+    }
+
+    # Keys under which CoreNLP's json output holds each kind of dependency
+    # parse.  Older versions of CoreNLP use the same names as in the xml;
+    # newer versions replaced collapsed and collapsed-ccprocessed 
+    # dependencies with their closest counterparts, enhanced and enhanced++
+    # dependencies.
+    JSON_DEPENDENCY_KEYS = {
+        'basic': ['basic-dependencies', 'basicDependencies'],
+        'collapsed': ['collapsed-dependencies', 'enhancedDependencies'],
+        'collapsed-ccprocessed': [
+            'collapsed-ccprocessed-dependencies', 
+            'enhancedPlusPlusDependencies'
+        ],
+    }
 
     def __init__(
         self, 
@@ -41,7 +168,18 @@ class AnnotatedText(object):
         exclude_long_mentions=False,
         long_mention_threshold=5,
         exclude_non_ner_coreferences=False,
-        initial_offset=0
+        initial_offset=0,
+        processes=1,
+        instrumentation=None,
+        keep_text=True,
+        keep_soup=True,
+        input_format='xml',
+        cycle_free=False,
+        sentence_filter=None,
+        token_fields=None,
+        intern_labels=True,
+        hash_sentences=False,
+        previous=None
     ):
 
         # If true, do not include NER's of the types listed in 
@@ -59,6 +197,74 @@ class AnnotatedText(object):
 
         self.initial_offset = initial_offset
 
+        # If more than one, the sentences are split into contiguous ranges
+        # that are parsed in that many worker processes
+        self.processes = processes
+
+        # Optionally receives the duration of each phase of construction,
+        # and counts of what was read.  See the instrumentation module.
+        self.instrumentation = as_collector(instrumentation)
+
+        # Whether to hold on to the CoreNLP xml, and the BeautifulSoup tree
+        # parsed from it, once the document has been built.  These are 
+        # by far the largest parts of an AnnotatedText.
+        self.keep_text = keep_text
+        self.keep_soup = keep_soup
+
+        # If true, links that point back up the object graph (from tokens
+        # to their governors, constituents and mentions, and from mentions
+        # to their references) are made weak once the document is built.
+        # The document then has no reference cycles, and is freed as soon
+        # as it is dropped, without waiting for the cyclic garbage 
+        # collector.  See break_cycles().
+        self.cycle_free = cycle_free
+
+        # Optionally, a predicate that decides which sentences to keep.  It
+        # is called with a sentence's list of tokens, as soon as they are
+        # read, so the constituency and dependency parses of the sentences
+        # it rejects are never built.  Kept sentences are renumbered, and 
+        # coreference and AIDA mentions in rejected sentences are dropped.
+        self.sentence_filter = sentence_filter
+        self.source_sentence_ids = None
+        if processes > 1:
+            require_picklable(sentence_filter, 'sentence_filter')
+
+        # If true, POS tags, NER types, dependency relations, and 
+        # constituent tags are replaced by the shared copies held in the
+        # label vocabularies (see the labels module), so that documents 
+        # don't each hold their own copies of the same few strings.
+        self.intern_labels = intern_labels
+
+        # If true, a hash of each <sentence> element is kept in 
+        # `sentence_hashes`, so that the document can later be given as
+        # `previous`, when reading a new version of it.  Sentences whose
+        # element is unchanged are then taken over from `previous` 
+        # (which shouldn't be used afterwards), rather than rebuilt.  The
+        # document-level coreference and AIDA links are always rebuilt.
+        self.hash_sentences = hash_sentences or previous is not None
+        self.sentence_hashes = None
+
+        # Optionally, only read and store some of the tokens' attributes 
+        # (see TOKEN_FIELDS).  Tokens always have their ids, and their
+        # dependency and mention links.  Named entities are only found if
+        # 'ner' is read, and AIDA mentions are aligned to tokens by their
+        # character offsets, so those are needed to read AIDA output.
+        if token_fields is None:
+            token_fields = self.TOKEN_FIELDS
+        for field in token_fields:
+            if field not in self.TOKEN_FIELDS:
+                raise ValueError(
+                    'token_fields must be among %s.' 
+                    % ', '.join(self.TOKEN_FIELDS)
+                )
+        self.token_fields = [f for f in self.TOKEN_FIELDS if f in token_fields]
+        missing_offsets = not self.OFFSET_FIELDS.issubset(self.token_fields)
+        if aida_json is not None and missing_offsets:
+            raise ValueError(
+                'Reading AIDA output needs the character_offset_begin and '
+                'character_offset_end token fields.'
+            )
+
         # User can choose the kind of dependency parse they wish to use
         # Valid options listed below.  Ensure that a valid option was chosen.
         if dependencies not in self.LEGAL_DEPENDENCY_TYPES:
@@ -69,13 +275,26 @@ class AnnotatedText(object):
         
         self.dependencies = dependencies
 
-        # Parse the annotated article xml
+        # CoreNLP's output can be read from its xml or its json format.
+        # Both produce the same sentences, tokens, and references.
+        if input_format not in self.LEGAL_INPUT_FORMATS:
+            raise ValueError('input_format must be one of "xml" or "json".')
+        self.input_format = input_format
+
+        if previous is not None:
+            self._check_previous(previous)
+
+        # Parse the annotated article xml (or json)
         if corenlp_xml is not None:
-            self._read_stanford_xml(corenlp_xml)
+            if self.input_format == 'json':
+                self._read_stanford_json(corenlp_xml)
+            else:
+                self._read_stanford_xml(corenlp_xml, previous)
 
             # Parse the AIDA JSON
             if aida_json is not None:
-                self._read_aida_json(aida_json)
+                self._run_phase('read_aida_json', self._read_aida_json, 
+                    aida_json)
 
         # User cannot provide AIDA data unless stanford xml is also 
         # provided
@@ -85,44 +304,544 @@ class AnnotatedText(object):
                 ' xml.'
             )
 
+        if self.cycle_free and corenlp_xml is not None:
+            self._run_phase('break_cycles', self.break_cycles)
+
+
+    @classmethod
+    def from_path(
+        cls, corenlp_path, aida_path=None, use_mmap=True, keep_text=False,
+        keep_soup=False, **kwargs
+    ):
+        '''
+        Build an AnnotatedText from the CoreNLP xml file at `corenlp_path`,
+        (and optionally the AIDA json file at `aida_path`).  The xml is 
+        read in chunks, from a memory map if `use_mmap` is true, so the
+        whole document is never held as one string.  Files compressed 
+        with gzip, bz2 or xz are decompressed as they are read.
+        '''
+        aida_json = None
+        if aida_path is not None:
+            aida_json = read_path(aida_path)
+
+        if use_mmap:
+            corenlp_xml = open_mmap(corenlp_path)
+            try:
+                return cls(
+                    corenlp_xml, aida_json, keep_text=keep_text,
+                    keep_soup=keep_soup, **kwargs
+                )
+            finally:
+                if not isinstance(corenlp_xml, basestring):
+                    corenlp_xml.close()
+
+        with open(corenlp_path, 'rb') as corenlp_file:
+            return cls(
+                corenlp_file, aida_json, keep_text=keep_text,
+                keep_soup=keep_soup, **kwargs
+            )
+
 
-    def _read_stanford_xml(self, article_string):
+    @classmethod
+    def from_bytes(
+        cls, corenlp_xml, aida_json=None, keep_text=False, keep_soup=False,
+        **kwargs
+    ):
+        '''
+        Build an AnnotatedText from CoreNLP xml held as a byte string.  The
+        bytes are decoded and parsed in chunks, and not kept afterwards
+        unless `keep_text` is true.
+        '''
+        return cls(
+            corenlp_xml, aida_json, keep_text=keep_text, keep_soup=keep_soup,
+            **kwargs
+        )
+
+
+    @classmethod
+    def from_file(
+        cls, corenlp_file, aida_file=None, keep_text=False, keep_soup=False,
+        **kwargs
+    ):
+        '''
+        Build an AnnotatedText from file objects holding the CoreNLP xml
+        and (optionally) the AIDA json.  The xml is read in chunks.
+        '''
+        return cls(
+            corenlp_file, aida_file, keep_text=keep_text, keep_soup=keep_soup,
+            **kwargs
+        )
+
+
+    def _read_stanford_xml(self, source, previous=None):
         '''
         read in an article that has been annotated by coreNLP, and
-        represent it using python objects
+        represent it using python objects.  `source` can be a string, an
+        mmap, or a file object, and its contents may be compressed.
         '''
 
-        # a string representing the xml output by coreNLP
-        self.text = article_string
+        # Parallel parsing works on the text of the sentences, so it needs
+        # the whole document.  Otherwise only keep the text if asked to.
+        text = None
+        if self.keep_text or self.processes > 1 or self.hash_sentences:
+            text = read_all(source)
+        self.text = text if self.keep_text else None
+
+        # Build a Python representation of all the sentences, either by
+        # parsing the whole document here, or by farming ranges of sentences
+        # out to worker processes.  When reading a new version of a 
+        # document, only the sentences that changed are parsed.
+        if previous is not None:
+            self._run_phase('read_changed_sentences', 
+                self._read_changed_sentences, text, previous)
+        elif self.processes > 1:
+            self._run_phase('read_sentences_in_parallel', 
+                self._read_sentences_in_parallel, text)
+        else:
+            # Parse the CoreNLP xml using BeautifulSoup.  If the text was
+            # read, the source (when it is a file) has been used up.
+            self._run_phase('beautiful_soup_parse', 
+                self._beautiful_soup_parse, source if text is None else text)
+            self._run_phase('read_all_sentences', self._read_all_sentences)
 
-        # Parse the CoreNLP xml using BeautifulSoup
-        self._beautiful_soup_parse()
+        if self.hash_sentences and self.sentence_hashes is None:
+            self.sentence_hashes = self._run_phase('hash_sentences', 
+                self._hash_sentences, self._split_sentences(text)[0])
 
-        # Build a Python representation of all the sentences
-        self._read_all_sentences()
+        if self.sentence_filter is not None:
+            self._run_phase('renumber_sentences', self._renumber_sentences)
 
         # Build a dictionary for looking up tokens by their offset.  This is
         # needed when/if reading in the aida file later
-        self.refresh_token_offsets()
+        self._run_phase('refresh_token_offsets', self.refresh_token_offsets)
 
         # build a Python representation of the coreference chains
-        self._build_coreferences()
+        self._run_phase('build_coreferences', self._build_coreferences)
 
         # Link AIDA disambiguations to corresponding coreference chains
-        self._link_references()
+        self._run_phase('link_references', self._link_references)
+
+        # Nothing more is read from the parse tree
+        if not self.keep_soup or self.cycle_free:
+            self._discard_soup()
+
+
+    def _read_stanford_json(self, source):
+        '''
+        Read an article annotated by CoreNLP, from CoreNLP's json output
+        rather than its xml.  This is much cheaper, since there is no 
+        BeautifulSoup tree to build.  `source` can be anything accepted by
+        _read_stanford_xml.  The json is never split among processes, and
+        there is no soup to keep.
+        '''
+        text = read_bytes(source)
+        self.text = text if self.keep_text else None
+        self.soup = None
+
+        data = self._run_phase('json_parse', json.loads, text)
+
+        self._run_phase('read_all_sentences', 
+            self._read_all_json_sentences, data)
+        if self.sentence_filter is not None:
+            self._run_phase('renumber_sentences', self._renumber_sentences)
+        self._run_phase('refresh_token_offsets', self.refresh_token_offsets)
+        self._run_phase('build_coreferences', 
+            self._build_json_coreferences, data)
+        self._run_phase('link_references', self._link_references)
+
+
+    def _read_all_json_sentences(self, data):
+        '''
+        Build the Sentences from the "sentences" list in CoreNLP's json
+        output.  Sentences in the json have 0-based indices, while tokens
+        have 1-based ones.
+        '''
+        self.sentences = []
+        self.tokens = []
+        self.num_sentences = 0
+
+        json_keys = [
+            (field, self.JSON_TOKEN_KEYS[field]) for field in self.token_fields]
+
+        for sentence_data in data.get('sentences', []):
+            sentence_id = sentence_data['index']
+            tokens = [
+                self._make_token(
+                    token_data['index'] - 1,
+                    sentence_id,
+                    dict(
+                        (field, token_data.get(key))
+                        for field, key in json_keys
+                    )
+                )
+                for token_data in sentence_data['tokens']
+            ]
+
+            if not self._keep_sentence(tokens):
+                continue
+
+            # The json parse is pretty-printed over several lines
+            parse_text = sentence_data.get('parse')
+            if parse_text is not None:
+                parse_text = ' '.join(parse_text.split())
+
+            # A governor of 0 marks the root, which becomes -1 once the 
+            # indices are converted to 0-based
+            dependencies = []
+            for key in self.JSON_DEPENDENCY_KEYS[self.dependencies]:
+                if key in sentence_data:
+                    dependencies = [
+                        (dep['dep'], dep['governor'] - 1, 
+                            dep['dependent'] - 1)
+                        for dep in sentence_data[key]
+                    ]
+                    break
+
+            self.num_sentences += 1
+            self.sentences.append(self._build_sentence(
+                sentence_id, tokens, parse_text, dependencies))
+
+        self._count('sentences', self.num_sentences)
+        self._count('tokens', len(self.tokens))
+
+
+    def _build_json_coreferences(self, data):
+        '''
+        Build the coreference chains from the "corefs" in CoreNLP's json
+        output, which maps chain ids to lists of mentions.  Chains are
+        taken in order of their ids.
+        '''
+        corefs = data.get('corefs', {})
+        chains = [
+            [
+                (
+                    mention['sentNum'] - 1,
+                    mention['startIndex'] - 1,
+                    mention['endIndex'] - 1,
+                    mention['headIndex'] - 1,
+                    mention.get('isRepresentativeMention', False)
+                )
+                for mention in corefs[chain_id]
+            ]
+            for chain_id in sorted(corefs, key=int)
+        ]
+
+        self._add_coreferences(chains)
+
+
+    def _discard_soup(self):
+        '''
+        Drop the BeautifulSoup tree.  The tree is full of reference cycles
+        (every element links to its parent and siblings), so it is taken
+        apart first, letting reference counting free it straight away.
+        '''
+        if getattr(self, 'soup', None) is not None:
+            decompose_soup(self.soup)
+        self.soup = None
+
+
+    def break_cycles(self):
+        '''
+        Replace each link that points back up the object graph by a weak
+        proxy, so that the document contains no reference cycles.  The 
+        weakened links are a token's governors (in `parents`), its
+        `c_parent` and `mentions`, and a mention's `reference` and 
+        `sentence`; a constituent's `c_parent` is weakened too.  The 
+        downward links (`children`, `c_children`, a mention's `tokens`, 
+        a reference's `mentions`, ...) stay strong, and keep everything 
+        alive for as long as the document is.
+
+        Proxies are used like the objects they point to, and compare equal
+        to them, but they are not the same objects (so test identity with
+        `==` rather than `is`).  The parse tree is discarded, since it is
+        cyclic itself.
+        '''
+        self._discard_soup()
+        self._set_back_links(weakref.proxy)
+        self.cycle_free = True
+
+
+    def _set_back_links(self, wrap):
+        '''
+        Reset every back-link in the document, to `wrap(target)`.  The 
+        targets are found by walking the downward links, so this can turn
+        weak links back into strong ones, as well as the reverse.
+        '''
+        for sentence in self.sentences:
+            tokens = sentence['tokens']
+            for token in tokens:
+                token['parents'] = [
+                    (dep_type, wrap(tokens[governor['id']]))
+                    for dep_type, governor in token['parents']
+                ]
+                token['mentions'] = []
+
+            if 'c_root' in sentence:
+                nodes = [sentence['c_root']]
+                while nodes:
+                    node = nodes.pop()
+                    for child in node['c_children']:
+                        child['c_parent'] = wrap(node)
+                        nodes.append(child)
+
+        for reference in self.references:
+            for mention in reference['mentions']:
+                mention['reference'] = wrap(reference)
+                if 'sentence' in mention:
+                    mention['sentence'] = wrap(
+                        self.sentences[mention['sentence_id']])
+                for token in mention['tokens']:
+                    token['mentions'].append(wrap(mention))
 
 
-    def _beautiful_soup_parse(self):
+    def __setstate__(self, state):
+        self.__dict__.update(state)
 
-        # Before parsing the xml, we have to deal with a glitch in how 
-        # beatiful soup parses xml: it doesn't allow <head></head> tags, 
-        # which do appear in CoreNLP output.  Work around this by converting
-        # these into <headword> tags instead.
-        head_replacer =  re.compile(r'(?P<open_tag></?)\s*head\s*>')  
-        self.text = head_replacer.sub('\g<open_tag>headword>', self.text)
+        # Unpickled labels are fresh copies
+        if state.get('intern_labels') and hasattr(self, 'sentences'):
+            self._intern_labels(self.sentences)
 
-        # Parse the xml
-        self.soup = Soup(self.text, 'html.parser')
+        if state.get('cycle_free') and hasattr(self, 'sentences'):
+            self._set_back_links(weakref.proxy)
+
+
+    def _intern_labels(self, sentences):
+        '''
+        Replace the labels in `sentences` by their shared copies from the 
+        label vocabularies.
+        '''
+        pos = VOCABULARIES['pos'].intern
+        ner = VOCABULARIES['ner'].intern
+        dep = VOCABULARIES['dep'].intern
+        c_tag = VOCABULARIES['c_tag'].intern
+
+        for sentence in sentences:
+            for token in sentence['tokens']:
+                if 'pos' in token:
+                    token['pos'] = pos(token['pos'])
+                if 'ner' in token:
+                    token['ner'] = ner(token['ner'])
+                token['parents'] = [
+                    (dep(dep_type), governor)
+                    for dep_type, governor in token['parents']
+                ]
+                token['children'] = [
+                    (dep(dep_type), child)
+                    for dep_type, child in token['children']
+                ]
+
+            # Constituents include the tokens, which are the leaves
+            if 'c_root' in sentence:
+                nodes = [sentence['c_root']]
+                while nodes:
+                    node = nodes.pop()
+                    node['c_tag'] = c_tag(node['c_tag'])
+                    nodes.extend(node['c_children'])
+
+
+    def _run_phase(self, name, method, *args):
+        '''
+        Run one phase of construction, reporting its duration if 
+        instrumentation was requested.
+        '''
+        if self.instrumentation is None:
+            return method(*args)
+
+        start = time.time()
+        result = method(*args)
+        self.instrumentation.phase(name, time.time() - start)
+        return result
+
+
+    def _count(self, name, amount=1):
+        '''
+        Report a counter if instrumentation was requested.
+        '''
+        if self.instrumentation is not None:
+            self.instrumentation.count(name, amount)
+
+
+    def _beautiful_soup_parse(self, source):
+
+        # Parse the xml, one chunk at a time.  Note that we have to deal 
+        # with a glitch in how beatiful soup parses xml: it doesn't allow
+        # <head></head> tags, which do appear in CoreNLP output.  The parser
+        # works around this by converting these into <headword> tags.
+        self.soup = parse_soup(source)
+
+
+    def _read_sentences_in_parallel(self, text):
+        '''
+        Split the <sentence> elements into contiguous ranges, and parse each
+        range in a worker process.  The resulting sentences are stitched 
+        back together in their original order.  Only the remainder of the
+        document (i.e. the coreference section) is parsed into `self.soup`.
+        '''
+        self.sentences = []
+        self.tokens = []
+        self.num_sentences = 0
+
+        sentence_xmls, remainder = self._split_sentences(text)
+
+        # Split the sentences into one contiguous range per process
+        range_size = max(1, -(-len(sentence_xmls) // self.processes))
+        ranges = [
+            ''.join(sentence_xmls[i:i+range_size])
+            for i in range(0, len(sentence_xmls), range_size)
+        ]
+
+        # These are the options that affect how sentences are read
+        options = {
+            'dependencies': self.dependencies,
+            'exclude_ordinal_NERs': self.exclude_ordinal_NERs,
+            'initial_offset': self.initial_offset,
+            'sentence_filter': self.sentence_filter,
+            'token_fields': self.token_fields,
+            'intern_labels': self.intern_labels,
+        }
+
+        # Parse the ranges in worker processes, and stitch them together
+        if len(ranges) > 0:
+            pool = Pool(min(self.processes, len(ranges)))
+            try:
+                instrumented = self.instrumentation is not None
+                results = pool.map(_read_sentence_range, [
+                    (options, r, instrumented) for r in ranges])
+            finally:
+                pool.close()
+                pool.join()
+
+            for sentences, collector in results:
+
+                # Pass along the counts made in the worker
+                if collector is not None:
+                    for name, amount in collector.counters.items():
+                        self._count(name, amount)
+
+                # Labels sent back from the workers are fresh copies
+                if self.intern_labels:
+                    self._intern_labels(sentences)
+
+                for sentence in sentences:
+                    self.num_sentences += 1
+                    self.sentences.append(sentence)
+                    self.tokens.extend(sentence['tokens'])
+
+        # The rest of the document is still needed to read coreferences
+        self.soup = parse_soup(remainder)
+
+
+    def _split_sentences(self, text):
+        '''
+        Find the text of the <sentence> elements, and the rest of the 
+        document (i.e. the coreference section).  Tolerate an article 
+        having no sentences.
+        '''
+        sentences_block = MATCH_SENTENCES_BLOCK.search(text)
+        if sentences_block is None:
+            return [], text
+
+        sentence_xmls = MATCH_SENTENCE_ELEMENT.findall(
+            sentences_block.group(1))
+        remainder = (
+            text[:sentences_block.start()] + text[sentences_block.end():])
+        return sentence_xmls, remainder
+
+
+    def _hash_sentences(self, sentence_xmls):
+        '''
+        Hash the text of each <sentence> element.  An element includes its
+        sentence's id and character offsets, so equal hashes mean the 
+        sentence can be reused as it is.
+        '''
+        return [
+            hashlib.sha1(
+                xml.encode('utf8') if isinstance(xml, unicode) else xml
+            ).hexdigest()
+            for xml in sentence_xmls
+        ]
+
+
+    def _check_previous(self, previous):
+        '''
+        Make sure that sentences can be taken over from `previous`: they 
+        must have been read in the same way as this document's.
+        '''
+        if getattr(previous, 'sentence_hashes', None) is None:
+            raise ValueError(
+                'The previous document must have been read with '
+                'hash_sentences=True.'
+            )
+        filtered = (
+            self.sentence_filter is not None 
+            or previous.source_sentence_ids is not None
+        )
+        if self.input_format != 'xml' or filtered:
+            raise ValueError(
+                'Sentences can only be reused when reading xml without a '
+                'sentence_filter.'
+            )
+        for option in [
+            'dependencies', 'exclude_ordinal_NERs', 'initial_offset',
+            'token_fields'
+        ]:
+            if getattr(previous, option) != getattr(self, option):
+                raise ValueError(
+                    'The previous document was read with a different %s.'
+                    % option
+                )
+
+
+    def _read_changed_sentences(self, text, previous):
+        '''
+        Build the sentences of a new version of the `previous` document, 
+        taking over the sentences whose <sentence> element is unchanged,
+        and parsing the others.  The rest of the document (i.e. the 
+        coreference section) is parsed into `self.soup`.
+        '''
+        self.sentences = []
+        self.tokens = []
+        self.num_sentences = 0
+
+        sentence_xmls, remainder = self._split_sentences(text)
+        self.sentence_hashes = self._hash_sentences(sentence_xmls)
+        previous_sentences = dict(
+            zip(previous.sentence_hashes, previous.sentences))
+
+        for sentence_xml, sentence_hash in zip(
+            sentence_xmls, self.sentence_hashes
+        ):
+            sentence = previous_sentences.pop(sentence_hash, None)
+            if sentence is not None:
+                self._reset_sentence(sentence)
+                self.tokens.extend(sentence['tokens'])
+                self._count('reused_sentences')
+            else:
+                soup = parse_soup(sentence_xml)
+                sentence = self._read_sentence(soup.find('sentence'))
+                decompose_soup(soup)
+
+            self.num_sentences += 1
+            self.sentences.append(sentence)
+
+        self._count('sentences', self.num_sentences)
+        self._count('tokens', len(self.tokens))
+
+        self.soup = parse_soup(remainder)
+
+
+    def _reset_sentence(self, sentence):
+        '''
+        Remove the document-level links from a sentence that is taken over
+        from a previous version of the document.  Its entities are rebuilt,
+        since AIDA links and references are attached to them.
+        '''
+        sentence['mentions'] = []
+        sentence['references'] = []
+        for token in sentence['tokens']:
+            token['mentions'] = []
+        if 'ner' in self.token_fields:
+            sentence['entities'] = self._read_entities(sentence['tokens'])
 
 
     def _read_all_sentences(self):
@@ -148,18 +867,42 @@ class AnnotatedText(object):
 
         # Process each sentence tag
         for s in sent_tags:
+            sentence = self._read_sentence(s)
+            if sentence is None:
+                continue
             self.num_sentences += 1
-            self.sentences.append(self._read_sentence(s))
+            self.sentences.append(sentence)
+
+        self._count('sentences', self.num_sentences)
+        self._count('tokens', len(self.tokens))
 
 
     def _read_aida_json(self, json_string):
 
-        # Parse the json
-        aida_data = json.loads(json_string)
+        # Parse the json, which may be compressed, or still in a file
+        aida_data = json.loads(read_bytes(json_string))
+
+        # If sentences were filtered, AIDA mentions are only linked if they
+        # start within a kept sentence
+        sentence_spans = None
+        if self.source_sentence_ids is not None:
+            sentence_spans = [
+                (
+                    s['tokens'][0]['character_offset_begin'],
+                    s['tokens'][-1]['character_offset_end']
+                )
+                for s in self.sentences if s['tokens']
+            ]
+            sentence_starts = [begin for begin, end in sentence_spans]
 
         # Tie each mention disambiguated by aida to a corresponding mention
         # in the stanford output
         for aida_mention in aida_data['mentions']:
+            if sentence_spans is not None:
+                i = bisect_right(sentence_starts, aida_mention['offset']) - 1
+                if i < 0 or aida_mention['offset'] >= sentence_spans[i][1]:
+                    self._count('filtered_aida_mentions')
+                    continue
             self._link_aida_mention(aida_mention, aida_data)
 
         # For each referenece (group of mentions believed to refer to the
@@ -346,37 +1089,41 @@ class AnnotatedText(object):
         # range), then *create* a mention and reference with those tokens
         sentence_id = found_tokens[0]['sentence_id']
         sentence = self.sentences[sentence_id]
-        new_mention = {
-            'tokens': found_tokens,
-            'start': min([t['id'] for t in found_tokens]),
-            'end': max([t['id'] for t in found_tokens]),
-            'head': self.find_head(found_tokens),
-            'sentence_id': sentence_id,
-            'sentence': sentence
-        }
-        ref = {
+
+        # The tokens are consecutive, so unless they run past the end of the
+        # sentence, the mention can be a view onto the sentence's tokens
+        if found_tokens[-1]['sentence_id'] == sentence_id:
+            new_mention = Mention.span(
+                sentence['tokens'], sentence_id, found_tokens[0]['id'],
+                found_tokens[-1]['id']
+            )
+        else:
+            new_mention = Mention({
+                'tokens': found_tokens,
+                'start': min([t['id'] for t in found_tokens]),
+                'end': max([t['id'] for t in found_tokens]),
+                'sentence_id': sentence_id,
+            })
+        new_mention['head'] = self.find_head(found_tokens)
+        new_mention['sentence'] = sentence
+        ref = Reference({
             'id': self._get_next_coref_id(),
             'mentions': [new_mention],
             'representative': new_mention
-        }
+        })
         new_mention['reference'] = ref
         self.references.append(ref)
+        self._count('aida_created_mentions')
 
-        # Add the mention to the sentence
-        try:
-            sentence['mentions'].append(new_mention)
-        except KeyError:
-            sentence['mentions'] = [new_mention]
-
-        # Add the mention to the tokens involved
+        # Add the mention to the sentence and to the tokens involved, and
+        # the reference to the sentence
+        sentence['mentions'].append(new_mention)
         for token in found_tokens:
             token['mentions'].append(new_mention)
+        sentence['references'].append(ref)
 
-        # Add the reference to the sentence
-        try:
-            sentence['references'].append(ref)
-        except KeyError:
-            sentence['references'] = [ref]
+        # The coreference index no longer covers all the references
+        self._coreference_index = None
 
         return new_mention
 
@@ -391,8 +1138,8 @@ class AnnotatedText(object):
             except KeyError:
                 pointer += 1
 
-                # But if we reach the end of the text it's an error
-                if pointer > len(self.text):
+                # But if we pass the last token it's an error
+                if pointer > self.last_token_offset:
                     raise
 
         return token
@@ -426,89 +1173,52 @@ class AnnotatedText(object):
                 for token in mention['tokens']:
                     token['mentions'].append(mention)
 
-                # note the extent of the mention
-                mention['start'] = min(
-                    [t['id'] for t in mention['tokens']])
-                mention['end'] = max([t['id'] for t in mention['tokens']])
-
                 # link the sentence to the mention
-                mention_sentence_id = mention['tokens'][0]['sentence_id']
-                sentence = self.sentences[mention_sentence_id]
-                try:
-                    sentence['mentions'].append(mention)
-                except KeyError:
-                    sentence['mentions'] = [mention]
+                self.sentences[mention['sentence_id']]['mentions'].append(
+                    mention)
 
             # Get all the sentences (by id) for a given reference
             ref_sentence_ids = set([
-                token['sentence_id']
-                for mention in ref['mentions']
-                for token in mention['tokens']
-            ])
+                mention['sentence_id'] for mention in ref['mentions']])
 
             # link the sentence to the references
-            for s_id in ref_sentence_ids:
-                sentence = self.sentences[s_id]
-                try:
-                    sentence['references'].append(ref)
-                except KeyError:
-                    sentence['references'] = [ref]
+            for s_id in sorted(ref_sentence_ids):
+                self.sentences[s_id]['references'].append(ref)
 
 
-    def _standardize_coreferencing(self):
-
-        # Generate an identifying signature for each NER entity, which
-        # will be used to cros-reference with coreference mentions.
-        all_ner_signatures = set()
-        ner_entity_lookup = {}
-        for s in self.sentences:
-            for entity in s['entities']:
-
-                # the sentence id and id of the entity's head token 
-                # uniquely identifies it, and is hashable
-                entity_signature = (
-                    entity['sentence_id'],     # idx of the sentence
-                    entity['head']['id'],    # idx of entity's head token
-                )
-                all_ner_signatures.add(entity_signature)
-
-                # keep a link back to the entity based on its signature
-                ner_entity_lookup[entity_signature] = entity
-
-        # Generate an identifying signature for each coreference and for
-        # each mention.  We will then be able to cross-reference the 
-        # coreference chains / mentions and the entities
-        all_coref_signatures = set()
-        coref_entity_lookup = {}
-        all_mention_signatures = set()
-        all_coref_tokens = set()
-        for coref in self.coreferences:
+    @property
+    def coreference_index(self):
+        '''
+        A CoreferenceIndex of the links between this document's tokens,
+        mentions, and references, built the first time it is needed.
+        '''
+        if getattr(self, '_coreference_index', None) is None:
+            self._coreference_index = CoreferenceIndex(
+                self.sentences, self.references)
+        return self._coreference_index
 
-            coref_signature = (
-                coref['representative']['sentence_id'],
-                coref['representative']['head']['id'],
-            )
 
-            coref_entity_lookup[coref_signature] = coref
-            all_coref_signatures.add(coref_signature)
+    def _standardize_coreferencing(self):
 
+        # Mark the tokens covered by coreference mentions, using one compact
+        # array per sentence.  These will be used to find the NER entities
+        # that aren't yet among the coreference mentions.
+        covered = [bytearray(len(s['tokens'])) for s in self.sentences]
+        for coref in self.coreferences:
             for mention in coref['mentions']:
-
-                all_coref_tokens.update([
-                    (mention['sentence_id'], t['id'])
-                    for t in mention['tokens']
-                ])
-
-                all_mention_signatures.add((
-                    mention['sentence_id'],
-                    mention['head']['id'],
-                ))
-
-        # get the ner signatures which aren't yet among the coref mentions
-        novel_ner_signatures = all_ner_signatures - all_coref_tokens
-
-        # get the coref signatures that are actual ners
-        valid_coref_signatures = all_coref_signatures & all_ner_signatures
+                start, end = mention['start'], mention['end']
+                if end >= start:
+                    covered[mention['sentence_id']][start:end+1] = (
+                        '\x01' * (end + 1 - start))
+
+        # The sentence id and id of an entity's head token uniquely 
+        # identify it, so they are used as a signature to cross-reference
+        # coreference chains with NER entities.
+        entity_signatures = set(
+            (entity['sentence_id'], entity['head']['id'])
+            for sentence in self.sentences
+            for entity in sentence['entities']
+        )
 
         # In some cases, we want "coreferences" to mean only coreference
         # chains whose representative mention is a NER.  Otherwise,
@@ -516,71 +1226,119 @@ class AnnotatedText(object):
         # example, refer to an entity mentioned several times using a
         # common noun (e.g. "the police").
         if self.exclude_non_ner_coreferences:
+
+            # Where several chains have the same representative, the last
+            # one is kept
+            chains_by_signature = {}
+            for coref in self.coreferences:
+                signature = (
+                    coref['representative']['sentence_id'],
+                    coref['representative']['head']['id'],
+                )
+                if signature in entity_signatures:
+                    chains_by_signature[signature] = coref
+
+            kept = set(id(coref) for coref in chains_by_signature.values())
             self.references = [
-                coref_entity_lookup[es] for es in valid_coref_signatures
-            ]
+                coref for coref in self.coreferences if id(coref) in kept]
+
         else:
             self.references = [coref for coref in self.coreferences]
 
         # build the ners not yet among the corefs into same structure as 
-        # corefs
-        for signature in novel_ner_signatures:
-            entity = ner_entity_lookup[signature]
-            self.references.append({
-                'id':self._get_next_coref_id(),
-                'mentions': [entity],
-                'representative': entity
-            })
+        # corefs, in the order they appear in the document
+        for sentence_id, sentence in enumerate(self.sentences):
+            for entity in sentence['entities']:
+                if covered[sentence_id][entity['head']['id']]:
+                    continue
+                self.references.append(Reference({
+                    'id':self._get_next_coref_id(),
+                    'mentions': [entity],
+                    'representative': entity
+                }))
 
 
     def _build_coreferences(self):
 
-        self.coreferences = []
-
         coref_tag_container = self.soup.find('coreference')
         if coref_tag_container is None:
             coreference_tags = []
         else:
             coreference_tags = coref_tag_container.find_all('coreference')
 
-        for ctag in coreference_tags:
+        # Recall that we convert 1-based ids to 0-based
+        chains = [
+            [
+                (
+                    int(mention_tag.find('sentence').text) - 1,
+                    int(mention_tag.find('start').text) - 1,
+                    int(mention_tag.find('end').text) - 1,
+                    int(mention_tag.find('headword').text) - 1,
+                    'representative' in mention_tag.attrs
+                )
+                for mention_tag in ctag.find_all('mention')
+            ]
+            for ctag in coreference_tags
+        ]
+
+        self._add_coreferences(chains)
+
+
+    def _add_coreferences(self, chains):
+        '''
+        Build the coreference chains.  Each chain is a list of mentions,
+        given as (sentence_id, start, end, head, is_representative), with
+        0-based indices, and `end` being one past the mention's last token.
+        This is shared by the xml and json readers.
+        '''
+        self.coreferences = []
+
+        # If sentences were filtered, mentions' sentence ids need to be
+        # mapped onto the kept sentences
+        kept_sentence_ids = None
+        if self.source_sentence_ids is not None:
+            kept_sentence_ids = dict(
+                (source_id, sentence_id) for sentence_id, source_id
+                in enumerate(self.source_sentence_ids)
+            )
 
-            coreference = {
+        for chain in chains:
+
+            coreference = Reference({
                 'id': self._get_next_coref_id(),
                 'mentions':[],
-            }
+            })
 
             # Process each mention in this coreference chain
-            for mention_tag in ctag.find_all('mention'):
+            for sentence_id, start, end, head, is_representative in chain:
 
-                # Recall that we convert 1-based ids to 0-based
-                sentence_id = int(mention_tag.find('sentence').text) - 1
-                sentence = self.sentences[sentence_id]
-                start = int(mention_tag.find('start').text) - 1
-                end = int(mention_tag.find('end').text) - 1
-                head = int(mention_tag.find('headword').text) - 1
+                # Drop mentions in sentences that were filtered out
+                if kept_sentence_ids is not None:
+                    if sentence_id not in kept_sentence_ids:
+                        continue
+                    sentence_id = kept_sentence_ids[sentence_id]
 
-                mention = {
-                    'sentence_id': sentence_id,
-                    'tokens': sentence['tokens'][start:end],
-                    'head': sentence['tokens'][head]
-                }
+                sentence = self.sentences[sentence_id]
+                mention = Mention.span(
+                    sentence['tokens'], sentence_id, start, end - 1)
+                mention['head'] = sentence['tokens'][head]
 
                 # Long mentions are typically nonsense
                 do_exclude = (
                     self.exclude_long_mentions and 
-                    len(mention['tokens']) > self.long_mention_threshold
+                    end - start > self.long_mention_threshold
                 )
                 if do_exclude:
                     continue
 
-                if 'representative' in mention_tag.attrs:
+                if is_representative:
                     coreference['representative'] = mention
 
                 coreference['mentions'].append(mention)
 
             # if there's no mentions left in the coreference, don't keep it
-            # (this can happen if we are excluding long mentions.)
+            # (this can happen if we are excluding long mentions, or 
+            # filtering sentences.)
             if len(coreference['mentions']) < 1:
                 continue
 
@@ -619,7 +1377,7 @@ class AnnotatedText(object):
         depth += 1
         if 'children' in root_token:
             for relation, child in root_token['children']:
-                print '  '*depth + relation + ' ' + child['word']
+                print '  '*depth + relation + ' ' + child.get('word', '_')
                 self.print_dep_tree(child, depth)
 
 
@@ -637,24 +1395,79 @@ class AnnotatedText(object):
 
     def _read_sentence(self, sentence_tag):
         '''
-        Convert sentence tags to python dictionaries.
+        Convert sentence tags to python dictionaries.  Returns None if the
+        sentence is rejected by `sentence_filter`.
         '''
+        tokens = self._read_tokens(sentence_tag)
+        if not self._keep_sentence(tokens):
+            return None
+
         # Note that CoreNLP uses 1-based indexing for sentence ids.  We
         # convert to 0-based indexing.
+        return self._build_sentence(
+            int(sentence_tag['id']) - 1,
+            tokens,
+            self._read_constituency_parse(sentence_tag),
+            self._read_dependencies(sentence_tag)
+        )
+
+
+    def _keep_sentence(self, tokens):
+        '''
+        Decide whether to keep the sentence made of `tokens`, which have 
+        only been read so far.
+        '''
+        if self.sentence_filter is None or self.sentence_filter(tokens):
+            return True
+        self._count('filtered_sentences')
+        return False
+
+
+    def _renumber_sentences(self):
+        '''
+        Once sentences have been filtered, give the kept sentences 
+        consecutive ids, so that a sentence's id is still its position in
+        `sentences`.  The ids they had in CoreNLP's output are kept in 
+        `source_sentence_ids`.
+        '''
+        self.source_sentence_ids = [s['id'] for s in self.sentences]
+        for sentence_id, sentence in enumerate(self.sentences):
+            if sentence['id'] == sentence_id:
+                continue
+            sentence['id'] = sentence_id
+            for token in sentence['tokens']:
+                token['sentence_id'] = sentence_id
+            for entity in sentence['entities']:
+                entity['sentence_id'] = sentence_id
+
+
+    def _build_sentence(self, sentence_id, tokens, parse_text, dependencies):
+        '''
+        Assemble a Sentence from its tokens, the serialized constituency
+        parse (or None, if there isn't one), and the dependency edges, as
+        (dep_type, governor_idx, dependent_idx) using 0-based indices, 
+        where a governor_idx of -1 marks the root.  This is shared by the
+        xml and json readers.
+        '''
         sentence =  Sentence({
-            'id': int(sentence_tag['id']) - 1,
-            'tokens': self._read_tokens(sentence_tag),
+            'id': sentence_id,
+            'tokens': tokens,
             'root': Token(),
         })
 
         # Build the constituency parse
-        self._read_constituency_parse(sentence, sentence_tag)
+        # Assign the root node to 'croot' (for 'constituency root')
+        if parse_text is not None:
+            sentence['c_root'], ptr = self._recursive_parse(
+                parse_text, sentence
+            )
 
         # Give the tokens the dependency tree relation
-        self._read_dependencies(sentence, sentence_tag)
+        self._add_dependencies(sentence, dependencies)
 
         # Group the named entities together, and find the headword within
-        sentence['entities'] = self._read_entities(sentence['tokens'])
+        if 'ner' in self.token_fields:
+            sentence['entities'] = self._read_entities(sentence['tokens'])
 
         # Add tokens to global list and to the token offset-lookup table
         # Exclude the "null" tokens that simulate sentence head.
@@ -663,17 +1476,166 @@ class AnnotatedText(object):
         return sentence
 
 
+    def _assemble_sentence(self, sentence_id, tokens, edges, nodes):
+        '''
+        Assemble a Sentence from stored parts, rather than from CoreNLP's
+        output (see the document_store and columnar modules).  `tokens`
+        are (token_id, values) pairs, where values is a dict of the
+        `token_fields`, as they are held in Tokens.  `edges` are the
+        dependency edges, as (governor_id, dependent_id, relation), in the
+        order of the governors' children, where a governor_id of -1 marks
+        the root.  `nodes` are the nodes of the constituency parse in
+        pre-order, as (parent_id, tag, depth, token_id), where parent_id is
+        the position of the parent node (-1 for the root), and token_id is
+        None for the non-terminal nodes.
+        '''
+        token_list = []
+        for token_id, values in tokens:
+            token = Token(values)
+            token['id'] = token_id
+            token['sentence_id'] = sentence_id
+            token['children'] = []
+            token['parents'] = []
+            token['mentions'] = []
+            token_list.append(token)
+
+        sentence = Sentence({
+            'id': sentence_id,
+            'tokens': token_list,
+            'root': Token(),
+        })
+
+        for governor_id, dependent_id, relation in edges:
+            dependent = token_list[dependent_id]
+            if governor_id < 0:
+                sentence['root'] = dependent
+                continue
+            governor = token_list[governor_id]
+            governor['children'].append((relation, dependent))
+            dependent['parents'].append((relation, governor))
+
+        # The leaves of the parse are the tokens themselves
+        elements = []
+        for parent_id, tag, depth, token_id in nodes:
+            parent = elements[parent_id] if parent_id >= 0 else None
+            if token_id is None:
+                element = Constituent({'word': None})
+            else:
+                element = token_list[token_id]
+            element['c_tag'] = tag
+            element['c_depth'] = depth
+            element['c_parent'] = parent
+            element['c_children'] = []
+            if parent is not None:
+                parent['c_children'].append(element)
+            elements.append(element)
+        if elements:
+            sentence['c_root'] = elements[0]
+
+        if 'ner' in self.token_fields:
+            sentence['entities'] = self._read_entities(token_list)
+
+        if self.intern_labels:
+            self._intern_labels([sentence])
+
+        return sentence
+
+
+    def _assemble_document(
+        self, sentences, references, has_aida, next_reference_id,
+        source_sentence_ids=None
+    ):
+        '''
+        Assemble a stored document from its `sentences` (see
+        _assemble_sentence) and its `references`.  Each reference is given
+        as (reference_id, is_coreference, kb_identifier, types, mentions),
+        and each of its mentions as (sentence_id, start, end, head_id,
+        is_representative, entity_idx, is_created, aida_link), where
+        entity_idx is the mention's position among its sentence's entities
+        (or None, if it isn't a named entity), is_created tells whether
+        the mention was made to hold an AIDA mention, and aida_link is
+        (kbIdentifier, disambiguationScore, types), or None.
+        '''
+        self.text = None
+        self.soup = None
+        self.sentences = sentences
+        self.num_sentences = len(sentences)
+        self.tokens = [
+            token for sentence in sentences for token in sentence['tokens']]
+        self.refresh_token_offsets()
+        self.next_coref_id = next_reference_id
+        self.source_sentence_ids = source_sentence_ids
+
+        self.references = []
+        self.coreferences = []
+        for reference_id, is_coreference, kb_identifier, types, mentions in (
+            references
+        ):
+            reference = Reference({'id': reference_id, 'mentions': []})
+
+            for (
+                sentence_id, start, end, head_id, is_representative,
+                entity_idx, is_created, aida_link
+            ) in mentions:
+                sentence = sentences[sentence_id]
+                if entity_idx is not None:
+                    mention = sentence['entities'][entity_idx]
+                else:
+                    mention = Mention.span(
+                        sentence['tokens'], sentence_id, start, end)
+                    mention['head'] = (
+                        sentence['tokens'][head_id]
+                        if head_id is not None else None
+                    )
+                if is_created:
+                    mention['sentence'] = sentence
+
+                if aida_link is not None:
+                    (mention['kbIdentifier'], mention['disambiguationScore'],
+                        mention['types']) = aida_link
+
+                if is_representative:
+                    reference['representative'] = mention
+                reference['mentions'].append(mention)
+
+            if kb_identifier is not None:
+                reference['kbIdentifier'] = kb_identifier
+                reference['types'] = types
+
+            self.references.append(reference)
+            if is_coreference:
+                self.coreferences.append(reference)
+
+        if has_aida:
+            self.disambiguated_references = [
+                reference for reference in self.references
+                if 'kbIdentifier' in reference
+            ]
+
+        self._link_references()
+
+
     def refresh_token_offsets(self):
         """
         Sets, or refreshes a dictionary that enables looking up tokens based on
         their character offset in the file.
         """
-        self.tokens_by_offset = {
-            t['character_offset_begin']: t for t in self.tokens}
+        if 'character_offset_begin' not in self.token_fields:
+            self.tokens_by_offset = {}
+        else:
+            self.tokens_by_offset = {
+                t['character_offset_begin']: t for t in self.tokens}
 
+        # No token begins after this offset
+        self.last_token_offset = max(self.tokens_by_offset.keys() or [0])
 
-    def _read_dependencies(self, sentence, sentence_tag):
 
+    def _read_dependencies(self, sentence_tag):
+        '''
+        Read the edges of the chosen kind of dependency parse, as 
+        (dep_type, governor_idx, dependent_idx), converting CoreNLP's 
+        1-based indices to 0-based ones.
+        '''
         if self.dependencies == 'collapsed-ccprocessed':
             dependencies_type = 'collapsed-ccprocessed-dependencies'
         elif self.dependencies == 'collapsed':
@@ -690,12 +1652,36 @@ class AnnotatedText(object):
             'dependencies', type=dependencies_type
         ).find_all('dep')
 
-        for dep in dependencies:
+        return [
+            (
+                dep['type'],
+                int(dep.find('governor')['idx']) - 1,
+                int(dep.find('dependent')['idx']) - 1
+            )
+            for dep in dependencies
+        ]
 
-            dependent_idx = int(dep.find('dependent')['idx']) - 1
-            dependent = sentence['tokens'][dependent_idx]
 
-            governor_idx = int(dep.find('governor')['idx']) - 1
+    def _add_dependencies(self, sentence, dependencies):
+        '''
+        Link the tokens of `sentence` according to the `dependencies`
+        edges (see _build_sentence).
+        '''
+
+        # Tallied for instrumentation
+        num_edges = 0
+        num_rejected_edges = 0
+
+        if self.intern_labels:
+            intern_dep = VOCABULARIES['dep'].intern
+            dependencies = [
+                (intern_dep(dep_type), governor_idx, dependent_idx)
+                for dep_type, governor_idx, dependent_idx in dependencies
+            ]
+
+        for dep_type, governor_idx, dependent_idx in dependencies:
+
+            dependent = sentence['tokens'][dependent_idx]
 
             # When the governor idx is -1, it means that the dependent
             # token is the root of the sentence.  Simply mark it as such
@@ -712,12 +1698,16 @@ class AnnotatedText(object):
 
             # refuse to add a link which would create a cycle 
             if governor_idx in self.collect_descendents(dependent):
+                num_rejected_edges += 1
                 continue
 
-            dep_type = dep['type']
-        
             governor['children'].append((dep_type, dependent))
             dependent['parents'].append((dep_type, governor))
+            num_edges += 1
+
+        if self.instrumentation is not None:
+            self._count('dependency_edges', num_edges)
+            self._count('cycle_rejected_edges', num_rejected_edges)
 
 
     def collect_descendents(self, token):
@@ -734,20 +1724,15 @@ class AnnotatedText(object):
             
 
 
-    def _read_constituency_parse(self, sentence, sentence_tag):
+    def _read_constituency_parse(self, sentence_tag):
 
         # Try to get the serialized sentence parse. If it's not there,
-        # then fail (it means CoreNLP was run without that annotator).
+        # then return None (it means CoreNLP was run without that 
+        # annotator).
         try:
-            parse_text = sentence_tag.find('parse').text
+            return sentence_tag.find('parse').text
         except AttributeError:
-            return 
-
-        # Recursively parse the constituency tree serialization
-        # Assign the root node to 'croot' (for 'constituency root')
-        sentence['c_root'], ptr = self._recursive_parse(
-            parse_text, sentence
-        )
+            return None
 
 
     def _recursive_parse(
@@ -760,10 +1745,13 @@ class AnnotatedText(object):
     ):
 
         # Initialize a constitency tree node
-        element = {'c_depth':depth, 'c_parent':parent, 'c_children':[]}
+        element = Constituent(
+            {'c_depth':depth, 'c_parent':parent, 'c_children':[]})
 
         # get the phrase or POS code
         element['c_tag'] = self.MATCH_TAG.match(parse_text).groups()[0]
+        if self.intern_labels:
+            element['c_tag'] = VOCABULARIES['c_tag'].intern(element['c_tag'])
 
         # get the inner text
         inner_text = self.MATCH_TAG.sub('', parse_text)
@@ -992,7 +1980,7 @@ class AnnotatedText(object):
                     cur_entity = None
 
             elif token['ner'] == last_entity_type:
-                cur_entity['tokens'].append(token)
+                cur_entity['end'] = token['id']
                 token['entity_idx'] = entity_idx
 
             else:
@@ -1002,10 +1990,10 @@ class AnnotatedText(object):
                     cur_entity = None
 
                 entity_idx += 1
-                cur_entity = {
-                    'tokens':[token], 
-                    'sentence_id': int(token['sentence_id'])
-                }
+                cur_entity = Mention.span(
+                    tokens, int(token['sentence_id']), token['id'], 
+                    token['id']
+                )
                 token['entity_idx'] = entity_idx
 
             last_entity_type = token['ner']
@@ -1067,42 +2055,52 @@ class AnnotatedText(object):
         # We convert to 0-based indices.
         sentence_id = int(sentence_tag['id']) - 1
 
+        # Only look for the tags of the fields being read
+        xml_tags = [
+            (field, self.XML_TOKEN_TAGS[field]) for field in self.token_fields]
+
         tokens = []
         for token_tag in sentence_tag.find_all('token'):
 
-            # The "Speaker" property can be missing, so handle that case
-            if token_tag.find('Speaker') is not None:
-                speaker = token_tag.find('Speaker').text
-            else:
-                speaker = None
-
-            # Get rest of the token's properties and make a Token object
-            token = Token({
-                'id': int(token_tag['id']) - 1,
-                'sentence_id': sentence_id,
-                'word': self.fix_word(token_tag.find('word').text),
-                'lemma': token_tag.find('lemma').text,
-                'pos': token_tag.find('pos').text,
-                'ner': (
-                    None if token_tag.find('ner').text == 'O' 
-                    else token_tag.find('ner').text),
-                'character_offset_begin': self._get_offset(
-                    token_tag, 'characteroffsetbegin'),
-                'character_offset_end': self._get_offset(
-                    token_tag, 'characteroffsetend'),
-                'speaker': speaker,
-                'children': [],
-                'parents': [],
-                'mentions': []
-            })
+            # Get the token's properties and make a Token object.  Some, 
+            # like "Speaker", can be missing.
+            values = {}
+            for field, tag_name in xml_tags:
+                tag = token_tag.find(tag_name)
+                values[field] = tag.text if tag is not None else None
 
-            tokens.append(token)
+            tokens.append(self._make_token(
+                int(token_tag['id']) - 1, sentence_id, values))
 
         return tokens
 
 
-    def _get_offset(self, token_tag, tagname):
-        return int(token_tag.find(tagname).text) + self.initial_offset
+    def _make_token(self, token_id, sentence_id, values):
+        '''
+        Make a Token, given its id, its sentence's id (already converted to
+        0-based indices), and a dict of the `token_fields` being read, as
+        they appear in CoreNLP's output.
+        '''
+        token = Token(values)
+        token['id'] = token_id
+        token['sentence_id'] = sentence_id
+        token['children'] = []
+        token['parents'] = []
+        token['mentions'] = []
+
+        if 'word' in token:
+            token['word'] = self.fix_word(token['word'])
+        if token.get('ner') == 'O':
+            token['ner'] = None
+        if self.intern_labels:
+            for field in ['pos', 'ner']:
+                if field in token:
+                    token[field] = VOCABULARIES[field].intern(token[field])
+        for field in self.OFFSET_FIELDS:
+            if field in token:
+                token[field] = int(token[field]) + self.initial_offset
+
+        return token
 
 
     def fix_word(self, word):
@@ -1114,10 +2112,22 @@ class AnnotatedText(object):
         return word#.encode('utf8').decode('unicode-escape')
 
 
+    def memory_report(
+        self, large_object_threshold=DEFAULT_LARGE_OBJECT_THRESHOLD
+    ):
+        '''
+        Approximate the bytes used by each layer of this document (tokens,
+        constituency, dependencies, mentions, etc.), and flag large 
+        objects that stay alive along with it, such as `self.soup`.  See
+        memory.memory_report().
+        '''
+        return memory_report(self, large_object_threshold)
+
+
     def __str__(self):
         sentence_strings = []
         for i, s in enumerate(self.sentences):
-            tokens = ' '.join([t['word'] for t in s['tokens']])
+            tokens = s.as_string()
             sentence_string = 'Sentence %d:\n%s' % (i, tokens)
             sentence_strings.append(sentence_string)
 
@@ -1129,7 +2139,17 @@ class AnnotatedText(object):
 
 
 
-class Sentence(dict):
+class _Referent(object):
+    '''
+    Mixin for the parts of a document that weak links can point to.
+    '''
+
+    def _referent(self):
+        # Called through a weak proxy, this is the object it points to
+        return self
+
+
+class Sentence(dict, _Referent):
 
     def __init__(self, *args, **kwargs):
         super(Sentence, self).__init__(*args, **kwargs)
@@ -1170,7 +2190,7 @@ class Sentence(dict):
         probably lead to unexpected and not-useful behavior for a lot of
         usecases!
         """
-        return id(self) == id(other)
+        return _is_same(self, other)
 
 
     def __ne__(self, other):
@@ -1184,8 +2204,9 @@ class Sentence(dict):
             occurred in the text, but whitespace and certain punctuation get
             normalized.
         '''
-        # note, the first token is a "root token", which has to be skipped
-        return ' '.join([t['word'] for t in self['tokens']])
+        # note, the first token is a "root token", which has to be skipped.
+        # Words that weren't read (see `token_fields`) are shown as "_".
+        return ' '.join([t.get('word', '_') for t in self['tokens']])
 
 
     def __str__(self):
@@ -1271,7 +2292,7 @@ class Sentence(dict):
 
 
     def get_text(self):
-        return ' '.join([t['word'] for t in self['tokens']])
+        return self.as_string()
 
 
     def _dep_tree_str(self, root_token, depth=0):
@@ -1287,18 +2308,23 @@ class Sentence(dict):
         return string
 
 
-class Token(dict):
+class Token(dict, _Referent):
 
     def __str__(self):
 
-        offset = '(%d,%d)' % ( 
-            self['character_offset_begin'], 
-            self['character_offset_end']
-        )
-        ner = self['ner'] if self['ner'] is not None else '-'
+        # Tokens may have been read with only some of their fields
+        if 'character_offset_begin' in self:
+            offset = '(%d,%d)' % ( 
+                self['character_offset_begin'], 
+                self.get('character_offset_end', -1)
+            )
+        else:
+            offset = '(-,-)'
+        ner = self.get('ner') if self.get('ner') is not None else '-'
 
         description = '%2d: %s %s %s %s' % (
-            self['id'], self['word'], offset, self['pos'], ner
+            self['id'], self.get('word', '-'), offset, self.get('pos', '-'),
+            ner
         )
 
         description = description.encode('utf8')
@@ -1309,7 +2335,7 @@ class Token(dict):
         '''
         See the docstring for Sentence.__eq__().
         '''
-        return id(self) == id(other)
+        return _is_same(self, other)
 
 
     def __ne__(self, other):
@@ -1330,3 +2356,77 @@ class Token(dict):
     def get_children(self):
         return self['children'] if 'children' in self else []
 
+
+class _IdentityDict(dict, _Referent):
+    '''
+    Base for the other parts of the object graph, which, like Sentences
+    and Tokens, are equal only to themselves (see Sentence.__eq__()).
+    Unlike plain dicts, they can also be the targets of weak references.
+    '''
+
+    def __eq__(self, other):
+        return _is_same(self, other)
+
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+class Constituent(_IdentityDict):
+    '''
+    A non-terminal node of a constituency parse.  (The terminal nodes are
+    the Tokens themselves.)
+    '''
+
+
+class Mention(_IdentityDict):
+    '''
+    A span of tokens within a sentence that refers to an entity: a 
+    coreference mention, a named entity, or a mention created for an AIDA
+    disambiguation.
+
+    Mentions made with Mention.span() are views onto their sentence's
+    tokens.  They store `sentence_id`, `start` and `end` (the ids of the
+    first and last tokens), and `head`, and `mention['tokens']` is sliced
+    from the sentence when it is asked for, rather than being stored.
+    (So 'tokens' is not among the mention's keys, though `in` and get()
+    do find it.)  Mentions given an explicit list of 'tokens' keep it.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(Mention, self).__init__(*args, **kwargs)
+        self.sentence_tokens = None
+
+
+    @classmethod
+    def span(cls, sentence_tokens, sentence_id, start, end):
+        '''
+        Make a mention covering `sentence_tokens[start:end+1]`.
+        '''
+        mention = cls({'sentence_id': sentence_id, 'start': start, 'end': end})
+        mention.sentence_tokens = sentence_tokens
+        return mention
+
+
+    def __missing__(self, key):
+        if key == 'tokens' and self.sentence_tokens is not None:
+            return self.sentence_tokens[self['start']:self['end'] + 1]
+        raise KeyError(key)
+
+
+    def __contains__(self, key):
+        if key == 'tokens' and self.sentence_tokens is not None:
+            return True
+        return dict.__contains__(self, key)
+
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+
+class Reference(_IdentityDict):
+    '''
+    A group of mentions believed to refer to the same entity.
+    '''
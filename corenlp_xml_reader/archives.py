@@ -0,0 +1,183 @@
+'''
+Reading corpora straight out of tar and zip archives, without extracting
+them.  CoreNLP members are named "<article-id>.xml" and AIDA members
+"<article-id>.json" (either can carry a compression extension, like
+".gz"), and may sit in any directory within the archive.  Members are
+paired by article id, and the CoreNLP and AIDA members can be in the same
+archive or in two separate ones.
+
+Archives are read sequentially, in a single pass, so tar archives can be
+streamed (including compressed tarballs, and pipes).  To parse in
+parallel, the reading thread hands documents to a pool of workers:
+
+    for article_id, article in iter_archive('corpus.tar.gz', workers=8):
+        ...
+'''
+
+from collections import OrderedDict
+import os
+import tarfile
+import zipfile
+from corpus import CorpusLoader, split_article_id
+
+
+# How many members can be held waiting for their partner, by default
+DEFAULT_MAX_PENDING = 100
+
+
+def iter_archive_members(archive):
+    '''
+    Yield (name, content) for each file in `archive`, in the order they
+    are stored.  `archive` can be the path of a zip file or of a (possibly
+    compressed) tar file, or a file object holding a tar stream.
+    '''
+    is_path = isinstance(archive, basestring)
+
+    if is_path and zipfile.is_zipfile(archive):
+        zip_file = zipfile.ZipFile(archive)
+        try:
+            for info in zip_file.infolist():
+                if not info.filename.endswith('/'):
+                    yield info.filename, zip_file.read(info)
+        finally:
+            zip_file.close()
+        return
+
+    # Open the tar file in streaming mode, so that it is read in one pass
+    if is_path:
+        tar_file = tarfile.open(archive, mode='r|*')
+    else:
+        tar_file = tarfile.open(fileobj=archive, mode='r|*')
+
+    try:
+        for member in tar_file:
+            if member.isfile():
+                yield member.name, tar_file.extractfile(member).read()
+    finally:
+        tar_file.close()
+
+
+def _classify_member(name):
+    '''
+    Work out whether an archive member holds CoreNLP xml or AIDA json, and
+    for which article.  Returns (kind, article_id), or (None, None) for
+    members that are neither.
+    '''
+    basename = os.path.basename(name)
+    for kind, ext in [('corenlp', '.xml'), ('aida', '.json')]:
+        article_id = split_article_id(basename, ext)
+        if article_id is not None:
+            return kind, article_id
+    return None, None
+
+
+def _iter_classified_members(archives):
+    '''
+    Yield (kind, article_id, content) for the relevant members of all the
+    `archives`, taking one member from each archive in turn.  Archives
+    that list their articles in the same order are thereby read in step.
+    '''
+    iterators = [iter_archive_members(archive) for archive in archives]
+    while iterators:
+        for iterator in list(iterators):
+            try:
+                name, content = next(iterator)
+            except StopIteration:
+                iterators.remove(iterator)
+                continue
+
+            kind, article_id = _classify_member(name)
+            if kind is not None:
+                yield kind, article_id, content
+
+
+def iter_archive_pairs(
+    archive, aida_archive=None, with_aida=True,
+    max_pending=DEFAULT_MAX_PENDING
+):
+    '''
+    Yield (article_id, corenlp_xml, aida_json) for each article in
+    `archive`, pairing CoreNLP and AIDA members by article id.  The AIDA
+    members are looked for in `aida_archive` if given, otherwise in
+    `archive` itself.
+
+    Members waiting for their partner are held in memory, so archives
+    in which each article's members sit close together (or which list
+    articles in the same order) are read with little memory.  At most
+    `max_pending` CoreNLP members wait for their AIDA member: beyond that,
+    the one that has waited longest is yielded with aida_json set to None
+    (as are those still waiting at the end), so archives without AIDA
+    members are streamed too.  If an AIDA member turns up after its
+    CoreNLP member was yielded, or more than `max_pending` AIDA members
+    are waiting, ValueError is raised.  `max_pending` can be None, to
+    hold any number of members.  If `with_aida` is false, AIDA members are
+    ignored and every article is yielded as soon as it is read.
+    '''
+    archives = [archive]
+    if with_aida and aida_archive is not None:
+        archives.append(aida_archive)
+
+    waiting_corenlp = OrderedDict()
+    waiting_aida = {}
+    unpaired = set()
+
+    for kind, article_id, content in _iter_classified_members(archives):
+
+        if kind == 'corenlp':
+            if not with_aida:
+                yield article_id, content, None
+            elif article_id in waiting_aida:
+                yield article_id, content, waiting_aida.pop(article_id)
+            else:
+                waiting_corenlp[article_id] = content
+                if max_pending is not None:
+                    while len(waiting_corenlp) > max_pending:
+                        unpaired_id, corenlp_xml = waiting_corenlp.popitem(
+                            last=False)
+                        unpaired.add(unpaired_id)
+                        yield unpaired_id, corenlp_xml, None
+
+        elif with_aida:
+            if article_id in waiting_corenlp:
+                yield article_id, waiting_corenlp.pop(article_id), content
+            elif article_id in unpaired:
+                raise ValueError(
+                    'The AIDA member of %s was read after more than '
+                    'max_pending other articles.' % article_id
+                )
+            else:
+                waiting_aida[article_id] = content
+                if max_pending is not None and len(waiting_aida) > max_pending:
+                    raise ValueError(
+                        'More than max_pending AIDA members are waiting for '
+                        'their CoreNLP members.'
+                    )
+
+    # Articles that have no AIDA member
+    for article_id, corenlp_xml in waiting_corenlp.iteritems():
+        yield article_id, corenlp_xml, None
+
+
+def iter_archive(
+    archive,
+    aida_archive=None,
+    with_aida=True,
+    executor='process',
+    workers=None,
+    max_in_flight=None,
+    max_pending=DEFAULT_MAX_PENDING,
+    **kwargs
+):
+    '''
+    Yield (article_id, annotated_text) for each article in `archive` (see
+    iter_archive_pairs).  The archive is read in this thread, while the
+    documents are parsed by a pool of workers (see corpus.CorpusLoader).
+    Keyword arguments are passed on to AnnotatedText.
+    '''
+    with CorpusLoader(executor, workers, max_in_flight) as loader:
+        pairs = iter_archive_pairs(
+            archive, aida_archive, with_aida, max_pending)
+        for article_id, annotated_text in loader.iter_contents(
+            pairs, **kwargs
+        ):
+            yield article_id, annotated_text
@@ -0,0 +1,354 @@
+'''
+Export of parsed documents as flat tables, for loading into Apache Arrow,
+Parquet files, or DataFrames without going through the nested Token
+dictionaries.  Each document becomes rows in these tables:
+
+    tokens          one row per token
+    dependencies    one row per dependency edge (the root's governor is -1)
+    constituents    one row per node of the constituency parse, numbered
+                    in pre-order within each sentence
+    mentions        one row per mention, with its reference (coreference
+                    chain)
+    references      one row per reference, with the kbIdentifier and types
+                    it was resolved to by AIDA (if any)
+    aida_links      one row per mention linked by AIDA
+
+Every row starts with the document id, so a whole corpus can go into one
+set of tables.  Building the rows needs only the standard library, while
+record batches and Parquet files need pyarrow, in which case string
+columns are dictionary-encoded:
+
+    with ParquetTableWriter('out/') as writer:
+        writer.write(article, 'article-1')
+
+export_corpus() parses a corpus in a pool of workers, which build the rows,
+and writes them as Parquet files in batches.
+'''
+
+from collections import OrderedDict
+import os
+from corpus import CorpusLoader, iter_pair_contents
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+DEFAULT_BATCH_SIZE = 64 * 1024
+
+# The columns of each table, and their types
+TABLES = OrderedDict([
+    ('tokens', [
+        ('doc_id', 'string'),
+        ('sentence_id', 'int'),
+        ('token_id', 'int'),
+        ('word', 'string'),
+        ('lemma', 'string'),
+        ('pos', 'string'),
+        ('ner', 'string'),
+        ('speaker', 'string'),
+        ('character_offset_begin', 'int'),
+        ('character_offset_end', 'int'),
+    ]),
+    ('dependencies', [
+        ('doc_id', 'string'),
+        ('sentence_id', 'int'),
+        ('governor_id', 'int'),
+        ('dependent_id', 'int'),
+        ('relation', 'string'),
+    ]),
+    ('constituents', [
+        ('doc_id', 'string'),
+        ('sentence_id', 'int'),
+        ('node_id', 'int'),
+        ('parent_id', 'int'),
+        ('tag', 'string'),
+        ('depth', 'int'),
+        ('token_id', 'int'),
+    ]),
+    ('mentions', [
+        ('doc_id', 'string'),
+        ('reference_id', 'int'),
+        ('sentence_id', 'int'),
+        ('start', 'int'),
+        ('end', 'int'),
+        ('head_id', 'int'),
+        ('is_representative', 'bool'),
+    ]),
+    ('references', [
+        ('doc_id', 'string'),
+        ('reference_id', 'int'),
+        ('num_mentions', 'int'),
+        ('kb_identifier', 'string'),
+        ('types', 'string_list'),
+    ]),
+    ('aida_links', [
+        ('doc_id', 'string'),
+        ('reference_id', 'int'),
+        ('sentence_id', 'int'),
+        ('start', 'int'),
+        ('end', 'int'),
+        ('kb_identifier', 'string'),
+        ('disambiguation_score', 'float'),
+    ]),
+])
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise ValueError(
+            'Exporting to Arrow or Parquet needs the pyarrow package.')
+
+
+class _TableRows(object):
+    '''
+    Accumulates the rows of one table, column by column.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.column_names = [column for column, kind in TABLES[name]]
+        self.columns = OrderedDict(
+            (column, []) for column in self.column_names)
+
+
+    def append(self, *row):
+        for column, value in zip(self.column_names, row):
+            self.columns[column].append(value)
+
+
+    def __len__(self):
+        return len(self.columns[self.column_names[0]])
+
+
+    def extend(self, columns):
+        for column in self.column_names:
+            self.columns[column].extend(columns[column])
+
+
+def _add_constituents(rows, doc_id, sentence_id, node):
+    '''
+    Add rows for the constituency tree below `node`, numbering the nodes in
+    pre-order.  Tokens are the leaves, and they keep their token id.
+    '''
+    stack = [(node, -1)]
+    node_id = 0
+    while stack:
+        node, parent_id = stack.pop()
+        rows.append(
+            doc_id, sentence_id, node_id, parent_id, node['c_tag'],
+            node['c_depth'], node.get('id')
+        )
+        for child in reversed(node['c_children']):
+            stack.append((child, node_id))
+        node_id += 1
+
+
+def document_columns(annotated_text, doc_id=None):
+    '''
+    Return the rows for `annotated_text` in each of the tables, as an
+    OrderedDict mapping table names to OrderedDicts of column lists.
+    '''
+    tables = OrderedDict((name, _TableRows(name)) for name in TABLES)
+
+    for sentence in annotated_text.sentences:
+        sentence_id = sentence['id']
+
+        for token in sentence['tokens']:
+            # Fields that weren't read (see AnnotatedText's token_fields)
+            # are left empty
+            tables['tokens'].append(
+                doc_id, sentence_id, token['id'], token.get('word'),
+                token.get('lemma'), token.get('pos'), token.get('ner'),
+                token.get('speaker'), token.get('character_offset_begin'),
+                token.get('character_offset_end')
+            )
+
+            for relation, governor in token.get('parents', []):
+                tables['dependencies'].append(
+                    doc_id, sentence_id, governor['id'], token['id'],
+                    relation
+                )
+
+        if 'root' in sentence:
+            tables['dependencies'].append(
+                doc_id, sentence_id, -1, sentence['root']['id'], 'root')
+
+        if 'c_root' in sentence:
+            _add_constituents(
+                tables['constituents'], doc_id, sentence_id,
+                sentence['c_root']
+            )
+
+    for reference in annotated_text.references:
+        tables['references'].append(
+            doc_id, reference['id'], len(reference['mentions']),
+            reference.get('kbIdentifier'), reference.get('types')
+        )
+
+        for mention in reference['mentions']:
+            head = mention['head']
+            tables['mentions'].append(
+                doc_id, reference['id'], mention['sentence_id'],
+                mention['start'], mention['end'],
+                head['id'] if head is not None else None,
+                mention is reference['representative']
+            )
+
+            if 'kbIdentifier' in mention:
+                tables['aida_links'].append(
+                    doc_id, reference['id'], mention['sentence_id'],
+                    mention['start'], mention['end'], mention['kbIdentifier'],
+                    mention['disambiguationScore']
+                )
+
+    return OrderedDict(
+        (name, rows.columns) for name, rows in tables.iteritems())
+
+
+def _arrow_type(kind):
+    if kind == 'string':
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    if kind == 'string_list':
+        return pyarrow.list_(pyarrow.string())
+    return {
+        'int': pyarrow.int64(),
+        'float': pyarrow.float64(),
+        'bool': pyarrow.bool_(),
+    }[kind]
+
+
+def table_schema(name):
+    '''
+    Return the pyarrow schema of the table called `name`.
+    '''
+    _require_pyarrow()
+    return pyarrow.schema([
+        pyarrow.field(column, _arrow_type(kind))
+        for column, kind in TABLES[name]
+    ])
+
+
+def _record_batch(name, columns):
+    '''
+    Make a record batch from the `columns` of the table called `name`,
+    dictionary-encoding the string columns.
+    '''
+    arrays = []
+    for column, kind in TABLES[name]:
+        if kind == 'string':
+            array = pyarrow.array(columns[column], type=pyarrow.string())
+            array = array.dictionary_encode()
+        else:
+            array = pyarrow.array(columns[column], type=_arrow_type(kind))
+        arrays.append(array)
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=table_schema(name))
+
+
+def to_record_batches(annotated_text, doc_id=None):
+    '''
+    Return an OrderedDict mapping each table name to a pyarrow RecordBatch
+    holding the rows for `annotated_text`.
+    '''
+    _require_pyarrow()
+    return OrderedDict(
+        (name, _record_batch(name, columns))
+        for name, columns
+        in document_columns(annotated_text, doc_id).iteritems()
+    )
+
+
+class ParquetTableWriter(object):
+    '''
+    Writes documents to one Parquet file per table, `<table>.parquet` in
+    `out_dir`.  Rows are buffered, and written once a table has
+    `batch_size` of them (and when the writer is closed).
+    '''
+
+    def __init__(self, out_dir, batch_size=DEFAULT_BATCH_SIZE, **kwargs):
+        _require_pyarrow()
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1.')
+
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+
+        self.batch_size = batch_size
+        self.buffers = OrderedDict((name, _TableRows(name)) for name in TABLES)
+
+        # Keyword arguments (like compression) go to the Parquet writers
+        self.writers = OrderedDict(
+            (name, pyarrow.parquet.ParquetWriter(
+                os.path.join(out_dir, name + '.parquet'),
+                table_schema(name), **kwargs
+            ))
+            for name in TABLES
+        )
+
+
+    def write(self, annotated_text, doc_id=None):
+        self.write_columns(document_columns(annotated_text, doc_id))
+
+
+    def write_columns(self, tables):
+        '''
+        Write the rows produced by document_columns().
+        '''
+        for name, columns in tables.iteritems():
+            self.buffers[name].extend(columns)
+            if len(self.buffers[name]) >= self.batch_size:
+                self._flush(name)
+
+
+    def _flush(self, name):
+        rows = self.buffers[name]
+        if len(rows) == 0:
+            return
+        batch = _record_batch(name, rows.columns)
+        self.writers[name].write_table(
+            pyarrow.Table.from_batches([batch]))
+        self.buffers[name] = _TableRows(name)
+
+
+    def close(self):
+        for name in TABLES:
+            self._flush(name)
+            self.writers[name].close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def export_corpus(
+    pairs, out_dir, batch_size=DEFAULT_BATCH_SIZE, executor='process',
+    workers=None, max_in_flight=None, **kwargs
+):
+    '''
+    Parse each (corenlp_path, aida_path) pair in `pairs` in a pool of
+    workers (see corpus.CorpusLoader), and write all of the documents to
+    Parquet files in `out_dir` (see ParquetTableWriter), using article ids
+    as document ids.  Keyword arguments are passed on to AnnotatedText.
+    Returns the number of documents written.
+    '''
+    _require_pyarrow()
+
+    num_documents = 0
+    with CorpusLoader(executor, workers, max_in_flight) as loader:
+        with ParquetTableWriter(out_dir, batch_size) as writer:
+            # The workers send back plain column lists, rather than whole
+            # documents
+            for doc_id, tables in loader.iter_contents(
+                iter_pair_contents(pairs), transform=document_columns,
+                **kwargs
+            ):
+                writer.write_columns(tables)
+                num_documents += 1
+
+    return num_documents
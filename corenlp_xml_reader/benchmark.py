@@ -0,0 +1,515 @@
+'''
+Benchmarks for building AnnotatedText objects, using the CoreNLP / AIDA
+pairs bundled in `data/`.  Reports the time taken by each phase of
+construction, throughput in tokens/sec and documents/sec, and peak memory.
+Scaling curves are produced by replicating the sentences of a document, and
+by generating synthetic documents with longer and longer sentences, so that
+costs which grow faster than the size of the document stand out.  The
+time spent by the cyclic garbage collector reclaiming documents is
+measured with and without `cycle_free`.  The memory copied by forked
+workers reading a corpus loaded before the fork is measured with the
+documents as they are, and frozen (on Linux only).
+
+Run it as a script; results are written as JSON, which makes it easy to
+compare runs:
+
+    python benchmark.py --output results.json
+'''
+
+import argparse
+from collections import OrderedDict
+import gc
+import json
+from multiprocessing import Pool
+import os
+import re
+import resource
+import sys
+import time
+from annotated_text import (
+    AnnotatedText, MATCH_SENTENCES_BLOCK, MATCH_SENTENCE_ELEMENT
+)
+import columnar
+from corpus import (
+    find_corpus_pairs, iter_pair_contents, read_file, split_article_id
+)
+from instrumentation import Collector
+from sources import read_path
+from synthetic import generate_document
+
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.path.join(HERE, 'data')
+DEFAULT_SCALES = [1, 2, 4, 8]
+DEFAULT_SENTENCE_LENGTHS = [10, 20, 40, 80]
+DEFAULT_SHARED_READERS = 4
+
+MATCH_SENTENCE_ID = re.compile(r'^<sentence id="(\d+)"')
+MATCH_OFFSET = re.compile(
+    r'(<CharacterOffset(?:Begin|End)>)(\d+)(</CharacterOffset(?:Begin|End)>)')
+MATCH_COREFERENCE_BLOCK = re.compile(
+    r'(<coreference>\s*)(<coreference>.*</coreference>)(\s*</coreference>)',
+    re.DOTALL
+)
+MATCH_MENTION_SENTENCE = re.compile(r'<sentence>(\d+)</sentence>')
+
+
+def replicate_sentences(corenlp_xml, factor, aida_json=None):
+    '''
+    Make a larger document by repeating all of the sentences in
+    `corenlp_xml` `factor` times.  Each copy gets its own sentence ids and
+    character offsets, and the coreference chains are copied to point at
+    the new sentences, so each copy is a faithful replica of the original.
+    If `aida_json` is given, its mentions are replicated the same way, and
+    (corenlp_xml, aida_json) is returned.
+    '''
+    sentences_block = MATCH_SENTENCES_BLOCK.search(corenlp_xml)
+    sentence_xmls = MATCH_SENTENCE_ELEMENT.findall(sentences_block.group(1))
+    num_sentences = len(sentence_xmls)
+
+    # Each copy gets shifted past the last character of the previous one
+    offsets = [int(m.group(2)) for m in MATCH_OFFSET.finditer(corenlp_xml)]
+    offset_shift = max(offsets) + 1 if offsets else 0
+
+    def shift_offsets(xml, shift):
+        return MATCH_OFFSET.sub(
+            lambda m: '%s%d%s' % (m.group(1), int(m.group(2)) + shift,
+                m.group(3)),
+            xml
+        )
+
+    # Replicate the sentences
+    replicated = []
+    for copy in range(factor):
+        for sentence_xml in sentence_xmls:
+            sentence_id = int(MATCH_SENTENCE_ID.match(sentence_xml).group(1))
+            sentence_xml = MATCH_SENTENCE_ID.sub(
+                '<sentence id="%d"' % (sentence_id + copy * num_sentences),
+                sentence_xml
+            )
+            replicated.append(shift_offsets(sentence_xml, copy*offset_shift))
+
+    corenlp_xml = (
+        corenlp_xml[:sentences_block.start(1)]
+        + '\n'.join(replicated)
+        + corenlp_xml[sentences_block.end(1):]
+    )
+
+    # Replicate the coreference chains, pointing them at the new sentences
+    coreference_block = MATCH_COREFERENCE_BLOCK.search(corenlp_xml)
+    if coreference_block is not None:
+        chains = coreference_block.group(2)
+        replicated_chains = [
+            MATCH_MENTION_SENTENCE.sub(
+                lambda m: '<sentence>%d</sentence>' % (
+                    int(m.group(1)) + copy * num_sentences),
+                chains
+            )
+            for copy in range(factor)
+        ]
+        corenlp_xml = (
+            corenlp_xml[:coreference_block.start(2)]
+            + '\n'.join(replicated_chains)
+            + corenlp_xml[coreference_block.end(2):]
+        )
+
+    if aida_json is None:
+        return corenlp_xml
+
+    aida_data = json.loads(aida_json)
+    aida_data['mentions'] = [
+        dict(mention, offset=mention['offset'] + copy * offset_shift)
+        for copy in range(factor)
+        for mention in aida_data['mentions']
+    ]
+
+    return corenlp_xml, json.dumps(aida_data)
+
+
+def time_construction(corenlp_xml, aida_json=None, **kwargs):
+    '''
+    Build an AnnotatedText, timing each phase of construction.  Returns
+    the AnnotatedText, and the Collector holding phase durations (in
+    seconds) and counters.
+    '''
+    collector = Collector()
+    annotated_text = AnnotatedText(
+        corenlp_xml, aida_json, instrumentation=collector, **kwargs)
+    return annotated_text, collector
+
+
+def get_peak_rss_kb():
+    '''
+    Peak resident memory of this process, in kilobytes.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Darwin reports bytes rather than kilobytes
+    if sys.platform == 'darwin':
+        peak = peak // 1024
+
+    return peak
+
+
+def measure_document(corenlp_xml, aida_json=None, **kwargs):
+    '''
+    Time the construction of one document, and report its size and
+    throughput.  Peak memory is only meaningful when this runs in a fresh
+    process (see measure_document_in_subprocess).
+    '''
+    rss_before = get_peak_rss_kb()
+    annotated_text, collector = time_construction(
+        corenlp_xml, aida_json, **kwargs)
+    total = sum(collector.phases.values())
+    num_tokens = len(annotated_text.tokens)
+
+    return OrderedDict([
+        ('sentences', len(annotated_text.sentences)),
+        ('tokens', num_tokens),
+        ('references', len(annotated_text.references)),
+        ('phases', collector.phases),
+        ('counters', dict(collector.counters)),
+        ('seconds', total),
+        ('tokens_per_sec', num_tokens / total if total else None),
+        ('rss_before_kb', rss_before),
+        ('peak_rss_kb', get_peak_rss_kb()),
+    ])
+
+
+def _measure_document(args):
+    corenlp_xml, aida_json, kwargs = args
+    return measure_document(corenlp_xml, aida_json, **kwargs)
+
+
+def measure_document_in_subprocess(corenlp_xml, aida_json=None, **kwargs):
+    '''
+    Run measure_document in a fresh worker process, so that the peak
+    memory reported belongs to this document alone.
+    '''
+    pool = Pool(1, maxtasksperchild=1)
+    try:
+        return pool.apply(
+            _measure_document, ((corenlp_xml, aida_json, kwargs),))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def benchmark_documents(pairs, repeat=1, **kwargs):
+    '''
+    Measure each document in `pairs`, keeping the fastest of `repeat` runs.
+    '''
+    results = []
+    for corenlp_path, aida_path in pairs:
+        corenlp_xml = read_file(corenlp_path)
+        aida_json = read_file(aida_path)
+
+        runs = [
+            measure_document_in_subprocess(corenlp_xml, aida_json, **kwargs)
+            for i in range(repeat)
+        ]
+        result = min(runs, key=lambda run: run['seconds'])
+
+        article_id = split_article_id(os.path.basename(corenlp_path), '.xml')
+        results.append(OrderedDict(
+            [('article_id', article_id)] + result.items()))
+
+    return results
+
+
+def benchmark_corpus(pairs, **kwargs):
+    '''
+    Load every document in `pairs` in this process, one after the other,
+    and report overall throughput.
+    '''
+    num_tokens = 0
+    start = time.time()
+    for corenlp_path, aida_path in pairs:
+        annotated_text = AnnotatedText(
+            read_file(corenlp_path), read_file(aida_path), **kwargs)
+        num_tokens += len(annotated_text.tokens)
+    seconds = time.time() - start
+
+    return OrderedDict([
+        ('documents', len(pairs)),
+        ('tokens', num_tokens),
+        ('seconds', seconds),
+        ('documents_per_sec', len(pairs) / seconds),
+        ('tokens_per_sec', num_tokens / seconds),
+    ])
+
+
+def benchmark_gc(pairs, **kwargs):
+    '''
+    Load every document in `pairs` in this process, one after the other,
+    and drop each one before loading the next, as when iterating over a
+    corpus.  This is done with the default object graph, and again with
+    cycle_free=True.  Automatic garbage collection is switched off, and a
+    full collection is run after dropping each document; its duration is
+    the pause needed by the cyclic garbage collector to reclaim the 
+    document.
+    '''
+    results = OrderedDict()
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for mode, cycle_free in [('default', False), ('cycle_free', True)]:
+            gc.collect()
+            pauses = []
+            collected = 0
+            start = time.time()
+            for corenlp_path, aida_path in pairs:
+                annotated_text = AnnotatedText(
+                    read_file(corenlp_path), read_file(aida_path), 
+                    cycle_free=cycle_free, **kwargs
+                )
+                del annotated_text
+
+                pause_start = time.time()
+                collected += gc.collect()
+                pauses.append(time.time() - pause_start)
+
+            results[mode] = OrderedDict([
+                ('seconds', time.time() - start),
+                ('gc_seconds', sum(pauses)),
+                ('max_gc_pause', max(pauses) if pauses else 0),
+                ('collected_objects', collected),
+            ])
+    finally:
+        if was_enabled:
+            gc.enable()
+
+    return results
+
+
+def get_private_dirty_kb():
+    '''
+    Memory that this process alone has written to, in kilobytes.  In a
+    forked process, that includes the pages of the parent that it has
+    copied by writing to them.  Only available on Linux (None elsewhere).
+    '''
+    for smaps_path in ['/proc/self/smaps_rollup', '/proc/self/smaps']:
+        if os.path.exists(smaps_path):
+            with open(smaps_path) as smaps:
+                return sum(
+                    int(line.split()[1]) for line in smaps
+                    if line.startswith('Private_Dirty:')
+                )
+    return None
+
+
+# The documents read by the forked readers of benchmark_shared_memory.  This
+# is set in the parent before the readers are forked, so that they start
+# out sharing the documents' pages with it.
+_shared_documents = None
+
+
+def _read_shared_documents(frozen):
+    '''
+    Count the labels of every token of the shared documents, and report
+    how much memory this reader had to copy to do so.  Frozen documents
+    are read straight from their token columns.
+    '''
+    private_before = get_private_dirty_kb()
+    start = time.time()
+
+    num_labels = 0
+    if frozen:
+        for doc in xrange(len(_shared_documents)):
+            columns = _shared_documents.document_tokens(doc)
+            del columns['sentence_offsets']
+            num_labels += sum(
+                int((values >= 0).sum()) for values in columns.itervalues())
+    else:
+        for annotated_text in _shared_documents:
+            for token in annotated_text.tokens:
+                num_labels += sum(
+                    1 for field in annotated_text.token_fields
+                    if token.get(field) is not None
+                )
+
+    return OrderedDict([
+        ('labels_read', num_labels),
+        ('seconds', time.time() - start),
+        ('private_dirty_kb', get_private_dirty_kb() - private_before),
+    ])
+
+
+def _measure_shared_reads(documents, frozen, readers):
+    global _shared_documents
+    _shared_documents = documents
+
+    # Each reader gets a freshly forked process
+    pool = Pool(readers, maxtasksperchild=1)
+    try:
+        runs = pool.map(
+            _read_shared_documents, [frozen] * readers, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        _shared_documents = None
+
+    copied = [run['private_dirty_kb'] for run in runs]
+    return OrderedDict([
+        ('readers', readers),
+        ('seconds', max(run['seconds'] for run in runs)),
+        ('copied_kb', copied),
+        ('mean_copied_kb', sum(copied) / float(len(copied))),
+    ])
+
+
+def benchmark_shared_memory(
+    pairs, readers=DEFAULT_SHARED_READERS, **kwargs
+):
+    '''
+    Load every document in `pairs`, then fork `readers` processes that
+    each read the labels of all of their tokens, and report how much memory each reader copied
+    from the parent.  Merely reading the documents' dicts updates their
+    reference counts (and the garbage collector updates its own records
+    in every object), so each reader ends up with its own copy of most of
+    the pages.  This is measured with the AnnotatedText objects, and again
+    with the documents frozen (see columnar.freeze()), where they are held
+    in a few large buffers that reading doesn't write to.  Returns None
+    where memory can't be measured, or numpy is missing.
+    '''
+    if get_private_dirty_kb() is None or columnar.numpy is None:
+        return None
+
+    documents = [
+        (doc_id, AnnotatedText(corenlp_xml, aida_json, **kwargs))
+        for doc_id, corenlp_xml, aida_json in iter_pair_contents(pairs)
+    ]
+
+    results = OrderedDict()
+    results['objects'] = _measure_shared_reads(
+        [annotated_text for doc_id, annotated_text in documents], False,
+        readers
+    )
+
+    # The objects are dropped before forking the readers of the frozen
+    # documents, so that their garbage collector doesn't visit them
+    frozen = columnar.freeze(documents)
+    del documents
+    gc.collect()
+    results['frozen'] = _measure_shared_reads(frozen, True, readers)
+
+    return results
+
+
+def benchmark_scaling(corenlp_path, aida_path=None, scales=DEFAULT_SCALES,
+    **kwargs
+):
+    '''
+    Measure construction of the document at `corenlp_path` with its
+    sentences replicated by each factor in `scales`.  With linear scaling,
+    tokens_per_sec stays flat as the factor grows.
+    '''
+    # Replication works on the decompressed text
+    corenlp_xml = read_path(corenlp_path)
+    aida_json = read_path(aida_path) if aida_path is not None else None
+
+    results = []
+    for factor in scales:
+        if aida_json is None:
+            scaled_xml = replicate_sentences(corenlp_xml, factor)
+            scaled_json = None
+        else:
+            scaled_xml, scaled_json = replicate_sentences(
+                corenlp_xml, factor, aida_json)
+
+        result = measure_document_in_subprocess(
+            scaled_xml, scaled_json, **kwargs)
+        results.append(OrderedDict([('factor', factor)] + result.items()))
+
+    return results
+
+
+def benchmark_sentence_length(
+    sentence_lengths=DEFAULT_SENTENCE_LENGTHS, num_sentences=20, seed=0,
+    **kwargs
+):
+    '''
+    Measure construction of synthetic documents having the same number of
+    sentences, but longer and longer sentences (with deeper parses).  This
+    exposes per-sentence costs, like parse splitting and cycle checking,
+    that grow faster than the sentence.
+    '''
+    results = []
+    for sentence_length in sentence_lengths:
+        corenlp_xml, aida_json = generate_document(
+            num_sentences=num_sentences,
+            sentence_length=sentence_length,
+            parse_depth=sentence_length // 4,
+            dependency_density=1.2,
+            seed=seed
+        )
+        result = measure_document_in_subprocess(
+            corenlp_xml, aida_json, **kwargs)
+        results.append(OrderedDict(
+            [('sentence_length', sentence_length)] + result.items()))
+
+    return results
+
+
+def run_benchmarks(data_dir=DATA_DIR, scales=DEFAULT_SCALES, repeat=1,
+    sentence_lengths=DEFAULT_SENTENCE_LENGTHS,
+    shared_readers=DEFAULT_SHARED_READERS, **kwargs
+):
+    pairs = find_corpus_pairs(
+        os.path.join(data_dir, 'CoreNLP'), os.path.join(data_dir, 'AIDA'))
+    largest = max(pairs, key=lambda pair: os.path.getsize(pair[0]))
+
+    return OrderedDict([
+        ('python', sys.version.split()[0]),
+        ('timestamp', time.time()),
+        ('options', kwargs),
+        ('documents', benchmark_documents(pairs, repeat, **kwargs)),
+        ('corpus', benchmark_corpus(pairs, **kwargs)),
+        ('gc', benchmark_gc(pairs, **kwargs)),
+        ('scaling', OrderedDict([
+            ('corenlp_path', os.path.basename(largest[0])),
+            ('results', benchmark_scaling(
+                largest[0], largest[1], scales, **kwargs)),
+        ])),
+        ('sentence_length_scaling', benchmark_sentence_length(
+            sentence_lengths, **kwargs)),
+        ('shared_memory', benchmark_shared_memory(
+            pairs, shared_readers, **kwargs)),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=(
+        'Benchmark AnnotatedText construction on the bundled data.'))
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--output', help='write JSON here (default stdout)')
+    parser.add_argument('--repeat', type=int, default=1,
+        help='runs per document; the fastest is kept')
+    parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)),
+        help='comma-separated sentence replication factors')
+    parser.add_argument('--sentence-lengths',
+        default=','.join(map(str, DEFAULT_SENTENCE_LENGTHS)),
+        help='comma-separated lengths of synthetic sentences')
+    parser.add_argument('--readers', type=int, default=DEFAULT_SHARED_READERS,
+        help='forked processes reading the shared corpus')
+    parser.add_argument('--dependencies', default='collapsed-ccprocessed')
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        args.data_dir,
+        scales=[int(s) for s in args.scales.split(',')],
+        repeat=args.repeat,
+        sentence_lengths=[int(s) for s in args.sentence_lengths.split(',')],
+        shared_readers=args.readers,
+        dependencies=args.dependencies
+    )
+
+    serialized = json.dumps(results, indent=2)
+    if args.output is None:
+        print serialized
+    else:
+        open(args.output, 'w').write(serialized)
+
+
+if __name__ == '__main__':
+    main()
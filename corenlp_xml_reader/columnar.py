@@ -0,0 +1,793 @@
+'''
+A columnar on-disk format for whole corpora.  The tokens, dependency
+edges, constituents, references, and mentions of every document are
+stored in long flat arrays, one file per column, so that a document is
+just a range of rows in each of them.  Labels (words, lemmas, POS tags,
+NER types, relations, constituent tags, kbIdentifiers) are stored as ids
+into string tables.
+
+A corpus is opened by memory-mapping its files, which takes no time, and
+reads nothing until a document is used.  Worker processes that open the
+same corpus share one copy of it in the page cache:
+
+    write_corpus(pairs, 'corpus/')
+
+    corpus = ColumnarCorpus('corpus/')
+    corpus.document_tokens(3)['pos']     # POS ids of document 3's tokens
+    corpus.sentence(3, 0)                # a Sentence, with its Tokens
+    corpus.document(corpus.index('1234'))
+
+A corpus can also be held in memory, by freezing documents that were
+already read (see freeze()), so that processes forked after it is built
+can share it too.
+
+The arrays are sliced without copying them.  Sentences and documents are
+built as the usual Sentence, Token and AnnotatedText objects, on demand,
+from their rows.  The columns are:
+
+    tokens              word, lemma, pos, ner, speaker (label ids, -1 for
+                        none), character_offset_begin,
+                        character_offset_end (-1 if not read)
+    sentences           sentence_token_offsets, sentence_edge_offsets,
+                        sentence_node_offsets, sentence_source_id
+    dependency edges    edge_governor (-1 for the root), edge_dependent,
+                        edge_relation
+    constituents        node_parent, node_tag, node_depth, node_token (-1
+                        for non-terminal nodes), in pre-order
+    references          reference_id, reference_is_coreference,
+                        reference_kb, reference_mention_offsets
+    mentions            mention_sentence, mention_start, mention_end,
+                        mention_head, mention_is_representative,
+                        mention_entity_idx, mention_is_created,
+                        mention_kb, mention_score
+    documents           document_sentence_offsets,
+                        document_reference_offsets, document_has_aida,
+                        document_is_filtered, document_next_reference_id
+
+The rows of an "offsets" column are the boundaries of the rows of
+another table: the tokens of (corpus-wide) sentence i are at
+[sentence_token_offsets[i]:sentence_token_offsets[i+1]].  Token ids,
+sentence ids, and reference positions within a document are local to
+it.  All of the documents in a corpus must have been read with the same
+`dependencies`, `exclude_ordinal_NERs`, and `token_fields`.  This needs
+numpy.
+'''
+
+from collections import OrderedDict
+import json
+import os
+from annotated_text import AnnotatedText
+from corpus import CorpusLoader, iter_pair_contents
+from document_store import document_rows
+from labels import LabelVocabulary
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+FORMAT_VERSION = 1
+META_FILE = 'corpus.json'
+
+# The columns, and their types
+COLUMNS = OrderedDict([
+    ('word', 'int32'),
+    ('lemma', 'int32'),
+    ('pos', 'int32'),
+    ('ner', 'int32'),
+    ('speaker', 'int32'),
+    ('character_offset_begin', 'int64'),
+    ('character_offset_end', 'int64'),
+    ('sentence_token_offsets', 'int64'),
+    ('sentence_edge_offsets', 'int64'),
+    ('sentence_node_offsets', 'int64'),
+    ('sentence_source_id', 'int32'),
+    ('edge_governor', 'int32'),
+    ('edge_dependent', 'int32'),
+    ('edge_relation', 'int32'),
+    ('node_parent', 'int32'),
+    ('node_tag', 'int32'),
+    ('node_depth', 'int32'),
+    ('node_token', 'int32'),
+    ('reference_id', 'int32'),
+    ('reference_is_coreference', 'int8'),
+    ('reference_kb', 'int32'),
+    ('reference_mention_offsets', 'int64'),
+    ('mention_sentence', 'int32'),
+    ('mention_start', 'int32'),
+    ('mention_end', 'int32'),
+    ('mention_head', 'int32'),
+    ('mention_is_representative', 'int8'),
+    ('mention_entity_idx', 'int32'),
+    ('mention_is_created', 'int8'),
+    ('mention_kb', 'int32'),
+    ('mention_score', 'float64'),
+    ('document_sentence_offsets', 'int64'),
+    ('document_reference_offsets', 'int64'),
+    ('document_has_aida', 'int8'),
+    ('document_is_filtered', 'int8'),
+    ('document_next_reference_id', 'int32'),
+])
+
+OFFSET_COLUMNS = [name for name in COLUMNS if name.endswith('_offsets')]
+
+# The string tables.  Token fields that are labels use the table with the
+# same name.  "kb_types" holds the json list of YAGO types of each kb id.
+STRING_TABLES = [
+    'word', 'lemma', 'pos', 'ner', 'speaker', 'dep', 'c_tag', 'kb',
+    'kb_types', 'doc_id'
+]
+LABEL_FIELDS = ['word', 'lemma', 'pos', 'ner', 'speaker']
+OFFSET_FIELDS = ['character_offset_begin', 'character_offset_end']
+
+# The options that must be the same for every document in a corpus
+CORPUS_OPTIONS = ['token_fields', 'dependencies', 'exclude_ordinal_NERs']
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ValueError('The columnar corpus format needs the numpy package.')
+
+
+def _column_path(out_dir, name):
+    return os.path.join(out_dir, name + '.bin')
+
+
+def _strings_paths(out_dir, name):
+    return (
+        os.path.join(out_dir, name + '.strings.bin'),
+        os.path.join(out_dir, name + '.string_offsets.bin')
+    )
+
+
+def _id_or_missing(vocabulary, label):
+    return -1 if label is None else vocabulary.id(label)
+
+
+def _open_array(path, dtype, length):
+    # numpy can't map empty files
+    if length == 0:
+        return numpy.zeros(0, dtype)
+    return numpy.memmap(path, dtype, mode='r', shape=(length,))
+
+
+class ColumnarWriter(object):
+    '''
+    Writes documents to a columnar corpus in `out_dir`.  The columns are
+    appended to as documents are added, and the string tables and the
+    corpus description are written when the writer is closed.  If
+    `out_dir` is None, the columns are kept in memory instead, and
+    frozen() makes a ColumnarCorpus of them.
+    '''
+
+    def __init__(self, out_dir=None):
+        _require_numpy()
+        if out_dir is not None and not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+
+        self.out_dir = out_dir
+        self.options = None
+        if out_dir is None:
+            self.files = None
+            self.chunks = OrderedDict((name, []) for name in COLUMNS)
+        else:
+            self.files = OrderedDict(
+                (name, open(_column_path(out_dir, name), 'wb'))
+                for name in COLUMNS
+            )
+        self.lengths = OrderedDict((name, 0) for name in COLUMNS)
+        self.vocabularies = OrderedDict(
+            (name, LabelVocabulary(name)) for name in STRING_TABLES
+            if name != 'kb_types'
+        )
+        self.kb_types = []
+
+        # Offsets columns start at 0
+        self.totals = {}
+        for name in OFFSET_COLUMNS:
+            self.totals[name] = 0
+            self._write(name, [0])
+
+
+    def _write(self, name, values):
+        values = numpy.array(values, COLUMNS[name])
+        if self.files is None:
+            self.chunks[name].append(values)
+        else:
+            values.tofile(self.files[name])
+        self.lengths[name] += len(values)
+
+
+    def _write_offsets(self, name, counts):
+        offsets = []
+        for count in counts:
+            self.totals[name] += count
+            offsets.append(self.totals[name])
+        self._write(name, offsets)
+
+
+    def write(self, annotated_text, doc_id):
+        self.write_rows(document_rows(annotated_text, doc_id))
+
+
+    def write_rows(self, rows):
+        '''
+        Write the document whose rows were made by
+        document_store.document_rows().
+        '''
+        (doc_id, num_sentences, token_fields, dependencies,
+            exclude_ordinal_ners, has_aida, is_filtered,
+            next_reference_id) = rows['documents'][0]
+        if doc_id is None:
+            raise ValueError('Documents must have an id.')
+
+        options = {
+            'token_fields': json.loads(token_fields),
+            'dependencies': dependencies,
+            'exclude_ordinal_NERs': bool(exclude_ordinal_ners),
+        }
+        if self.options is None:
+            self.options = options
+        elif options != self.options:
+            raise ValueError(
+                'The documents of a corpus must all be read with the same '
+                '%s.' % ', '.join(CORPUS_OPTIONS)
+            )
+
+        if doc_id in self.vocabularies['doc_id']:
+            raise ValueError('Document %s was already written.' % doc_id)
+        self.vocabularies['doc_id'].add(doc_id)
+
+        # Types are stored for each kb id, the first time it is seen
+        kb = self.vocabularies['kb']
+        for kb_identifier, types in rows['kb_types']:
+            if kb_identifier not in kb:
+                kb.add(kb_identifier)
+                self.kb_types.append(types)
+
+        self._write_tokens(rows)
+        self._write_sentences(rows)
+        self._write_references(rows)
+
+        self._write_offsets('document_sentence_offsets', [num_sentences])
+        self._write_offsets(
+            'document_reference_offsets', [len(rows['references'])])
+        self._write('document_has_aida', [has_aida])
+        self._write('document_is_filtered', [is_filtered])
+        self._write('document_next_reference_id', [next_reference_id])
+
+
+    def _write_tokens(self, rows):
+        token_rows = rows['tokens']
+        for position, field in enumerate(AnnotatedText.TOKEN_FIELDS, 3):
+            values = [row[position] for row in token_rows]
+            if field in LABEL_FIELDS:
+                vocabulary = self.vocabularies[field]
+                values = [_id_or_missing(vocabulary, v) for v in values]
+            else:
+                values = [-1 if v is None else v for v in values]
+            self._write(field, values)
+
+
+    def _write_sentences(self, rows):
+        sentence_ids = [row[1] for row in rows['sentences']]
+        edge_counts = dict((sentence_id, 0) for sentence_id in sentence_ids)
+        node_counts = dict(edge_counts)
+        for row in rows['dependencies']:
+            edge_counts[row[1]] += 1
+        for row in rows['constituents']:
+            node_counts[row[1]] += 1
+
+        self._write_offsets(
+            'sentence_token_offsets', [row[3] for row in rows['sentences']])
+        self._write_offsets(
+            'sentence_edge_offsets', [edge_counts[i] for i in sentence_ids])
+        self._write_offsets(
+            'sentence_node_offsets', [node_counts[i] for i in sentence_ids])
+        self._write(
+            'sentence_source_id', [row[2] for row in rows['sentences']])
+
+        dep = self.vocabularies['dep']
+        edges = rows['dependencies']
+        self._write('edge_governor', [row[2] for row in edges])
+        self._write('edge_dependent', [row[3] for row in edges])
+        self._write('edge_relation', [dep.id(row[4]) for row in edges])
+
+        c_tag = self.vocabularies['c_tag']
+        nodes = rows['constituents']
+        self._write('node_parent', [row[3] for row in nodes])
+        self._write('node_tag', [c_tag.id(row[4]) for row in nodes])
+        self._write('node_depth', [row[5] for row in nodes])
+        self._write('node_token', [
+            -1 if row[6] is None else row[6] for row in nodes])
+
+
+    def _write_references(self, rows):
+        kb = self.vocabularies['kb']
+        references = rows['references']
+        mention_counts = dict((row[1], 0) for row in references)
+        for row in rows['mentions']:
+            mention_counts[row[1]] += 1
+
+        self._write('reference_id', [row[1] for row in references])
+        self._write(
+            'reference_is_coreference', [row[3] for row in references])
+        self._write(
+            'reference_kb', [_id_or_missing(kb, row[4]) for row in references])
+        self._write_offsets(
+            'reference_mention_offsets',
+            [mention_counts[row[1]] for row in references]
+        )
+
+        # Mentions are written in the order of their references
+        positions = dict((row[1], row[2]) for row in references)
+        mentions = sorted(
+            rows['mentions'], key=lambda row: (positions[row[1]], row[2]))
+        aida_links = dict(
+            ((row[1], row[2]), (row[4], row[5])) for row in rows['aida_links'])
+
+        self._write('mention_sentence', [row[3] for row in mentions])
+        self._write('mention_start', [row[4] for row in mentions])
+        self._write('mention_end', [row[5] for row in mentions])
+        self._write('mention_head', [
+            -1 if row[6] is None else row[6] for row in mentions])
+        self._write(
+            'mention_is_representative', [row[7] for row in mentions])
+        self._write('mention_entity_idx', [
+            -1 if row[8] is None else row[8] for row in mentions])
+        self._write('mention_is_created', [row[9] for row in mentions])
+
+        links = [aida_links.get((row[1], row[2])) for row in mentions]
+        self._write('mention_kb', [
+            -1 if link is None else kb.id(link[0]) for link in links])
+        self._write('mention_score', [
+            float('nan') if link is None else link[1] for link in links])
+
+
+    def _string_tables(self):
+        '''
+        Encode each string table, as (blob, offsets) arrays.
+        '''
+        tables = OrderedDict(
+            (name, list(vocabulary))
+            for name, vocabulary in self.vocabularies.iteritems()
+        )
+        tables['kb_types'] = self.kb_types
+
+        encoded_tables = OrderedDict()
+        for name, strings in tables.iteritems():
+            encoded = [string.encode('utf8') for string in strings]
+            encoded_tables[name] = (
+                numpy.frombuffer(''.join(encoded), 'uint8'),
+                numpy.cumsum(
+                    [0] + [len(string) for string in encoded], dtype='int64')
+            )
+        return encoded_tables
+
+
+    def _options(self):
+        return self.options or {
+            'token_fields': AnnotatedText.TOKEN_FIELDS,
+            'dependencies': 'collapsed-ccprocessed',
+            'exclude_ordinal_NERs': False,
+        }
+
+
+    def close(self):
+        if self.files is None:
+            return
+        for f in self.files.itervalues():
+            f.close()
+
+        lengths = OrderedDict(self.lengths)
+        for name, (blob, offsets) in self._string_tables().iteritems():
+            blob_path, offsets_path = _strings_paths(self.out_dir, name)
+            blob.tofile(blob_path)
+            offsets.tofile(offsets_path)
+            lengths[name + '.strings'] = len(offsets) - 1
+
+        meta = OrderedDict([
+            ('version', FORMAT_VERSION),
+            ('options', self._options()),
+            ('lengths', lengths),
+        ])
+        with open(os.path.join(self.out_dir, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+
+    def frozen(self, intern_labels=True):
+        '''
+        Make a read-only ColumnarCorpus of the documents written so far,
+        held in memory (only for writers without an `out_dir`).
+        '''
+        if self.files is not None:
+            raise ValueError('Only in-memory writers can be frozen.')
+
+        columns = OrderedDict()
+        for name, dtype in COLUMNS.iteritems():
+            chunks = self.chunks[name]
+            columns[name] = (
+                numpy.concatenate(chunks) if chunks
+                else numpy.zeros(0, dtype)
+            )
+
+        strings = OrderedDict(
+            (name, _Strings(blob, offsets))
+            for name, (blob, offsets) in self._string_tables().iteritems()
+        )
+        return ColumnarCorpus.from_arrays(
+            columns, strings, self._options(), intern_labels)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _Strings(object):
+    '''
+    A string table, held as the utf8 `blob` of all of its strings, and
+    their `offsets` in it.  Strings are decoded when they are first asked
+    for, and kept, so each is shared by all the tokens using it.
+    '''
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+        self.decoded = {}
+        self.ids = None
+
+
+    @classmethod
+    def open(cls, out_dir, name, length):
+        '''
+        Memory-map the string table called `name`, holding `length` strings.
+        '''
+        blob_path, offsets_path = _strings_paths(out_dir, name)
+        offsets = _open_array(offsets_path, 'int64', length + 1)
+        blob = _open_array(blob_path, 'uint8', int(offsets[-1]))
+        return cls(blob, offsets)
+
+
+    def __getitem__(self, string_id):
+        string = self.decoded.get(string_id)
+        if string is None:
+            start, end = self.offsets[string_id:string_id + 2]
+            string = self.blob[start:end].tostring().decode('utf8')
+            self.decoded[string_id] = string
+        return string
+
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+    def index(self, string):
+        '''
+        The id of `string` (this decodes the whole table, once).
+        '''
+        if self.ids is None:
+            self.ids = dict((self[i], i) for i in xrange(len(self)))
+        try:
+            return self.ids[string]
+        except KeyError:
+            raise ValueError('%r is not in the table.' % string)
+
+
+class ColumnarCorpus(object):
+    '''
+    A columnar corpus written by ColumnarWriter, in `path`.  Documents are
+    referred to by their position in the corpus.  Rebuilt documents have
+    their labels interned, unless `intern_labels` is false (see
+    AnnotatedText).
+    '''
+
+    def __init__(self, path, intern_labels=True):
+        _require_numpy()
+        self.path = path
+        self.intern_labels = intern_labels
+        if path is None:
+            return
+
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError('Unsupported columnar corpus version.')
+
+        self.options = meta['options']
+        lengths = meta['lengths']
+        self.columns = OrderedDict(
+            (name, _open_array(
+                _column_path(path, name), dtype, lengths[name]))
+            for name, dtype in COLUMNS.iteritems()
+        )
+        self.strings = OrderedDict(
+            (name, _Strings.open(path, name, lengths[name + '.strings']))
+            for name in STRING_TABLES
+        )
+
+
+    @classmethod
+    def from_arrays(cls, columns, strings, options, intern_labels=True):
+        '''
+        Make a corpus of `columns` and `strings` held in memory.  The
+        arrays are made read-only.
+        '''
+        corpus = cls(None, intern_labels)
+        corpus.options = options
+        corpus.columns = columns
+        corpus.strings = strings
+        for array in columns.values():
+            array.flags.writeable = False
+        for table in strings.values():
+            table.blob.flags.writeable = False
+            table.offsets.flags.writeable = False
+        return corpus
+
+
+    def __len__(self):
+        return len(self.columns['document_has_aida'])
+
+
+    def doc_id(self, doc):
+        return self.strings['doc_id'][doc]
+
+
+    def index(self, doc_id):
+        '''
+        The position of the document whose id is `doc_id`.
+        '''
+        return self.strings['doc_id'].index(doc_id)
+
+
+    def label(self, table, label_id):
+        '''
+        The label whose id is `label_id` in the string table `table`.
+        '''
+        return self.strings[table][label_id]
+
+
+    def _range(self, name, i):
+        offsets = self.columns[name]
+        return int(offsets[i]), int(offsets[i + 1])
+
+
+    def sentence_range(self, doc):
+        '''
+        The range of corpus-wide sentence positions of document `doc`.
+        '''
+        return self._range('document_sentence_offsets', doc)
+
+
+    def token_range(self, doc):
+        '''
+        The range of corpus-wide token positions of document `doc`.
+        '''
+        start, stop = self.sentence_range(doc)
+        offsets = self.columns['sentence_token_offsets']
+        return int(offsets[start]), int(offsets[stop])
+
+
+    def document_tokens(self, doc):
+        '''
+        The token columns of document `doc`, as an OrderedDict mapping
+        field names to slices of the memory-mapped arrays, along with the
+        document's sentence boundaries ("sentence_offsets", relative to its
+        first token).
+        '''
+        start, stop = self.token_range(doc)
+        columns = OrderedDict(
+            (field, self.columns[field][start:stop])
+            for field in self.options['token_fields']
+        )
+        sentence_start, sentence_stop = self.sentence_range(doc)
+        columns['sentence_offsets'] = (
+            self.columns['sentence_token_offsets'][
+                sentence_start:sentence_stop + 1] - start
+        )
+        return columns
+
+
+    def _reader(self):
+        return AnnotatedText(
+            dependencies=self.options['dependencies'],
+            exclude_ordinal_NERs=self.options['exclude_ordinal_NERs'],
+            token_fields=[str(f) for f in self.options['token_fields']],
+            intern_labels=self.intern_labels, keep_text=False,
+            keep_soup=False
+        )
+
+
+    def _build_sentence(self, reader, position, sentence_id):
+        '''
+        Build the Sentence at corpus-wide `position`, giving it the id
+        `sentence_id`.
+        '''
+        columns = self.columns
+        strings = self.strings
+
+        start, stop = self._range('sentence_token_offsets', position)
+        fields = []
+        for field in reader.token_fields:
+            values = columns[field][start:stop].tolist()
+            if field in LABEL_FIELDS:
+                table = strings[field]
+                values = [None if v < 0 else table[v] for v in values]
+            else:
+                values = [None if v < 0 else v for v in values]
+            fields.append((field, values))
+        tokens = [
+            (token_id, dict(
+                (field, values[token_id]) for field, values in fields))
+            for token_id in xrange(stop - start)
+        ]
+
+        start, stop = self._range('sentence_edge_offsets', position)
+        dep = strings['dep']
+        edges = zip(
+            columns['edge_governor'][start:stop].tolist(),
+            columns['edge_dependent'][start:stop].tolist(),
+            [dep[r] for r in columns['edge_relation'][start:stop].tolist()]
+        )
+
+        start, stop = self._range('sentence_node_offsets', position)
+        c_tag = strings['c_tag']
+        nodes = zip(
+            columns['node_parent'][start:stop].tolist(),
+            [c_tag[t] for t in columns['node_tag'][start:stop].tolist()],
+            columns['node_depth'][start:stop].tolist(),
+            [
+                None if t < 0 else t
+                for t in columns['node_token'][start:stop].tolist()
+            ]
+        )
+
+        return reader._assemble_sentence(sentence_id, tokens, edges, nodes)
+
+
+    def sentence(self, doc, sentence_id):
+        '''
+        Build the Sentence whose id is `sentence_id` in document `doc`,
+        with its tokens, parses, and named entities, but without links to
+        the document's references.
+        '''
+        start, stop = self.sentence_range(doc)
+        if not 0 <= sentence_id < stop - start:
+            raise IndexError('sentence id out of range')
+        return self._build_sentence(
+            self._reader(), start + sentence_id, sentence_id)
+
+
+    def sentences(self, doc):
+        '''
+        Build all of the Sentences of document `doc`, as by sentence().
+        '''
+        reader = self._reader()
+        start, stop = self.sentence_range(doc)
+        return [
+            self._build_sentence(reader, position, position - start)
+            for position in xrange(start, stop)
+        ]
+
+
+    def _references(self, doc):
+        '''
+        Read the references of document `doc`, as taken by
+        AnnotatedText._assemble_document().
+        '''
+        columns = self.columns
+        kb = self.strings['kb']
+        kb_types = self.strings['kb_types']
+
+        references = []
+        start, stop = self._range('document_reference_offsets', doc)
+        for position in xrange(start, stop):
+            mentions = []
+            mention_start, mention_stop = self._range(
+                'reference_mention_offsets', position)
+            for m in xrange(mention_start, mention_stop):
+                kb_id = int(columns['mention_kb'][m])
+                aida_link = None
+                if kb_id >= 0:
+                    aida_link = (
+                        kb[kb_id], float(columns['mention_score'][m]),
+                        json.loads(kb_types[kb_id])
+                    )
+                head = int(columns['mention_head'][m])
+                entity_idx = int(columns['mention_entity_idx'][m])
+                mentions.append((
+                    int(columns['mention_sentence'][m]),
+                    int(columns['mention_start'][m]),
+                    int(columns['mention_end'][m]),
+                    None if head < 0 else head,
+                    bool(columns['mention_is_representative'][m]),
+                    None if entity_idx < 0 else entity_idx,
+                    bool(columns['mention_is_created'][m]),
+                    aida_link
+                ))
+
+            kb_id = int(columns['reference_kb'][position])
+            references.append((
+                int(columns['reference_id'][position]),
+                bool(columns['reference_is_coreference'][position]),
+                kb[kb_id] if kb_id >= 0 else None,
+                json.loads(kb_types[kb_id]) if kb_id >= 0 else None,
+                mentions
+            ))
+
+        return references
+
+
+    def document(self, doc):
+        '''
+        Build the AnnotatedText of document `doc`, with its coreference
+        and AIDA links.
+        '''
+        reader = self._reader()
+        start, stop = self.sentence_range(doc)
+        sentences = [
+            self._build_sentence(reader, position, position - start)
+            for position in xrange(start, stop)
+        ]
+
+        source_sentence_ids = None
+        if self.columns['document_is_filtered'][doc]:
+            source_sentence_ids = (
+                self.columns['sentence_source_id'][start:stop].tolist())
+
+        reader._assemble_document(
+            sentences, self._references(doc),
+            bool(self.columns['document_has_aida'][doc]),
+            int(self.columns['document_next_reference_id'][doc]),
+            source_sentence_ids
+        )
+        return reader
+
+
+def freeze(documents, intern_labels=True):
+    '''
+    Freeze the (doc_id, annotated_text) pairs in `documents` into a
+    read-only ColumnarCorpus held in memory (every document needs an id).
+    All of the documents' data then sits in a few dozen large buffers,
+    rather than in millions of dicts, lists, and strings.  Reading the
+    corpus doesn't touch the buffers' reference counts (nor does the
+    garbage collector visit them), so after forking, worker processes can
+    read it without copying its pages.  Documents and sentences are
+    rebuilt in the worker when they are used (see ColumnarCorpus), and
+    can be dropped afterwards.
+    '''
+    writer = ColumnarWriter()
+    for doc_id, annotated_text in documents:
+        writer.write(annotated_text, doc_id)
+    return writer.frozen(intern_labels)
+
+
+def write_corpus(
+    pairs, out_dir, executor='process', workers=None, max_in_flight=None,
+    **kwargs
+):
+    '''
+    Parse each (corenlp_path, aida_path) pair in `pairs` in a pool of
+    workers (see corpus.CorpusLoader), and write the documents, in order,
+    to a columnar corpus in `out_dir`, using article ids as document ids.
+    Keyword arguments are passed on to AnnotatedText.  Returns the number
+    of documents written.
+    '''
+    _require_numpy()
+
+    num_documents = 0
+    with CorpusLoader(executor, workers, max_in_flight) as loader:
+        with ColumnarWriter(out_dir) as writer:
+
+            # The workers send back plain rows, rather than whole documents
+            for doc_id, rows in loader.iter_contents(
+                iter_pair_contents(pairs), transform=document_rows, **kwargs
+            ):
+                writer.write_rows(rows)
+                num_documents += 1
+
+    return num_documents
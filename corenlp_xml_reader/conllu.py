@@ -0,0 +1,263 @@
+'''
+Export to the CoNLL-U format (http://universaldependencies.org/format.html).
+
+Each token is written with the ten standard columns.  CoreNLP's POS tags
+are Penn Treebank tags, so they go in XPOS, and UPOS is left blank.  DEPS
+lists all of a token's governors, while HEAD and DEPREL must form a tree.
+Collapsed dependencies aren't one (a token can have several governors, or
+none, as punctuation does), so each token's HEAD is the first governor
+through which it is reached from the root, and tokens that can't be
+reached are attached to the root as "dep".  With basic dependencies,
+HEAD and DEPREL are those of the basic tree.
+
+Extra columns can be added, in which case the output follows CoNLL-U Plus,
+and starts with a line declaring the columns.  The available extras are:
+
+    ner       the token's named entity type
+    offsets   the token's character offsets, as "begin-end"
+    coref     ids of the references (coreference chains) the token is in
+    kb        AIDA kbIdentifiers of the references the token is in
+
+Token fields that weren't read (see AnnotatedText's token_fields) are
+left blank.  Sentence ids are unique within a file: the sentences of a
+document that has an id are numbered "<doc_id>-<n>", and other sentences
+by their position in the file.  Output is written in buffered chunks,
+from AnnotatedText objects or straight from a stream of sentences, so
+whole corpora can be converted in constant memory.
+'''
+
+from collections import deque
+from corpus import CorpusLoader, iter_pair_contents
+
+
+STANDARD_COLUMNS = [
+    'ID', 'FORM', 'LEMMA', 'UPOS', 'XPOS', 'FEATS', 'HEAD', 'DEPREL', 'DEPS',
+    'MISC'
+]
+EXTRA_COLUMNS = ['ner', 'offsets', 'coref', 'kb']
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+def _field(value):
+    '''
+    CoNLL-U uses an underscore for empty fields, and fields can't contain
+    tabs or newlines.
+    '''
+    if value is None or value == '':
+        return u'_'
+    value = unicode(value)
+    return value.replace(u'\t', u' ').replace(u'\n', u' ')
+
+
+def _token_references(token):
+    '''
+    The references whose mentions include `token`, without repeats.
+    '''
+    references = []
+    for mention in token.get('mentions', []):
+        reference = mention.get('reference')
+        if reference is not None and reference not in references:
+            references.append(reference)
+    return references
+
+
+def _extra_fields(token, extra_columns):
+    fields = []
+    for column in extra_columns:
+        if column == 'ner':
+            fields.append(_field(token.get('ner')))
+        elif column == 'offsets':
+            if 'character_offset_begin' in token:
+                fields.append(u'%d-%d' % (
+                    token['character_offset_begin'],
+                    token['character_offset_end']
+                ))
+            else:
+                fields.append(u'_')
+        elif column == 'coref':
+            fields.append(_field(u'|'.join(
+                unicode(r['id']) for r in _token_references(token))))
+        elif column == 'kb':
+            fields.append(_field(u'|'.join(
+                r['kbIdentifier'] for r in _token_references(token)
+                if 'kbIdentifier' in r
+            )))
+    return fields
+
+
+def _tree_heads(sentence):
+    '''
+    Choose a (head, deprel) pair for each token of `sentence`, in order,
+    such that they form a tree (see the module docstring).  Heads are
+    1-based, and 0 is the root.  Without a root dependency, the first
+    token is taken as the root.
+    '''
+    tokens = sentence['tokens']
+    heads = [None] * len(tokens)
+    if not tokens:
+        return heads
+
+    root_id = sentence.get('root', {}).get('id')
+    if root_id is None:
+        root_id = 0
+    heads[root_id] = (u'0', u'root')
+
+    # Walk the dependencies breadth first from the root
+    governors = deque([tokens[root_id]])
+    while governors:
+        governor = governors.popleft()
+        for relation, dependent in governor.get('children', []):
+            if heads[dependent['id']] is None:
+                heads[dependent['id']] = (
+                    unicode(governor['id'] + 1), relation)
+                governors.append(dependent)
+
+    for token_id, head in enumerate(heads):
+        if head is None:
+            heads[token_id] = (unicode(root_id + 1), u'dep')
+    return heads
+
+
+def sentence_lines(sentence, extra_columns=(), sent_id=None):
+    '''
+    Return the CoNLL-U lines (as unicode strings, without newlines) for
+    `sentence`, including its comment lines and the blank line after it.
+    '''
+    if sent_id is None:
+        sent_id = sentence['id'] + 1
+
+    lines = [
+        u'# sent_id = %s' % sent_id,
+        u'# text = %s' % sentence.as_string(),
+    ]
+
+    root_id = sentence.get('root', {}).get('id')
+    heads = _tree_heads(sentence)
+    for token in sentence['tokens']:
+
+        # CoNLL-U ids are 1-based, and 0 is the root
+        head, deprel = heads[token['id']]
+        deps = [(g['id'] + 1, rel) for rel, g in token.get('parents', [])]
+        if token['id'] == root_id:
+            deps.append((0, u'root'))
+        if not deps:
+            deps.append((int(head), deprel))
+        deps.sort()
+
+        fields = [
+            unicode(token['id'] + 1),
+            _field(token.get('word')),
+            _field(token.get('lemma')),
+            u'_',
+            _field(token.get('pos')),
+            u'_',
+            head,
+            _field(deprel),
+            _field(u'|'.join(u'%d:%s' % dep for dep in deps)),
+            u'_',
+        ] + _extra_fields(token, extra_columns)
+
+        lines.append(u'\t'.join(fields))
+
+    lines.append(u'')
+    return lines
+
+
+def _iter_sentences(items):
+    '''
+    Yield (doc_id, is_first, sentence) from a stream of AnnotatedText
+    objects, Sentences, or (doc_id, AnnotatedText) pairs.  doc_id is None
+    unless the sentence's document has an id, and is_first tells whether
+    the sentence is its document's first.
+    '''
+    for item in items:
+        doc_id = None
+        if isinstance(item, tuple):
+            doc_id, item = item
+
+        if hasattr(item, 'sentences'):
+            for i, sentence in enumerate(item.sentences):
+                yield doc_id, i == 0, sentence
+        else:
+            yield None, False, item
+
+
+def write_conllu(
+    items, out, extra_columns=(), buffer_size=DEFAULT_BUFFER_SIZE
+):
+    '''
+    Write `items` to `out` (a path or a file object opened for writing
+    bytes) as CoNLL-U.  `items` is an iterable of AnnotatedText objects,
+    of (doc_id, AnnotatedText) pairs, or of Sentences.  Output is
+    buffered and written in chunks of about `buffer_size` bytes.  Returns
+    the number of sentences written.
+    '''
+    for column in extra_columns:
+        if column not in EXTRA_COLUMNS:
+            raise ValueError(
+                'extra_columns must be among %s.' % ', '.join(EXTRA_COLUMNS))
+
+    close_out = False
+    if isinstance(out, basestring):
+        out = open(out, 'wb')
+        close_out = True
+
+    try:
+        chunk = []
+        chunk_size = 0
+
+        if extra_columns:
+            header = u'# global.columns = %s' % u' '.join(
+                STANDARD_COLUMNS + [c.upper() for c in extra_columns])
+            chunk.append(header + u'\n')
+
+        num_sentences = 0
+        for doc_id, is_first, sentence in _iter_sentences(items):
+
+            # Sentence ids must be unique within the file
+            if doc_id is not None:
+                sent_id = u'%s-%d' % (doc_id, sentence['id'] + 1)
+            else:
+                sent_id = num_sentences + 1
+
+            lines = sentence_lines(sentence, extra_columns, sent_id)
+            if doc_id is not None and is_first:
+                lines.insert(0, u'# newdoc id = %s' % doc_id)
+            text = u'\n'.join(lines) + u'\n'
+
+            chunk.append(text)
+            chunk_size += len(text)
+            num_sentences += 1
+
+            if chunk_size >= buffer_size:
+                out.write(u''.join(chunk).encode('utf8'))
+                chunk = []
+                chunk_size = 0
+
+        if chunk:
+            out.write(u''.join(chunk).encode('utf8'))
+
+    finally:
+        if close_out:
+            out.close()
+
+    return num_sentences
+
+
+def convert_corpus(
+    pairs, out, extra_columns=(), buffer_size=DEFAULT_BUFFER_SIZE,
+    executor='process', workers=None, max_in_flight=None, **kwargs
+):
+    '''
+    Load each (corenlp_path, aida_path) pair in `pairs` using a pool of
+    workers (see corpus.CorpusLoader), and write them all to `out` as
+    CoNLL-U, one document after the other, each headed by its article id.
+    Only `max_in_flight` documents are held at once.  Keyword arguments
+    are passed on to AnnotatedText.  Returns the number of sentences
+    written.
+    '''
+    with CorpusLoader(executor, workers, max_in_flight) as loader:
+        return write_conllu(
+            loader.iter_contents(iter_pair_contents(pairs), **kwargs), out,
+            extra_columns, buffer_size
+        )
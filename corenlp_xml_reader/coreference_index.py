@@ -0,0 +1,201 @@
+'''
+A compact index of a document's coreference layer.  Tokens, mentions, and
+references are numbered within the document, and the links between them
+are held in flat integer arrays, in both directions, in the "compressed
+sparse row" layout: the items linked to entry i are found at
+`ids[offsets[i]:offsets[i+1]]`.  The index is built in one linear pass
+over the references, and answers questions such as which references a
+token belongs to, or which sentences a reference is mentioned in, by
+slicing these arrays:
+
+    index = article.coreference_index
+    index.references_for_token(token)
+    index.mentions_in_sentence(sentence_id)
+    index.sentences_for_reference(reference)
+
+Numbering:
+
+    token       position in the document (the sentence's first token's
+                position, plus the token's id)
+    mention     position in the list of all mentions, taken reference by
+                reference, so each reference's mentions are contiguous
+    reference   position in `references`
+'''
+
+from array import array
+from itertools import izip
+
+
+def _group(num_keys, keys, values):
+    '''
+    Counting sort of `values` by `keys` (integers below `num_keys`).
+    Returns (offsets, ids) such that the values having key k are
+    `ids[offsets[k]:offsets[k+1]]`, in their original order.
+    '''
+    offsets = array('l', [0]) * (num_keys + 1)
+    for key in keys:
+        offsets[key + 1] += 1
+    for i in xrange(num_keys):
+        offsets[i + 1] += offsets[i]
+
+    ids = array('l', [0]) * len(values)
+    fill = array('l', offsets)
+    for key, value in izip(keys, values):
+        ids[fill[key]] = value
+        fill[key] += 1
+
+    return offsets, ids
+
+
+class CoreferenceIndex(object):
+    '''
+    Index of the links between the tokens, mentions, and references of the
+    document made of `sentences` and `references`.  The index is a
+    snapshot: it needs to be rebuilt if references are added.
+    '''
+
+    def __init__(self, sentences, references):
+        self.sentences = sentences
+        self.references = references
+
+        # Position of each sentence's first token
+        self.sentence_token_offsets = array('l', [0])
+        for sentence in sentences:
+            self.sentence_token_offsets.append(
+                self.sentence_token_offsets[-1] + len(sentence['tokens']))
+        num_tokens = self.sentence_token_offsets[-1]
+
+        # Number the mentions, and record each mention's reference and
+        # sentence, and the tokens it covers
+        self.mentions = []
+        self.reference_mention_offsets = array('l', [0])
+        self.mention_references = array('l')
+        self.mention_sentences = array('l')
+        self.reference_positions = {}
+        token_keys = array('l')
+        token_values = array('l')
+        reference_keys = array('l')
+        sentence_keys = array('l')
+
+        for reference_idx, reference in enumerate(references):
+            self.reference_positions[reference['id']] = reference_idx
+            reference_sentences = set()
+
+            for mention in reference['mentions']:
+                mention_idx = len(self.mentions)
+                self.mentions.append(mention)
+                self.mention_references.append(reference_idx)
+                self.mention_sentences.append(mention['sentence_id'])
+                reference_sentences.add(mention['sentence_id'])
+
+                for token in mention['tokens']:
+                    token_keys.append(self.token_position(token))
+                    token_values.append(mention_idx)
+
+            self.reference_mention_offsets.append(len(self.mentions))
+
+            for sentence_id in sorted(reference_sentences):
+                reference_keys.append(reference_idx)
+                sentence_keys.append(sentence_id)
+
+        mention_ids = array('l', xrange(len(self.mentions)))
+
+        # Token -> mentions
+        self.token_mention_offsets, self.token_mention_ids = _group(
+            num_tokens, token_keys, token_values)
+
+        # Sentence -> mentions
+        self.sentence_mention_offsets, self.sentence_mention_ids = _group(
+            len(sentences), self.mention_sentences, mention_ids)
+
+        # Reference -> sentences, and sentence -> references
+        self.reference_sentence_offsets, self.reference_sentence_ids = (
+            _group(len(references), reference_keys, sentence_keys))
+        self.sentence_reference_offsets, self.sentence_reference_ids = (
+            _group(len(sentences), sentence_keys, reference_keys))
+
+
+    def token_position(self, token):
+        '''
+        The position of `token` within the document.
+        '''
+        return self.sentence_token_offsets[token['sentence_id']] + token['id']
+
+
+    def reference_position(self, reference):
+        '''
+        The position of `reference` in `references`.
+        '''
+        return self.reference_positions[reference['id']]
+
+
+    def mentions_for_token(self, token):
+        '''
+        The mentions that include `token`.
+        '''
+        position = self.token_position(token)
+        start = self.token_mention_offsets[position]
+        end = self.token_mention_offsets[position + 1]
+        return [self.mentions[i] for i in self.token_mention_ids[start:end]]
+
+
+    def references_for_token(self, token):
+        '''
+        The references having a mention that includes `token`, without
+        repeats.
+        '''
+        position = self.token_position(token)
+        start = self.token_mention_offsets[position]
+        end = self.token_mention_offsets[position + 1]
+
+        reference_ids = []
+        for mention_idx in self.token_mention_ids[start:end]:
+            reference_idx = self.mention_references[mention_idx]
+            if reference_idx not in reference_ids:
+                reference_ids.append(reference_idx)
+        return [self.references[i] for i in reference_ids]
+
+
+    def mentions_in_sentence(self, sentence_id):
+        '''
+        The mentions found in the sentence whose id is `sentence_id`.
+        '''
+        start = self.sentence_mention_offsets[sentence_id]
+        end = self.sentence_mention_offsets[sentence_id + 1]
+        return [
+            self.mentions[i] for i in self.sentence_mention_ids[start:end]]
+
+
+    def references_in_sentence(self, sentence_id):
+        '''
+        The references mentioned in the sentence whose id is `sentence_id`.
+        '''
+        start = self.sentence_reference_offsets[sentence_id]
+        end = self.sentence_reference_offsets[sentence_id + 1]
+        return [
+            self.references[i]
+            for i in self.sentence_reference_ids[start:end]
+        ]
+
+
+    def sentences_for_reference(self, reference):
+        '''
+        The sentences in which `reference` is mentioned, in order.
+        '''
+        position = self.reference_position(reference)
+        start = self.reference_sentence_offsets[position]
+        end = self.reference_sentence_offsets[position + 1]
+        return [
+            self.sentences[i]
+            for i in self.reference_sentence_ids[start:end]
+        ]
+
+
+    def mentions_for_reference(self, reference):
+        '''
+        The mentions of `reference`.
+        '''
+        position = self.reference_position(reference)
+        start = self.reference_mention_offsets[position]
+        end = self.reference_mention_offsets[position + 1]
+        return self.mentions[start:end]
@@ -0,0 +1,374 @@
+'''
+Utilities for loading many CoreNLP-annotated documents (and their optional
+AIDA disambiguations) without blocking the caller on each parse.
+'''
+
+from collections import deque
+import cPickle
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+from annotated_text import AnnotatedText, require_picklable
+from sources import COMPRESSED_EXTENSIONS
+
+
+LEGAL_EXECUTORS = set(['process', 'thread'])
+
+
+def read_file(path):
+    '''
+    Read the full contents of the file at `path`, or return None if `path`
+    is None (which is used to indicate that a document has no AIDA file).
+    Compressed files are returned as they are; AnnotatedText decompresses
+    them as it reads them.
+    '''
+    if path is None:
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def split_article_id(fname, ext):
+    '''
+    If `fname` is "<article-id><ext>", possibly followed by a compression
+    extension such as ".gz", return the article id.  Otherwise return None.
+    '''
+    for compressed_ext in [''] + COMPRESSED_EXTENSIONS:
+        suffix = ext + compressed_ext
+        if fname.endswith(suffix) and len(fname) > len(suffix):
+            return fname[:-len(suffix)]
+    return None
+
+
+def find_corpus_pairs(corenlp_dir, aida_dir=None):
+    '''
+    List (corenlp_path, aida_path) pairs for the CoreNLP xml files found
+    in `corenlp_dir`, sorted by article id.  CoreNLP files are named
+    "<article-id>.xml" and AIDA files "<article-id>.json", either of which
+    can carry a compression extension (".gz", ".bz2" or ".xz").  If
+    `aida_dir` is None, or an article has no AIDA file, its aida_path is
+    None.
+    '''
+    pairs = []
+    for fname in sorted(os.listdir(corenlp_dir)):
+        article_id = split_article_id(fname, '.xml')
+        if article_id is None:
+            continue
+
+        aida_path = None
+        if aida_dir is not None:
+            for compressed_ext in [''] + COMPRESSED_EXTENSIONS:
+                candidate = os.path.join(
+                    aida_dir, article_id + '.json' + compressed_ext)
+                if os.path.exists(candidate):
+                    aida_path = candidate
+                    break
+
+        pairs.append((os.path.join(corenlp_dir, fname), aida_path))
+
+    return pairs
+
+
+def iter_pair_contents(pairs):
+    '''
+    Read the (corenlp_path, aida_path) pairs in `pairs` one at a time,
+    yielding (article_id, corenlp_xml, aida_json) triples, as taken by
+    CorpusLoader.iter_contents().
+    '''
+    for corenlp_path, aida_path in pairs:
+        yield (
+            split_article_id(os.path.basename(corenlp_path), '.xml'),
+            read_file(corenlp_path),
+            read_file(aida_path)
+        )
+
+
+def load(corenlp_path, aida_path=None, **kwargs):
+    '''
+    Load a single document from its CoreNLP xml file and (optionally) its
+    AIDA json file.  Keyword arguments are passed on to AnnotatedText.
+    '''
+    return AnnotatedText(
+        read_file(corenlp_path), read_file(aida_path), **kwargs)
+
+
+def _build_annotated_text(args):
+    '''
+    Worker that builds an AnnotatedText from already-read file contents.
+    This needs to be a module-level function so that it can be sent to
+    worker processes.
+    '''
+    corenlp_xml, aida_json, kwargs = args
+    return AnnotatedText(corenlp_xml, aida_json, **kwargs)
+
+
+def _build_and_transform(args):
+    '''
+    Worker that builds an AnnotatedText and returns the result of calling
+    `transform(annotated_text, key)` on it, so that only the (usually
+    smaller) result needs to be sent back from the worker.
+    '''
+    corenlp_xml, aida_json, kwargs, transform, key = args
+    return transform(AnnotatedText(corenlp_xml, aida_json, **kwargs), key)
+
+
+def _try_build_annotated_text(args):
+    '''
+    Like _build_annotated_text, but returns an (error, annotated_text) 
+    pair instead of raising, so that a failed document still triggers
+    the pool's callback.
+    '''
+    try:
+        return None, _build_annotated_text(args)
+    except Exception, e:
+        return e, None
+
+
+def _try_build_pickled(args):
+    '''
+    Like _try_build_annotated_text, but returns the AnnotatedText already
+    pickled.  A process pool doesn't call back for results it can't send,
+    so pickling it here reports those as errors too.
+    '''
+    try:
+        return None, cPickle.dumps(
+            _build_annotated_text(args), cPickle.HIGHEST_PROTOCOL)
+    except Exception, e:
+        return e, None
+
+
+class PendingDocument(object):
+    '''
+    Handle for a document being loaded by CorpusLoader.load_async().
+    '''
+
+    def __init__(self):
+        self.async_result = None
+        self.error = None
+        self.annotated_text = None
+
+
+    def ready(self):
+        return self.async_result.ready()
+
+
+    def wait(self, timeout=None):
+        self.async_result.wait(timeout)
+
+
+    def get(self, timeout=None):
+        '''
+        Return the AnnotatedText, waiting for it if necessary.  If loading
+        the document failed, the error is raised here.
+        '''
+        # The loader's callback has filled in the result by the time the
+        # pool's result is ready
+        self.async_result.get(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.annotated_text
+
+
+class CorpusLoader(object):
+    '''
+    Loads documents in a pool of worker processes (or threads), so that
+    the calling thread is free while the CPU-bound parsing happens.
+    File reads happen in the calling thread, overlapping with the parsing
+    of documents that were submitted earlier.
+
+    At most `max_in_flight` documents are held by the loader at any time
+    (read but not yet handed back to the caller), which keeps memory
+    predictable when many documents are requested at once.
+
+    If `initializer` is given, each worker calls `initializer(*initargs)`
+    when it starts, which can be used to hand workers state that is 
+    needed by a `transform` (see iter_contents), once per worker rather
+    than once per document.
+    '''
+
+    def __init__(
+        self, executor='process', workers=None, max_in_flight=None,
+        initializer=None, initargs=()
+    ):
+
+        if executor not in LEGAL_EXECUTORS:
+            raise ValueError('executor must be one of "process" or "thread".')
+
+        self.executor = executor
+        self.workers = workers if workers is not None else cpu_count()
+
+        # By default allow enough documents in flight to keep every worker
+        # busy while the caller consumes finished documents
+        if max_in_flight is None:
+            max_in_flight = 2 * self.workers
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1.')
+        self.max_in_flight = max_in_flight
+
+        if executor == 'process':
+            self.pool = Pool(self.workers, initializer, initargs)
+        else:
+            self.pool = ThreadPool(self.workers, initializer, initargs)
+
+        # Limits the number of documents submitted using load_async that
+        # have not yet finished.
+        self.in_flight = threading.BoundedSemaphore(self.max_in_flight)
+
+
+    def _check_picklable(self, kwargs, transform=None):
+        '''
+        Functions sent to worker processes must be module-level functions.
+        Check them before submitting anything, rather than failing inside
+        the pool.
+        '''
+        if self.executor == 'process':
+            require_picklable(
+                kwargs.get('sentence_filter'), 'sentence_filter')
+            require_picklable(transform, 'transform')
+
+
+    def load_async(
+        self, corenlp_path, aida_path=None, callback=None,
+        error_callback=None, block=True, **kwargs
+    ):
+        '''
+        Start loading a document, and return immediately with a
+        PendingDocument, whose `get()` method provides the AnnotatedText 
+        once it is ready.  If `callback` is given, it is called with the
+        AnnotatedText when it is ready (from a thread belonging to the
+        loader, so it should hand the document off quickly).  If loading
+        fails, `callback` isn't called, and the error is raised by `get()`
+        and passed to `error_callback`, if that is given.
+
+        If `max_in_flight` documents are already loading, this blocks until
+        one of them finishes, or, if `block` is false, returns None without
+        loading the document.  A document stops counting as in flight as
+        soon as it has loaded or failed.
+        '''
+        self._check_picklable(kwargs)
+        if not self.in_flight.acquire(block):
+            return None
+
+        pending = PendingDocument()
+        pickled = self.executor == 'process'
+
+        def finished(result):
+            self.in_flight.release()
+            error, annotated_text = result
+            if error is None and pickled:
+                try:
+                    annotated_text = cPickle.loads(annotated_text)
+                except Exception, e:
+                    error, annotated_text = e, None
+
+            pending.error = error
+            pending.annotated_text = annotated_text
+            if error is not None:
+                if error_callback is not None:
+                    error_callback(error)
+            elif callback is not None:
+                callback(annotated_text)
+
+        try:
+            corenlp_xml = read_file(corenlp_path)
+            aida_json = read_file(aida_path)
+            pending.async_result = self.pool.apply_async(
+                _try_build_pickled if pickled else _try_build_annotated_text,
+                ((corenlp_xml, aida_json, kwargs),),
+                callback=finished
+            )
+        except:
+            self.in_flight.release()
+            raise
+        return pending
+
+
+    def iter_corpus(self, pairs, **kwargs):
+        '''
+        Yield an AnnotatedText for each (corenlp_path, aida_path) pair in
+        `pairs`, in order.  Documents are read and submitted ahead of the
+        one being yielded, but never more than `max_in_flight` at once.
+        Keyword arguments are passed on to AnnotatedText.
+        '''
+        for key, annotated_text in self.iter_contents(
+            iter_pair_contents(pairs), **kwargs
+        ):
+            yield annotated_text
+
+
+    def iter_contents(self, contents, transform=None, **kwargs):
+        '''
+        Like iter_corpus(), but for documents whose contents have already
+        been read.  `contents` yields (key, corenlp_xml, aida_json) triples,
+        where key is anything that identifies the document, and this yields
+        (key, annotated_text) pairs, in order.  `contents` is only advanced
+        when there is room for another document in flight.
+
+        If `transform` is given, it is called in the worker as
+        `transform(annotated_text, key)`, and its result is yielded in
+        place of the AnnotatedText.  For the process executor it must be
+        a module-level function.
+        '''
+        self._check_picklable(kwargs, transform)
+        pending = deque()
+        contents = iter(contents)
+        exhausted = False
+
+        while True:
+
+            # Top up the documents being worked on.  Reading the next 
+            # document overlaps with parsing of those already submitted.
+            while not exhausted and len(pending) < self.max_in_flight:
+                try:
+                    key, corenlp_xml, aida_json = next(contents)
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                if transform is None:
+                    task = _build_annotated_text, (
+                        corenlp_xml, aida_json, kwargs)
+                else:
+                    task = _build_and_transform, (
+                        corenlp_xml, aida_json, kwargs, transform, key)
+                pending.append(
+                    (key, self.pool.apply_async(task[0], (task[1],))))
+
+            if len(pending) == 0:
+                return
+
+            key, async_result = pending.popleft()
+            yield key, async_result.get()
+
+
+    def close(self):
+        '''
+        Wait for submitted documents to finish, then stop the workers.
+        '''
+        self.pool.close()
+        self.pool.join()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.pool.terminate()
+            self.pool.join()
+
+
+def iter_corpus(
+    pairs, executor='process', workers=None, max_in_flight=None, **kwargs
+):
+    '''
+    Convenience generator that loads the documents listed in `pairs` using
+    a temporary CorpusLoader.  See CorpusLoader.iter_corpus().
+    '''
+    with CorpusLoader(executor, workers, max_in_flight) as loader:
+        for annotated_text in loader.iter_corpus(pairs, **kwargs):
+            yield annotated_text
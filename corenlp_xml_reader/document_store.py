@@ -0,0 +1,638 @@
+'''
+A SQLite database of parsed documents, from which AnnotatedText and
+Sentence objects are rebuilt when they are needed, without going back to
+the CoreNLP and AIDA files.  Each document is stored as rows in these
+tables:
+
+    documents       one row per document, with the options it was read with
+    sentences       one row per sentence
+    tokens          one row per token
+    dependencies    one row per dependency edge (the root's governor is -1)
+    constituents    one row per node of the constituency parse, numbered
+                    in pre-order within each sentence
+    references      one row per reference, with the kbIdentifier AIDA
+                    resolved it to (if any)
+    mentions        one row per mention, numbered within its reference
+    aida_links      one row per mention linked by AIDA
+    kb_types        the YAGO types of each kbIdentifier (shared by all
+                    documents)
+
+Documents are added in batches, each in one transaction:
+
+    store = DocumentStore('corpus.db')
+    store.add_many((doc_id, article) for ...)
+    article = store.document('1234')
+    for doc_id, sentence in store.sentences_mentioning('Barack_Obama'):
+        ...
+
+Rebuilt documents have the same sentences, tokens, parses, references,
+mentions, and AIDA links as the ones that were stored, but neither their
+CoreNLP text nor their parse tree.  Coreference chains dropped by
+`exclude_non_ner_coreferences` aren't stored, and mentions that AIDA made
+across a sentence boundary are rebuilt within their first sentence.
+'''
+
+from collections import OrderedDict
+import json
+import sqlite3
+from annotated_text import AnnotatedText
+from corpus import CorpusLoader, iter_pair_contents
+
+
+DEFAULT_BATCH_SIZE = 256
+
+# SQLite limits the number of parameters in one statement
+MAX_QUERY_PARAMETERS = 500
+
+# The columns of each table, and their types
+TABLES = OrderedDict([
+    ('documents', [
+        ('doc_id', 'TEXT PRIMARY KEY'),
+        ('num_sentences', 'INTEGER'),
+        ('token_fields', 'TEXT'),
+        ('dependencies', 'TEXT'),
+        ('exclude_ordinal_ners', 'INTEGER'),
+        ('has_aida', 'INTEGER'),
+        ('is_filtered', 'INTEGER'),
+        ('next_reference_id', 'INTEGER'),
+    ]),
+    ('sentences', [
+        ('doc_id', 'TEXT'),
+        ('sentence_id', 'INTEGER'),
+        ('source_sentence_id', 'INTEGER'),
+        ('num_tokens', 'INTEGER'),
+    ]),
+    ('tokens', [
+        ('doc_id', 'TEXT'),
+        ('sentence_id', 'INTEGER'),
+        ('token_id', 'INTEGER'),
+        ('word', 'TEXT'),
+        ('lemma', 'TEXT'),
+        ('pos', 'TEXT'),
+        ('ner', 'TEXT'),
+        ('character_offset_begin', 'INTEGER'),
+        ('character_offset_end', 'INTEGER'),
+        ('speaker', 'TEXT'),
+    ]),
+    ('dependencies', [
+        ('doc_id', 'TEXT'),
+        ('sentence_id', 'INTEGER'),
+        ('governor_id', 'INTEGER'),
+        ('dependent_id', 'INTEGER'),
+        ('relation', 'TEXT'),
+    ]),
+    ('constituents', [
+        ('doc_id', 'TEXT'),
+        ('sentence_id', 'INTEGER'),
+        ('node_id', 'INTEGER'),
+        ('parent_id', 'INTEGER'),
+        ('tag', 'TEXT'),
+        ('depth', 'INTEGER'),
+        ('token_id', 'INTEGER'),
+    ]),
+    ('references', [
+        ('doc_id', 'TEXT'),
+        ('reference_id', 'INTEGER'),
+        ('position', 'INTEGER'),
+        ('is_coreference', 'INTEGER'),
+        ('kb_identifier', 'TEXT'),
+    ]),
+    ('mentions', [
+        ('doc_id', 'TEXT'),
+        ('reference_id', 'INTEGER'),
+        ('mention_idx', 'INTEGER'),
+        ('sentence_id', 'INTEGER'),
+        ('start', 'INTEGER'),
+        ('end', 'INTEGER'),
+        ('head_id', 'INTEGER'),
+        ('is_representative', 'INTEGER'),
+        ('entity_idx', 'INTEGER'),
+        ('is_created', 'INTEGER'),
+    ]),
+    ('aida_links', [
+        ('doc_id', 'TEXT'),
+        ('reference_id', 'INTEGER'),
+        ('mention_idx', 'INTEGER'),
+        ('sentence_id', 'INTEGER'),
+        ('kb_identifier', 'TEXT'),
+        ('disambiguation_score', 'REAL'),
+    ]),
+    ('kb_types', [
+        ('kb_identifier', 'TEXT PRIMARY KEY'),
+        ('types', 'TEXT'),
+    ]),
+])
+
+# Tables whose rows belong to one document
+DOCUMENT_TABLES = [name for name in TABLES if name != 'kb_types']
+
+INDEXES = [
+    ('sentences', ['doc_id', 'sentence_id']),
+    ('tokens', ['doc_id', 'sentence_id', 'token_id']),
+    ('dependencies', ['doc_id', 'sentence_id']),
+    ('constituents', ['doc_id', 'sentence_id']),
+    ('references', ['doc_id', 'position']),
+    ('references', ['kb_identifier']),
+    ('mentions', ['doc_id', 'reference_id', 'mention_idx']),
+    ('aida_links', ['doc_id', 'reference_id', 'mention_idx']),
+    ('aida_links', ['kb_identifier']),
+]
+
+
+def _quote(name):
+    # Some table and column names ("references", "end") are SQL keywords
+    return '"%s"' % name
+
+
+def _insert_statement(name):
+    verb = 'INSERT OR IGNORE' if name == 'kb_types' else 'INSERT'
+    return '%s INTO %s VALUES (%s)' % (
+        verb, _quote(name), ', '.join('?' * len(TABLES[name])))
+
+
+def _add_constituent_rows(rows, doc_id, sentence_id, node):
+    '''
+    Add rows for the constituency tree below `node`, numbering the nodes in
+    pre-order.  Tokens are the leaves, and they keep their token id.
+    '''
+    stack = [(node, -1)]
+    node_id = 0
+    while stack:
+        node, parent_id = stack.pop()
+        rows.append((
+            doc_id, sentence_id, node_id, parent_id, node['c_tag'],
+            node['c_depth'], node.get('id')
+        ))
+        for child in reversed(node['c_children']):
+            stack.append((child, node_id))
+        node_id += 1
+
+
+def document_rows(annotated_text, doc_id=None):
+    '''
+    Return the rows for `annotated_text` in each of the tables, as an
+    OrderedDict mapping table names to lists of tuples.
+    '''
+    rows = OrderedDict((name, []) for name in TABLES)
+    sentences = annotated_text.sentences
+    source_sentence_ids = annotated_text.source_sentence_ids
+
+    rows['documents'].append((
+        doc_id, len(sentences), json.dumps(annotated_text.token_fields),
+        annotated_text.dependencies, int(annotated_text.exclude_ordinal_NERs),
+        int(hasattr(annotated_text, 'disambiguated_references')),
+        int(source_sentence_ids is not None),
+        getattr(annotated_text, 'next_coref_id', 0)
+    ))
+
+    entity_positions = {}
+    for sentence in sentences:
+        sentence_id = sentence['id']
+        rows['sentences'].append((
+            doc_id, sentence_id,
+            source_sentence_ids[sentence_id]
+                if source_sentence_ids is not None else sentence_id,
+            len(sentence['tokens'])
+        ))
+
+        # Edges are stored from the governors' side, so that rebuilt tokens
+        # list their children in the same order
+        for token in sentence['tokens']:
+            rows['tokens'].append(
+                (doc_id, sentence_id, token['id'])
+                + tuple(token.get(field) for field in AnnotatedText.TOKEN_FIELDS)
+            )
+            for relation, child in token['children']:
+                rows['dependencies'].append(
+                    (doc_id, sentence_id, token['id'], child['id'], relation))
+
+        if 'id' in sentence['root']:
+            rows['dependencies'].append(
+                (doc_id, sentence_id, -1, sentence['root']['id'], 'root'))
+
+        if 'c_root' in sentence:
+            _add_constituent_rows(
+                rows['constituents'], doc_id, sentence_id, sentence['c_root'])
+
+        for entity_idx, entity in enumerate(sentence['entities']):
+            entity_positions[id(entity)] = entity_idx
+
+    coreference_ids = set(
+        id(c) for c in getattr(annotated_text, 'coreferences', []))
+
+    for position, reference in enumerate(annotated_text.references):
+        reference_id = reference['id']
+        rows['references'].append((
+            doc_id, reference_id, position,
+            int(id(reference) in coreference_ids),
+            reference.get('kbIdentifier')
+        ))
+        if 'kbIdentifier' in reference:
+            rows['kb_types'].append((
+                reference['kbIdentifier'], json.dumps(reference['types'])))
+
+        for mention_idx, mention in enumerate(reference['mentions']):
+            head = mention['head']
+            rows['mentions'].append((
+                doc_id, reference_id, mention_idx, mention['sentence_id'],
+                mention['start'], mention['end'],
+                head['id'] if head is not None else None,
+                int(mention is reference['representative']),
+                entity_positions.get(id(mention)),
+                int('sentence' in mention)
+            ))
+
+            if 'kbIdentifier' in mention:
+                rows['aida_links'].append((
+                    doc_id, reference_id, mention_idx, mention['sentence_id'],
+                    mention['kbIdentifier'], mention['disambiguationScore']
+                ))
+                rows['kb_types'].append((
+                    mention['kbIdentifier'], json.dumps(mention['types'])))
+
+    return rows
+
+
+class DocumentStore(object):
+    '''
+    A SQLite database, at `path`, of parsed documents, keyed by document
+    id.  The tables are created if they don't exist yet.  Documents are
+    rebuilt with their labels interned, unless `intern_labels` is false
+    (see AnnotatedText).
+    '''
+
+    def __init__(self, path, intern_labels=True):
+        self.path = path
+        self.intern_labels = intern_labels
+        self.connection = sqlite3.connect(path)
+        self._create_tables()
+
+
+    def _create_tables(self):
+        with self.connection:
+            for name, columns in TABLES.iteritems():
+                self.connection.execute(
+                    'CREATE TABLE IF NOT EXISTS %s (%s)' % (
+                        _quote(name),
+                        ', '.join(
+                            '%s %s' % (_quote(column), kind)
+                            for column, kind in columns
+                        )
+                    )
+                )
+            for name, columns in INDEXES:
+                self.connection.execute(
+                    'CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+                        _quote('_'.join([name] + columns)), _quote(name),
+                        ', '.join(_quote(column) for column in columns)
+                    )
+                )
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def add(self, annotated_text, doc_id):
+        '''
+        Store `annotated_text` under `doc_id`, replacing any document
+        already stored under that id.
+        '''
+        self.add_rows([document_rows(annotated_text, doc_id)])
+
+
+    def add_many(self, documents, batch_size=DEFAULT_BATCH_SIZE):
+        '''
+        Store each (doc_id, annotated_text) pair in `documents`, committing
+        them `batch_size` documents at a time.  Returns the number of
+        documents stored.
+        '''
+        return self.add_many_rows(
+            (document_rows(annotated_text, doc_id)
+                for doc_id, annotated_text in documents),
+            batch_size
+        )
+
+
+    def add_many_rows(self, documents_rows, batch_size=DEFAULT_BATCH_SIZE):
+        '''
+        Store the documents whose rows (as made by document_rows()) are in
+        `documents_rows`, committing them `batch_size` documents at a time.
+        Returns the number of documents stored.
+        '''
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1.')
+
+        num_documents = 0
+        batch = []
+        for rows in documents_rows:
+            batch.append(rows)
+            if len(batch) == batch_size:
+                self.add_rows(batch)
+                num_documents += len(batch)
+                batch = []
+        if batch:
+            self.add_rows(batch)
+            num_documents += len(batch)
+
+        return num_documents
+
+
+    def add_rows(self, batch):
+        '''
+        Store the documents whose rows (as made by document_rows()) are in
+        `batch`, in one transaction.
+        '''
+        with self.connection:
+            self._delete([rows['documents'][0][0] for rows in batch])
+            for name in TABLES:
+                self.connection.executemany(
+                    _insert_statement(name),
+                    (row for rows in batch for row in rows[name])
+                )
+
+
+    def _delete(self, doc_ids):
+        for name in DOCUMENT_TABLES:
+            self.connection.executemany(
+                'DELETE FROM %s WHERE doc_id = ?' % _quote(name),
+                ((doc_id,) for doc_id in doc_ids)
+            )
+
+
+    def remove(self, doc_id):
+        '''
+        Remove the document stored under `doc_id`.
+        '''
+        with self.connection:
+            self._delete([doc_id])
+
+
+    def doc_ids(self):
+        '''
+        The ids of the stored documents, in order.
+        '''
+        return [
+            doc_id for doc_id, in self.connection.execute(
+                'SELECT doc_id FROM documents ORDER BY doc_id')
+        ]
+
+
+    def __contains__(self, doc_id):
+        return self._document_row(doc_id) is not None
+
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM documents').fetchone()[0]
+
+
+    def _document_row(self, doc_id):
+        return self.connection.execute(
+            'SELECT token_fields, dependencies, exclude_ordinal_ners, '
+            'has_aida, is_filtered, next_reference_id FROM documents '
+            'WHERE doc_id = ?', (doc_id,)
+        ).fetchone()
+
+
+    def _reader(self, doc_id):
+        '''
+        Make an empty AnnotatedText with the options the document stored
+        under `doc_id` was read with, and return it with the rest of the
+        document's row.
+        '''
+        row = self._document_row(doc_id)
+        if row is None:
+            raise KeyError(doc_id)
+
+        token_fields, dependencies, exclude_ordinal_ners = row[:3]
+        reader = AnnotatedText(
+            dependencies=dependencies,
+            exclude_ordinal_NERs=bool(exclude_ordinal_ners),
+            token_fields=[str(field) for field in json.loads(token_fields)],
+            intern_labels=self.intern_labels, keep_text=False,
+            keep_soup=False
+        )
+        return reader, row[3:]
+
+
+    def _sentence_rows(self, name, doc_id, sentence_ids, order):
+        '''
+        Fetch the rows of the table called `name` for the sentences of
+        `doc_id` (all of them, if `sentence_ids` is None), grouped by
+        sentence id.
+        '''
+        columns = ', '.join(_quote(column) for column, kind in TABLES[name])
+        query = 'SELECT %s FROM %s WHERE doc_id = ?' % (columns, _quote(name))
+        if sentence_ids is None:
+            chunks = [None]
+        else:
+            chunks = [
+                sentence_ids[i:i + MAX_QUERY_PARAMETERS]
+                for i in xrange(0, len(sentence_ids), MAX_QUERY_PARAMETERS)
+            ]
+
+        grouped = {}
+        for chunk in chunks:
+            params = [doc_id]
+            chunk_query = query
+            if chunk is not None:
+                chunk_query += ' AND sentence_id IN (%s)' % ', '.join(
+                    '?' * len(chunk))
+                params.extend(chunk)
+            chunk_query += ' ORDER BY ' + order
+            for row in self.connection.execute(chunk_query, params):
+                grouped.setdefault(row[1], []).append(row)
+
+        return grouped
+
+
+    def _build_sentences(self, reader, doc_id, sentence_ids=None):
+        '''
+        Rebuild the sentences of `doc_id` whose ids are in `sentence_ids`
+        (or all of them), with their tokens, parses, and named entities,
+        as `reader` would have read them.
+        '''
+        token_rows = self._sentence_rows(
+            'tokens', doc_id, sentence_ids, 'sentence_id, token_id')
+        dependency_rows = self._sentence_rows(
+            'dependencies', doc_id, sentence_ids, 'rowid')
+        constituent_rows = self._sentence_rows(
+            'constituents', doc_id, sentence_ids, 'sentence_id, node_id')
+
+        if sentence_ids is None:
+            sentence_ids = [
+                sentence_id for sentence_id, in self.connection.execute(
+                    'SELECT sentence_id FROM sentences WHERE doc_id = ? '
+                    'ORDER BY sentence_id', (doc_id,)
+                )
+            ]
+
+        field_positions = [
+            (field, 3 + AnnotatedText.TOKEN_FIELDS.index(field))
+            for field in reader.token_fields
+        ]
+
+        return [
+            reader._assemble_sentence(
+                sentence_id,
+                [
+                    (row[2], dict(
+                        (field, row[position])
+                        for field, position in field_positions
+                    ))
+                    for row in token_rows.get(sentence_id, [])
+                ],
+                [row[2:] for row in dependency_rows.get(sentence_id, [])],
+                [row[3:] for row in constituent_rows.get(sentence_id, [])]
+            )
+            for sentence_id in sentence_ids
+        ]
+
+
+    def document(self, doc_id):
+        '''
+        Rebuild the AnnotatedText stored under `doc_id`.
+        '''
+        reader, (has_aida, is_filtered, next_reference_id) = self._reader(
+            doc_id)
+
+        source_sentence_ids = None
+        if is_filtered:
+            source_sentence_ids = [
+                source_id for source_id, in self.connection.execute(
+                    'SELECT source_sentence_id FROM sentences '
+                    'WHERE doc_id = ? ORDER BY sentence_id', (doc_id,)
+                )
+            ]
+
+        reader._assemble_document(
+            self._build_sentences(reader, doc_id),
+            self._read_references(doc_id), has_aida, next_reference_id,
+            source_sentence_ids
+        )
+        return reader
+
+
+    def _read_references(self, doc_id):
+        '''
+        Read the references of `doc_id`, as taken by
+        AnnotatedText._assemble_document().
+        '''
+
+        # A reference's kbIdentifier is always that of one of its mentions
+        kb_types = {}
+        aida_links = {}
+        for reference_id, mention_idx, kb_identifier, score, types in (
+            self.connection.execute(
+                'SELECT a.reference_id, a.mention_idx, a.kb_identifier, '
+                'a.disambiguation_score, k.types FROM aida_links a '
+                'JOIN kb_types k ON a.kb_identifier = k.kb_identifier '
+                'WHERE a.doc_id = ?', (doc_id,)
+            )
+        ):
+            kb_types[kb_identifier] = json.loads(types)
+            aida_links[reference_id, mention_idx] = (
+                kb_identifier, score, kb_types[kb_identifier])
+
+        mentions = {}
+        for row in self.connection.execute(
+            'SELECT reference_id, mention_idx, sentence_id, start, "end", '
+            'head_id, is_representative, entity_idx, is_created '
+            'FROM mentions WHERE doc_id = ? '
+            'ORDER BY reference_id, mention_idx', (doc_id,)
+        ):
+            mentions.setdefault(row[0], []).append(
+                row[2:] + (aida_links.get((row[0], row[1])),))
+
+        return [
+            (
+                reference_id, is_coreference, kb_identifier,
+                kb_types.get(kb_identifier), mentions.get(reference_id, [])
+            )
+            for reference_id, is_coreference, kb_identifier in (
+                self.connection.execute(
+                    'SELECT reference_id, is_coreference, kb_identifier '
+                    'FROM "references" WHERE doc_id = ? ORDER BY position',
+                    (doc_id,)
+                )
+            )
+        ]
+
+
+    def sentences(self, doc_id, sentence_ids=None):
+        '''
+        Rebuild the sentences of the document stored under `doc_id` whose
+        ids are in `sentence_ids` (or all of them), without building the
+        rest of the document.  Their tokens, parses, and named entities
+        are rebuilt, but not their links to the document's references.
+        '''
+        reader, rest = self._reader(doc_id)
+        if sentence_ids is not None:
+            sentence_ids = list(sentence_ids)
+        return self._build_sentences(reader, doc_id, sentence_ids)
+
+
+    def query_sentences(self, sql, params=()):
+        '''
+        Run the query `sql`, which selects (doc_id, sentence_id) pairs,
+        and yield (doc_id, Sentence) pairs for the sentences it selects,
+        without repeats.  Sentences are rebuilt as by sentences().
+        '''
+        sentence_ids = OrderedDict()
+        for doc_id, sentence_id in self.connection.execute(sql, params):
+            ids = sentence_ids.setdefault(doc_id, [])
+            if sentence_id not in ids:
+                ids.append(sentence_id)
+
+        for doc_id, ids in sentence_ids.iteritems():
+            for sentence in self.sentences(doc_id, ids):
+                yield doc_id, sentence
+
+
+    def sentences_mentioning(self, kb_identifier):
+        '''
+        Yield (doc_id, Sentence) pairs for the sentences having a mention
+        of a reference resolved to `kb_identifier`, in order.
+        '''
+        return self.query_sentences(
+            'SELECT DISTINCT m.doc_id, m.sentence_id FROM "references" r '
+            'JOIN mentions m ON m.doc_id = r.doc_id '
+            'AND m.reference_id = r.reference_id '
+            'WHERE r.kb_identifier = ? ORDER BY m.doc_id, m.sentence_id',
+            (kb_identifier,)
+        )
+
+
+def store_corpus(
+    pairs, path, batch_size=DEFAULT_BATCH_SIZE, executor='process',
+    workers=None, max_in_flight=None, **kwargs
+):
+    '''
+    Parse each (corenlp_path, aida_path) pair in `pairs` in a pool of
+    workers (see corpus.CorpusLoader), and store the documents in the
+    DocumentStore at `path`, using article ids as document ids.  Keyword
+    arguments are passed on to AnnotatedText.  Returns the number of
+    documents stored.
+    '''
+    with CorpusLoader(executor, workers, max_in_flight) as loader:
+        with DocumentStore(path) as store:
+
+            # The workers send back plain rows, rather than whole documents
+            return store.add_many_rows(
+                (
+                    rows for doc_id, rows in loader.iter_contents(
+                        iter_pair_contents(pairs), transform=document_rows,
+                        **kwargs
+                    )
+                ),
+                batch_size
+            )
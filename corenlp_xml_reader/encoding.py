@@ -0,0 +1,401 @@
+'''
+Integer encoding of documents, for training models.  A Vocabulary maps
+the words, lemmas, POS tags, or NER types found in a corpus to ids, and
+an Encoder uses one Vocabulary per field to turn documents into NumPy
+arrays:
+
+    counts = count_corpus(pairs, workers=8)
+    encoder = Encoder(build_vocabularies(counts, min_count=5))
+    encoder.save('vocabularies.json')
+
+    for batch in encode_corpus(pairs, encoder, batch_size=256):
+        batch['word'], batch['sentence_offsets'], ...
+
+Each encoding is a dict holding one array of ids per field, with an entry
+per token, plus the boundaries of sentences and documents:
+
+    sentence_offsets    the tokens of sentence i are at
+                        [sentence_offsets[i]:sentence_offsets[i+1]]
+    document_offsets    the sentences of document i are at
+                        [document_offsets[i]:document_offsets[i+1]]
+
+Tokens without a named entity are encoded with the NER label "O".  Labels
+missing from a vocabulary get the id of its unknown label, and the
+reserved labels come first, so that "<pad>" is 0.  Counting only needs the
+standard library, while encoding needs numpy.
+'''
+
+from collections import Counter, OrderedDict
+import json
+from corpus import CorpusLoader, iter_pair_contents
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+ENCODED_FIELDS = ['word', 'lemma', 'pos', 'ner']
+DEFAULT_RESERVED = [u'<pad>', u'<unk>']
+DEFAULT_UNKNOWN = u'<unk>'
+DEFAULT_BATCH_SIZE = 64
+OFFSET_KEYS = ['sentence_offsets', 'document_offsets']
+NO_ENTITY = u'O'
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ValueError('Encoding documents needs the numpy package.')
+
+
+def _check_fields(fields):
+    for field in fields:
+        if field not in ENCODED_FIELDS:
+            raise ValueError(
+                'fields must be among %s.' % ', '.join(ENCODED_FIELDS))
+
+
+def _token_label(token, field):
+    label = token.get(field)
+    if label is None and field == 'ner':
+        return NO_ENTITY
+    return label
+
+
+class Vocabulary(object):
+    '''
+    A fixed mapping of labels to ids.  The `reserved` labels get the first
+    ids, in order, followed by `labels`.  Labels that aren't in the
+    vocabulary are given the id of `unknown` (which must be one of the
+    labels), or raise KeyError if `unknown` is None.
+    '''
+
+    def __init__(
+        self, labels=(), reserved=DEFAULT_RESERVED, unknown=DEFAULT_UNKNOWN
+    ):
+        self.reserved = list(reserved)
+        self.labels = []
+        self.ids = {}
+        for label in self.reserved + list(labels):
+            if label not in self.ids:
+                self.ids[label] = len(self.labels)
+                self.labels.append(label)
+
+        if unknown is not None and unknown not in self.ids:
+            raise ValueError('The unknown label must be in the vocabulary.')
+        self.unknown = unknown
+        self.unknown_id = self.ids.get(unknown)
+
+
+    @classmethod
+    def from_counts(
+        cls, counts, min_count=1, max_size=None, reserved=DEFAULT_RESERVED,
+        unknown=DEFAULT_UNKNOWN
+    ):
+        '''
+        Build a vocabulary from a Counter of labels, keeping those seen at
+        least `min_count` times, most frequent first (ties are broken
+        alphabetically).  If `max_size` is given, the vocabulary, including
+        its reserved labels, has at most that many labels, so it can't be
+        smaller than the number of reserved labels.
+        '''
+        if max_size is not None and max_size < len(reserved):
+            raise ValueError(
+                'max_size must be at least the number of reserved labels.')
+        labels = sorted(
+            (label for label, count in counts.iteritems()
+                if count >= min_count and label is not None),
+            key=lambda label: (-counts[label], label)
+        )
+        if max_size is not None:
+            labels = labels[:max_size - len(reserved)]
+        return cls(labels, reserved, unknown)
+
+
+    def id(self, label):
+        '''
+        The id of `label`.
+        '''
+        label_id = self.ids.get(label, self.unknown_id)
+        if label_id is None:
+            raise KeyError(label)
+        return label_id
+
+
+    def label(self, label_id):
+        '''
+        The label whose id is `label_id`.
+        '''
+        return self.labels[label_id]
+
+
+    def __contains__(self, label):
+        return label in self.ids
+
+
+    def __len__(self):
+        return len(self.labels)
+
+
+    def __iter__(self):
+        return iter(self.labels)
+
+
+    def as_dict(self):
+        return OrderedDict([
+            ('labels', self.labels[len(self.reserved):]),
+            ('reserved', self.reserved),
+            ('unknown', self.unknown),
+        ])
+
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['labels'], data['reserved'], data['unknown'])
+
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f)
+
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def count_labels(sentences, fields=ENCODED_FIELDS, counts=None):
+    '''
+    Count the labels of each of the `fields` in `sentences`, adding them
+    to `counts` if given.  Returns an OrderedDict mapping fields to
+    Counters.
+    '''
+    _check_fields(fields)
+    if counts is None:
+        counts = OrderedDict((field, Counter()) for field in fields)
+
+    for sentence in sentences:
+        for field in fields:
+            counts[field].update(
+                _token_label(token, field) for token in sentence['tokens'])
+
+    return counts
+
+
+def document_counts(annotated_text, key=None):
+    '''
+    Count the labels of every encoded field in `annotated_text`.  Used to
+    count a corpus in worker processes.
+    '''
+    return count_labels(annotated_text.sentences)
+
+
+def build_vocabularies(
+    counts, min_count=1, max_size=None, reserved=DEFAULT_RESERVED,
+    unknown=DEFAULT_UNKNOWN
+):
+    '''
+    Build a Vocabulary for each field in `counts` (as made by
+    count_labels).  `min_count` and `max_size` can be given as a single
+    value, or as a dict mapping fields to values.
+    '''
+    vocabularies = OrderedDict()
+    for field, field_counts in counts.iteritems():
+        vocabularies[field] = Vocabulary.from_counts(
+            field_counts,
+            min_count.get(field, 1) if isinstance(min_count, dict)
+                else min_count,
+            max_size.get(field) if isinstance(max_size, dict) else max_size,
+            reserved,
+            unknown
+        )
+    return vocabularies
+
+
+def count_corpus(
+    pairs, executor='process', workers=None, max_in_flight=None, **kwargs
+):
+    '''
+    Count the labels of every encoded field in the documents listed in
+    `pairs`, parsing and counting them in a pool of workers (see
+    corpus.CorpusLoader).  Keyword arguments are passed on to
+    AnnotatedText.
+    '''
+    counts = OrderedDict((field, Counter()) for field in ENCODED_FIELDS)
+    with CorpusLoader(executor, workers, max_in_flight) as loader:
+        for doc_id, doc_counts in loader.iter_contents(
+            iter_pair_contents(pairs), transform=document_counts, **kwargs
+        ):
+            for field, field_counts in doc_counts.iteritems():
+                counts[field].update(field_counts)
+
+    return counts
+
+
+def concatenate(encodings):
+    '''
+    Join several encodings (of documents, or batches) into one.
+    '''
+    _require_numpy()
+    encodings = list(encodings)
+    if not encodings:
+        raise ValueError('There must be at least one encoding to join.')
+
+    joined = OrderedDict(
+        (key, numpy.concatenate([e[key] for e in encodings]))
+        for key in encodings[0] if key not in OFFSET_KEYS
+    )
+
+    # Offsets are shifted by the tokens (or sentences) that come before
+    for key in OFFSET_KEYS:
+        parts = [numpy.zeros(1, numpy.int64)]
+        shift = 0
+        for encoding in encodings:
+            parts.append(encoding[key][1:] + shift)
+            shift += encoding[key][-1]
+        joined[key] = numpy.concatenate(parts)
+
+    return joined
+
+
+class Encoder(object):
+    '''
+    Encodes documents and sentences as arrays of ids, using a Vocabulary
+    for each field (word, lemma, pos, and/or ner).
+    '''
+
+    def __init__(self, vocabularies):
+        _check_fields(vocabularies)
+        self.vocabularies = OrderedDict(vocabularies)
+
+
+    def encode_sentences(self, sentences):
+        '''
+        Encode `sentences` as if they made up one document.
+        '''
+        _require_numpy()
+        ids = OrderedDict((field, []) for field in self.vocabularies)
+        sentence_offsets = [0]
+
+        for sentence in sentences:
+            tokens = sentence['tokens']
+            for field, vocabulary in self.vocabularies.iteritems():
+                lookup = vocabulary.ids.get
+                unknown_id = vocabulary.unknown_id
+                field_ids = [
+                    lookup(_token_label(token, field), unknown_id)
+                    for token in tokens
+                ]
+                if unknown_id is None and None in field_ids:
+                    raise KeyError(
+                        'A %s label is missing from the vocabulary.' % field)
+                ids[field].extend(field_ids)
+            sentence_offsets.append(sentence_offsets[-1] + len(tokens))
+
+        encoding = OrderedDict(
+            (field, numpy.array(field_ids, numpy.int32))
+            for field, field_ids in ids.iteritems()
+        )
+        encoding['sentence_offsets'] = numpy.array(
+            sentence_offsets, numpy.int64)
+        encoding['document_offsets'] = numpy.array(
+            [0, len(sentence_offsets) - 1], numpy.int64)
+        return encoding
+
+
+    def encode(self, annotated_text):
+        '''
+        Encode the document `annotated_text`.
+        '''
+        return self.encode_sentences(annotated_text.sentences)
+
+
+    def iter_batches(self, documents, batch_size=DEFAULT_BATCH_SIZE):
+        '''
+        Yield encodings of `batch_size` documents at a time.
+        '''
+        batch = []
+        for annotated_text in documents:
+            batch.append(self.encode(annotated_text))
+            if len(batch) == batch_size:
+                yield concatenate(batch)
+                batch = []
+        if batch:
+            yield concatenate(batch)
+
+
+    def iter_sentence_batches(self, sentences, batch_size=DEFAULT_BATCH_SIZE):
+        '''
+        Yield encodings of `batch_size` sentences at a time, from a stream
+        of sentences.
+        '''
+        batch = []
+        for sentence in sentences:
+            batch.append(sentence)
+            if len(batch) == batch_size:
+                yield self.encode_sentences(batch)
+                batch = []
+        if batch:
+            yield self.encode_sentences(batch)
+
+
+    def save(self, path):
+        '''
+        Save the vocabularies as json.
+        '''
+        with open(path, 'w') as f:
+            json.dump(OrderedDict(
+                (field, vocabulary.as_dict())
+                for field, vocabulary in self.vocabularies.iteritems()
+            ), f)
+
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f, object_pairs_hook=OrderedDict)
+        return cls(OrderedDict(
+            (field, Vocabulary.from_dict(vocabulary))
+            for field, vocabulary in data.iteritems()
+        ))
+
+
+# The encoder used by worker processes.  It is handed to each worker once,
+# when the worker starts, rather than being sent with every document.
+_worker_encoder = None
+
+
+def _set_worker_encoder(encoder):
+    global _worker_encoder
+    _worker_encoder = encoder
+
+
+def _encode_in_worker(annotated_text, key):
+    return _worker_encoder.encode(annotated_text)
+
+
+def encode_corpus(
+    pairs, encoder, batch_size=DEFAULT_BATCH_SIZE, executor='process',
+    workers=None, max_in_flight=None, **kwargs
+):
+    '''
+    Parse and encode each (corenlp_path, aida_path) pair in `pairs` in a
+    pool of workers (see corpus.CorpusLoader), and yield the encodings in
+    batches of `batch_size` documents, in order.  Keyword arguments are
+    passed on to AnnotatedText.
+    '''
+    _require_numpy()
+    with CorpusLoader(
+        executor, workers, max_in_flight, _set_worker_encoder, (encoder,)
+    ) as loader:
+        batch = []
+        for doc_id, encoding in loader.iter_contents(
+            iter_pair_contents(pairs), transform=_encode_in_worker, **kwargs
+        ):
+            batch.append(encoding)
+            if len(batch) == batch_size:
+                yield concatenate(batch)
+                batch = []
+        if batch:
+            yield concatenate(batch)
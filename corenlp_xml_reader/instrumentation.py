@@ -0,0 +1,84 @@
+'''
+Collectors that receive timing and counter information from AnnotatedText
+while it is being built.  Pass one as the `instrumentation` argument:
+
+    collector = Collector()
+    AnnotatedText(corenlp_xml, aida_json, instrumentation=collector)
+    print collector.phases, collector.counters
+
+Any object with `phase(name, seconds)` and `count(name, amount)` methods
+can be used as a collector.  A plain function can also be given, in which
+case it is called as `callback(kind, name, value)`, where kind is either
+'phase' or 'count'.
+'''
+
+from collections import Counter, OrderedDict
+
+
+class Collector(object):
+    '''
+    Accumulates the duration of each construction phase, and counters such
+    as the number of tokens read.  A collector can be shared by several
+    documents, in which case it holds the totals.
+    '''
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.counters = Counter()
+
+
+    def phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+
+    def merge(self, other):
+        '''
+        Add the phases and counters of another collector into this one.
+        '''
+        for name, seconds in other.phases.items():
+            self.phase(name, seconds)
+        self.counters.update(other.counters)
+
+
+    def as_dict(self):
+        return OrderedDict([
+            ('phases', OrderedDict(self.phases)),
+            ('counters', dict(self.counters)),
+        ])
+
+
+class CallbackCollector(object):
+    '''
+    Adapts a function to the collector interface.  The function is called
+    as `callback(kind, name, value)`.
+    '''
+
+    def __init__(self, callback):
+        self.callback = callback
+
+
+    def phase(self, name, seconds):
+        self.callback('phase', name, seconds)
+
+
+    def count(self, name, amount=1):
+        self.callback('count', name, amount)
+
+
+def as_collector(instrumentation):
+    '''
+    Accept either a collector or a callback function, and return a
+    collector.  None (meaning no instrumentation) is passed through.
+    '''
+    if instrumentation is None or hasattr(instrumentation, 'phase'):
+        return instrumentation
+
+    if callable(instrumentation):
+        return CallbackCollector(instrumentation)
+
+    raise ValueError(
+        'instrumentation must be a collector or a callable.')
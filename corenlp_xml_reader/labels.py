@@ -0,0 +1,110 @@
+'''
+Shared vocabularies of the small set of labels that recur throughout a
+corpus: POS tags, NER types, dependency relations, and constituent tags.
+Each vocabulary lives for the whole process, so that every document read
+in it shares one copy of each label string, rather than one per token,
+edge, or constituent.  Each label also gets a small integer id, for
+compact storage and fast comparisons:
+
+    pos = labels.VOCABULARIES['pos']
+    nnp = pos.id('NNP')
+    [t for t in article.tokens if pos.id(t['pos']) == nnp]
+
+Ids are handed out in the order labels are first seen, so they are only
+meaningful within a process.
+'''
+
+from collections import OrderedDict
+import threading
+
+
+class LabelVocabulary(object):
+    '''
+    Maps labels to small integer ids and back, holding one canonical copy
+    of each label.
+    '''
+
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = []
+        self.ids = {}
+        self.lock = threading.Lock()
+        for label in labels:
+            self.add(label)
+
+
+    def add(self, label):
+        '''
+        Add `label` if it isn't known yet, and return its id.
+        '''
+        with self.lock:
+            label_id = self.ids.get(label)
+            if label_id is None:
+                label_id = len(self.labels)
+                self.ids[label] = label_id
+                self.labels.append(label)
+        return label_id
+
+
+    def id(self, label):
+        '''
+        The id of `label`, adding it if needed.
+        '''
+        label_id = self.ids.get(label)
+        if label_id is None:
+            label_id = self.add(label)
+        return label_id
+
+
+    def label(self, label_id):
+        '''
+        The label whose id is `label_id`.
+        '''
+        return self.labels[label_id]
+
+
+    def intern(self, label):
+        '''
+        The canonical copy of `label` (which is added if needed).  None is
+        returned as is.
+        '''
+        if label is None:
+            return None
+        label_id = self.ids.get(label)
+        if label_id is None:
+            label_id = self.add(label)
+        return self.labels[label_id]
+
+
+    def __contains__(self, label):
+        return label in self.ids
+
+
+    def __len__(self):
+        return len(self.labels)
+
+
+    def __iter__(self):
+        return iter(self.labels)
+
+
+    def __repr__(self):
+        return '<LabelVocabulary %s: %d labels>' % (self.name, len(self))
+
+
+VOCABULARIES = OrderedDict(
+    (name, LabelVocabulary(name)) for name in ['pos', 'ner', 'dep', 'c_tag'])
+
+
+def intern_label(kind, label):
+    '''
+    The canonical copy of `label` in the vocabulary called `kind`.
+    '''
+    return VOCABULARIES[kind].intern(label)
+
+
+def label_id(kind, label):
+    '''
+    The id of `label` in the vocabulary called `kind`.
+    '''
+    return VOCABULARIES[kind].id(label)
@@ -0,0 +1,200 @@
+'''
+Approximate memory accounting for AnnotatedText objects.  Sizes come from
+sys.getsizeof, so they cover the Python objects making up each layer but
+not allocator overhead.  Each object is counted once, against the first
+layer in which it is encountered.
+'''
+
+from collections import OrderedDict
+import sys
+
+
+# Report the layers in this order
+LAYERS = [
+    'tokens', 'constituency', 'dependencies', 'mentions', 'sentences',
+    'indexes', 'text', 'soup'
+]
+
+# Retained attributes that are flagged when they exceed the threshold
+RETAINED_ATTRIBUTES = ['text', 'soup', 'tokens_by_offset', 'tokens']
+
+DEFAULT_LARGE_OBJECT_THRESHOLD = 1024 * 1024
+
+SCALAR_TYPES = (basestring, int, long, float, bool, type(None))
+
+
+class _SizeTally(object):
+    '''
+    Tallies the size of objects into layers, making sure that no object is
+    counted twice.
+    '''
+
+    def __init__(self):
+        self.seen = set()
+        self.layers = OrderedDict((layer, 0) for layer in LAYERS)
+
+
+    def add(self, layer, obj):
+        '''
+        Count `obj` itself (not the objects it refers to) against `layer`.
+        Returns False if it had already been counted.
+        '''
+        if id(obj) in self.seen:
+            return False
+        self.seen.add(id(obj))
+        self.layers[layer] += sys.getsizeof(obj)
+        return True
+
+
+    def add_scalars(self, layer, values):
+        '''
+        Count any strings and numbers among `values` against `layer`.
+        '''
+        for value in values:
+            if isinstance(value, SCALAR_TYPES):
+                self.add(layer, value)
+
+
+def _tally_token(tally, token):
+    if not tally.add('tokens', token):
+        return
+
+    tally.add_scalars('tokens', token.itervalues())
+    for key in ['children', 'parents', 'mentions']:
+        if key in token:
+            tally.add('tokens', token[key])
+
+    for key in ['children', 'parents']:
+        for edge in token.get(key, []):
+            if tally.add('dependencies', edge):
+                tally.add_scalars('dependencies', edge)
+
+
+def _tally_constituent(tally, node):
+
+    # Tokens double as the leaves of the constituency tree; only their
+    # list of (no) children belongs to the constituency layer.
+    if 'id' not in node:
+        if not tally.add('constituency', node):
+            return
+        tally.add_scalars('constituency', node.itervalues())
+
+    tally.add('constituency', node['c_children'])
+    for child in node['c_children']:
+        _tally_constituent(tally, child)
+
+
+def _tally_mention(tally, mention):
+    if not tally.add('mentions', mention):
+        return
+
+    tally.add_scalars('mentions', mention.itervalues())
+
+    # Mentions that are views onto their sentence's tokens have no list of
+    # tokens of their own
+    if dict.__contains__(mention, 'tokens'):
+        tally.add('mentions', mention['tokens'])
+    if 'types' in mention:
+        tally.add('mentions', mention['types'])
+        tally.add_scalars('mentions', mention['types'])
+
+
+def _tally_reference(tally, reference):
+    if not tally.add('mentions', reference):
+        return
+
+    tally.add_scalars('mentions', reference.itervalues())
+    tally.add('mentions', reference['mentions'])
+    for mention in reference['mentions']:
+        _tally_mention(tally, mention)
+    if 'types' in reference:
+        tally.add('mentions', reference['types'])
+        tally.add_scalars('mentions', reference['types'])
+
+
+def _tally_soup(tally, soup):
+    '''
+    Count the BeautifulSoup tree: every tag and string, along with the
+    instance dictionaries and lists that hold their links.
+    '''
+    for node in [soup] + list(soup.descendants):
+        tally.add('soup', node)
+        node_dict = getattr(node, '__dict__', None)
+        if node_dict is not None:
+            tally.add('soup', node_dict)
+        for attr in ['contents', 'attrs']:
+            value = node_dict.get(attr) if node_dict is not None else None
+            if value is not None and tally.add('soup', value):
+                if isinstance(value, dict):
+                    tally.add_scalars('soup', value.itervalues())
+
+
+def memory_report(
+    annotated_text, large_object_threshold=DEFAULT_LARGE_OBJECT_THRESHOLD
+):
+    '''
+    Walk `annotated_text` once, and return an approximate breakdown of the
+    bytes used by each of its layers, along with a list of large objects
+    that stay alive for as long as the document does.
+    '''
+    tally = _SizeTally()
+
+    sentences = getattr(annotated_text, 'sentences', [])
+    for sentence in sentences:
+        for token in sentence['tokens']:
+            _tally_token(tally, token)
+        _tally_token(tally, sentence['root'])
+
+        if 'c_root' in sentence:
+            _tally_constituent(tally, sentence['c_root'])
+
+        tally.add('sentences', sentence)
+        tally.add_scalars('sentences', sentence.itervalues())
+        for key in ['tokens', 'entities', 'mentions', 'references']:
+            tally.add('sentences', sentence[key])
+        for entity in sentence['entities']:
+            _tally_mention(tally, entity)
+
+    for attr in ['references', 'coreferences']:
+        for reference in getattr(annotated_text, attr, []):
+            _tally_reference(tally, reference)
+
+    # The document-level lists and lookup tables
+    for attr in [
+        'sentences', 'tokens', 'tokens_by_offset', 'references',
+        'coreferences', 'disambiguated_references'
+    ]:
+        if hasattr(annotated_text, attr):
+            tally.add('indexes', getattr(annotated_text, attr))
+
+    # The original input, and the parse tree it was read from
+    if getattr(annotated_text, 'text', None) is not None:
+        tally.add('text', annotated_text.text)
+    if getattr(annotated_text, 'soup', None) is not None:
+        _tally_soup(tally, annotated_text.soup)
+
+    total = sum(tally.layers.values())
+
+    # Flag large objects that are kept alive by the document
+    large_objects = []
+    for attr in RETAINED_ATTRIBUTES:
+        value = getattr(annotated_text, attr, None)
+        if value is None:
+            continue
+        if attr in ['text', 'soup']:
+            size = tally.layers[attr]
+        else:
+            size = sys.getsizeof(value)
+        if size >= large_object_threshold:
+            large_objects.append(OrderedDict([
+                ('attribute', attr),
+                ('bytes', size),
+                ('fraction', size / float(total) if total else 0.0),
+            ]))
+    large_objects.sort(key=lambda obj: obj['bytes'], reverse=True)
+
+    return OrderedDict([
+        ('layers', tally.layers),
+        ('total', total),
+        ('large_objects', large_objects),
+    ])
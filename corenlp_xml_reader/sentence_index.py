@@ -0,0 +1,263 @@
+'''
+Random access to the sentences of large CoreNLP xml files.  An index of
+the byte ranges of each <sentence> element, and of the coreference
+section, is built in one scan of the file and saved next to it, as
+"<path>.idx".  The sentences can then be read individually, parsing only
+the bytes of the sentences asked for:
+
+    document = IndexedDocument('article.xml')
+    document.sentence(4000)
+    document.sentences(4000, 4010)
+
+Indexes record the size and modification time of the file they were
+built from, along with a hash of its first and last bytes, and are
+rebuilt if any of these change.  Compressed files can't be
+read at random, so they can't be indexed.
+'''
+
+import hashlib
+import json
+import os
+import re
+from annotated_text import AnnotatedText
+from sources import decompose_soup, detect_compression, open_mmap, parse_soup
+
+
+INDEX_EXTENSION = '.idx'
+INDEX_VERSION = 2
+
+# How many bytes at each end of a file go into its signature
+SIGNATURE_BYTES = 64 * 1024
+
+# The options of AnnotatedText that IndexedDocument passes on
+SENTENCE_OPTIONS = [
+    'dependencies', 'exclude_ordinal_NERs', 'initial_offset', 'token_fields',
+    'intern_labels'
+]
+
+MATCH_SENTENCES_START = re.compile(r'<sentences>')
+MATCH_SENTENCES_END = re.compile(r'</sentences>')
+MATCH_SENTENCE_ELEMENT = re.compile(
+    r'<sentence\b[^>]*>.*?</sentence>', re.DOTALL)
+MATCH_COREFERENCE_START = re.compile(r'<coreference>')
+MATCH_COREFERENCE_END = re.compile(r'</coreference>\s*</document>')
+
+
+def index_path(path):
+    return path + INDEX_EXTENSION
+
+
+def _file_signature(path):
+    '''
+    The size, modification time, and a hash of the first and last bytes
+    of the file at `path`.  The hash catches rewrites that keep the size
+    and happen within the resolution of the file system's timestamps.
+    '''
+    stat = os.stat(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read(SIGNATURE_BYTES))
+        if stat.st_size > SIGNATURE_BYTES:
+            f.seek(max(SIGNATURE_BYTES, stat.st_size - SIGNATURE_BYTES))
+            digest.update(f.read())
+    return stat.st_size, stat.st_mtime, digest.hexdigest()
+
+
+class SentenceIndex(object):
+    '''
+    The byte ranges, as (start, end) pairs, of the <sentence> elements
+    (`sentences`) and of the coreference section (`coreference`, which is
+    None if there is none) of a CoreNLP xml file.
+    '''
+
+    def __init__(
+        self, sentences, coreference=None, size=None, mtime=None, digest=None
+    ):
+        self.sentences = sentences
+        self.coreference = coreference
+        self.size = size
+        self.mtime = mtime
+        self.digest = digest
+
+
+    @staticmethod
+    def _scan(text):
+        sentences = []
+        coreference = None
+
+        # Only look for sentences within the <sentences> block, since
+        # coreference mentions have <sentence> tags too
+        start = MATCH_SENTENCES_START.search(text)
+        if start is not None:
+            end = MATCH_SENTENCES_END.search(text, start.end())
+            end_pos = end.start() if end is not None else len(text)
+            sentences = [
+                match.span() for match in MATCH_SENTENCE_ELEMENT.finditer(
+                    text, start.end(), end_pos)
+            ]
+            coreference_start = MATCH_COREFERENCE_START.search(
+                text, end_pos)
+            if coreference_start is not None:
+                coreference_end = MATCH_COREFERENCE_END.search(
+                    text, coreference_start.end())
+                if coreference_end is not None:
+                    coreference = (
+                        coreference_start.start(),
+                        coreference_end.start() + len('</coreference>')
+                    )
+
+        return sentences, coreference
+
+
+    @classmethod
+    def build(cls, path):
+        '''
+        Index the file at `path`, in one scan of it.
+        '''
+        text = open_mmap(path)
+        try:
+            if detect_compression(text[:8]) is not None:
+                raise ValueError('Compressed files can\'t be indexed.')
+            sentences, coreference = cls._scan(text)
+        finally:
+            if hasattr(text, 'close'):
+                text.close()
+
+        size, mtime, digest = _file_signature(path)
+        return cls(sentences, coreference, size, mtime, digest)
+
+
+    def is_current(self, path):
+        '''
+        Whether the file at `path` is unchanged since it was indexed.
+        '''
+        return _file_signature(path) == (self.size, self.mtime, self.digest)
+
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'size': self.size,
+                'mtime': self.mtime,
+                'digest': self.digest,
+                'sentences': [
+                    offset for span in self.sentences for offset in span],
+                'coreference': self.coreference,
+            }, f)
+
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError('Unsupported sentence index version.')
+        offsets = data['sentences']
+        return cls(
+            zip(offsets[::2], offsets[1::2]),
+            tuple(data['coreference']) if data['coreference'] else None,
+            data['size'],
+            data['mtime'],
+            data['digest']
+        )
+
+
+    def __len__(self):
+        return len(self.sentences)
+
+
+def load_index(path, rebuild=True):
+    '''
+    Load the index of the CoreNLP xml file at `path` from its sidecar
+    file.  If there is none, or it is out of date (or was saved by another
+    version of this module), the index is built, and saved unless
+    `rebuild` is false, in which case ValueError is raised.
+    '''
+    sidecar = index_path(path)
+    if os.path.exists(sidecar):
+        try:
+            index = SentenceIndex.load(sidecar)
+        except ValueError:
+            index = None
+        if index is not None and index.is_current(path):
+            return index
+
+    if not rebuild:
+        raise ValueError('No current sentence index for %s.' % path)
+
+    index = SentenceIndex.build(path)
+    index.save(sidecar)
+    return index
+
+
+class IndexedDocument(object):
+    '''
+    Reads individual sentences of the CoreNLP xml file at `path`, using
+    its sentence index (see load_index).  Keyword arguments are the
+    options of AnnotatedText that affect how sentences are read
+    (dependencies, exclude_ordinal_NERs, initial_offset, token_fields, and
+    intern_labels); other options raise ValueError.  Sentences keep their
+    ids, so sentence i has id i.  Coreference and AIDA links span the
+    whole document, so they aren't built.
+    '''
+
+    def __init__(self, path, index=None, rebuild=True, **kwargs):
+        for option in kwargs:
+            if option not in SENTENCE_OPTIONS:
+                raise ValueError(
+                    'IndexedDocument only takes the options %s.'
+                    % ', '.join(SENTENCE_OPTIONS)
+                )
+        self.path = path
+        self.index = index if index is not None else load_index(
+            path, rebuild)
+        self.options = kwargs
+
+
+    def __len__(self):
+        return len(self.index)
+
+
+    def _read_range(self, start, end):
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+
+    def sentences(self, start=0, stop=None):
+        '''
+        Build the Sentences start, start+1, ..., stop-1, reading only
+        their bytes.
+        '''
+        spans = self.index.sentences[start:stop]
+        if not spans:
+            return []
+
+        sentences_xml = self._read_range(spans[0][0], spans[-1][1])
+        reader = AnnotatedText(**self.options)
+        reader.soup = parse_soup(
+            '<sentences>' + sentences_xml + '</sentences>')
+        try:
+            reader._read_all_sentences()
+        finally:
+            decompose_soup(reader.soup)
+        return reader.sentences
+
+
+    def sentence(self, sentence_id):
+        '''
+        Build the Sentence whose id is `sentence_id`.
+        '''
+        if not 0 <= sentence_id < len(self):
+            raise IndexError('sentence id out of range')
+        return self.sentences(sentence_id, sentence_id + 1)[0]
+
+
+    def coreference_xml(self):
+        '''
+        The xml of the coreference section, or None if there is none.
+        '''
+        if self.index.coreference is None:
+            return None
+        return self._read_range(*self.index.coreference)
@@ -0,0 +1,276 @@
+'''
+Reading CoreNLP xml from different kinds of input (strings, files, and
+memory-mapped files) in chunks, so that the parse tree can be built without
+first holding the whole document, or rewritten copies of it, in memory.
+
+Inputs compressed with gzip, bz2 or xz are detected by their magic bytes
+and decompressed as they are read.
+'''
+
+import bz2
+import codecs
+import mmap
+import zlib
+from bs4 import BeautifulSoup as Soup
+
+# The chunked parser below extends bs4's html.parser tree builder, relying
+# on some of its internals (parser_args, already_closed_empty_element).
+# setup.py pins bs4 to the releases it was tested with.
+from bs4.builder._htmlparser import (
+    BeautifulSoupHTMLParser, HTMLParserTreeBuilder
+)
+from bs4.element import Tag
+
+
+# xz support needs the lzma module, which Python 2 only has as a backport
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_ENCODING = 'utf-8'
+
+COMPRESSION_MAGIC_BYTES = [
+    ('gzip', '\x1f\x8b'),
+    ('bz2', 'BZh'),
+    ('xz', '\xfd7zXZ\x00'),
+]
+COMPRESSED_EXTENSIONS = ['.gz', '.bz2', '.xz']
+
+
+def detect_compression(header):
+    '''
+    Return the name of the compression format whose magic bytes `header`
+    begins with, or None if it doesn't look compressed.
+    '''
+    for compression, magic_bytes in COMPRESSION_MAGIC_BYTES:
+        if header[:len(magic_bytes)] == magic_bytes:
+            return compression
+    return None
+
+
+def _make_decompressor(compression):
+    if compression == 'gzip':
+        # The extra 16 tells zlib to expect a gzip header and trailer
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == 'bz2':
+        return bz2.BZ2Decompressor()
+    if lzma is None:
+        raise ValueError(
+            'Reading xz-compressed input needs the lzma module (on Python 2, '
+            'install backports.lzma).')
+    return lzma.LZMADecompressor()
+
+
+def _decompress_chunks(compression, raw_chunks):
+    '''
+    Decompress a stream of compressed chunks.  Files made by concatenating
+    several compressed streams (as `cat a.gz b.gz` does) are handled by
+    starting a new decompressor whenever one stream ends.
+    '''
+    decompressor = _make_decompressor(compression)
+    for raw_chunk in raw_chunks:
+        while raw_chunk:
+            try:
+                chunk = decompressor.decompress(raw_chunk)
+            except EOFError:
+                # bz2 and xz decompressors refuse data after the end of 
+                # their stream
+                decompressor = _make_decompressor(compression)
+                continue
+
+            if chunk:
+                yield chunk
+
+            raw_chunk = decompressor.unused_data
+            if raw_chunk:
+                decompressor = _make_decompressor(compression)
+
+    if hasattr(decompressor, 'flush'):
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
+
+
+def iter_raw_chunks(source, chunk_size=CHUNK_SIZE):
+    '''
+    Yield the contents of `source`, which can be a byte string, an mmap, or
+    a file object, as chunks of bytes, decompressing it if need be.
+    '''
+    if isinstance(source, (str, mmap.mmap)):
+        raw_chunks = (
+            source[start:start+chunk_size]
+            for start in xrange(0, len(source), chunk_size)
+        )
+    else:
+        raw_chunks = iter(lambda: source.read(chunk_size), '')
+
+    # Look at the first chunk to see whether the input is compressed
+    first_chunk = next(raw_chunks, '')
+    compression = None
+    if not isinstance(first_chunk, unicode):
+        compression = detect_compression(first_chunk)
+
+    def all_chunks():
+        yield first_chunk
+        for raw_chunk in raw_chunks:
+            yield raw_chunk
+
+    if compression is None:
+        for raw_chunk in all_chunks():
+            if raw_chunk:
+                yield raw_chunk
+    else:
+        for chunk in _decompress_chunks(compression, all_chunks()):
+            yield chunk
+
+
+def read_bytes(source):
+    '''
+    Read the whole of `source` (see iter_raw_chunks), decompressing it if
+    need be.  Unicode strings are returned as they are.
+    '''
+    if isinstance(source, unicode):
+        return source
+    if isinstance(source, str) and detect_compression(source) is None:
+        return source
+    return ''.join(iter_raw_chunks(source))
+
+
+def read_path(path):
+    '''
+    Read the whole file at `path`, decompressing it if need be.
+    '''
+    with open(path, 'rb') as f:
+        return read_bytes(f)
+
+
+def iter_chunks(source, chunk_size=CHUNK_SIZE, encoding=DEFAULT_ENCODING):
+    '''
+    Yield the contents of `source` as unicode chunks.  `source` can be a
+    unicode string, a byte string, an mmap, or a file object opened for
+    reading.  Bytes are decompressed (if need be) and decoded incrementally
+    using `encoding`.
+    '''
+    if isinstance(source, unicode):
+        for start in xrange(0, len(source), chunk_size):
+            yield source[start:start+chunk_size]
+        return
+
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for raw_chunk in iter_raw_chunks(source, chunk_size):
+
+        # File objects opened with codecs.open already yield unicode
+        if isinstance(raw_chunk, unicode):
+            yield raw_chunk
+            continue
+
+        chunk = decoder.decode(raw_chunk)
+        if chunk:
+            yield chunk
+
+    tail = decoder.decode('', final=True)
+    if tail:
+        yield tail
+
+
+def read_all(source, encoding=DEFAULT_ENCODING):
+    '''
+    Read the whole of `source` (see iter_chunks) into a single string.
+    Uncompressed strings are returned as they are.
+    '''
+    if isinstance(source, unicode):
+        return source
+    if isinstance(source, str) and detect_compression(source) is None:
+        return source
+    return u''.join(iter_chunks(source, encoding=encoding))
+
+
+class _CoreNLPHTMLParser(BeautifulSoupHTMLParser):
+    '''
+    BeautifulSoup doesn't handle <head></head> tags, which do appear in
+    CoreNLP output, the way we need it to.  Rather than rewriting the
+    document text, this parser renames them to <headword> as they are read.
+    '''
+
+    def handle_starttag(self, name, *args, **kwargs):
+        if name == 'head':
+            name = 'headword'
+        return BeautifulSoupHTMLParser.handle_starttag(
+            self, name, *args, **kwargs)
+
+
+    def handle_endtag(self, name, *args, **kwargs):
+        if name == 'head':
+            name = 'headword'
+        return BeautifulSoupHTMLParser.handle_endtag(
+            self, name, *args, **kwargs)
+
+
+class _ChunkedTreeBuilder(HTMLParserTreeBuilder):
+    '''
+    Tree builder that feeds the parser one chunk at a time, rather than
+    being handed the whole document as a string.
+    '''
+
+    # The chunks can't be pickled, so the soup drops its builder instead
+    picklable = False
+
+    def __init__(self, chunks, *args, **kwargs):
+        HTMLParserTreeBuilder.__init__(self, *args, **kwargs)
+        self.chunks = chunks
+
+
+    def feed(self, markup):
+        args, kwargs = self.parser_args
+        parser = _CoreNLPHTMLParser(*args, **kwargs)
+        parser.soup = self.soup
+        for chunk in self.chunks:
+            parser.feed(chunk)
+        parser.close()
+
+        # Don't keep the source alive along with the soup
+        self.chunks = None
+        parser.already_closed_empty_element = []
+
+
+def parse_soup(source, encoding=DEFAULT_ENCODING):
+    '''
+    Parse CoreNLP xml from `source` (see iter_chunks) into a BeautifulSoup
+    tree, reading it one chunk at a time.
+    '''
+    builder = _ChunkedTreeBuilder(iter_chunks(source, encoding=encoding))
+    return Soup(u'', builder=builder)
+
+
+def decompose_soup(soup):
+    '''
+    Take apart a tree made by parse_soup(), breaking the links between its
+    elements, so that reference counting can free it without help from
+    the cyclic garbage collector.  The soup can't be used afterwards.
+    '''
+    # The soup's own chain of elements is empty, so calling decompose() on
+    # it alone would leave the document in place
+    for element in list(soup.contents):
+        if isinstance(element, Tag):
+            element.decompose()
+        else:
+            element.extract()
+    soup.decompose()
+
+
+def open_mmap(path):
+    '''
+    Memory-map the file at `path` for reading.  Empty files can't be
+    mapped, so an empty string is returned for them instead.
+    '''
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return ''
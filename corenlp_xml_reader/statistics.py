@@ -0,0 +1,229 @@
+'''
+Corpus-wide statistics, computed map-reduce style: each statistic makes a
+partial result for every document (in the workers that parse them, so
+only the partial results come back), and the partial results are merged
+into a total.
+
+    totals = corpus_statistics(pairs, workers=8)
+    totals['ner_types'].most_common(5)
+
+The built-in statistics are:
+
+    sizes                   documents, sentences, tokens, and references
+    ner_types               named entities, by type
+    chain_lengths           CoreNLP coreference chains, by number of mentions
+    aida_links              AIDA mentions matched to an existing mention,
+                            and mentions created to hold an AIDA mention
+    kb_identifiers          references, by the kbIdentifier AIDA resolved
+                            them to
+
+Other statistics can be defined by subclassing Statistic, or by passing a
+function to Statistic.  Statistics are Counters by default, but a
+Statistic can use any partial result, by overriding empty() and merge().
+Each document is only read once, however many statistics are computed,
+and the built-in statistics only need the `ner` token field, so
+`token_fields=['ner', 'character_offset_begin', 'character_offset_end']`
+can be passed on to AnnotatedText to read documents faster.
+'''
+
+from collections import Counter, OrderedDict
+from corpus import CorpusLoader, iter_pair_contents
+
+
+class Statistic(object):
+    '''
+    A statistic computed for each document, and merged over the corpus.
+    Partial results are made by `collect(annotated_text)`, or by calling
+    `collect` if it was given (when the process executor is used, it must
+    be a module-level function).  By default they are Counters, which are
+    merged by adding them up.
+    '''
+
+    name = None
+
+    def __init__(self, name=None, collect=None):
+        if name is not None:
+            self.name = name
+        if collect is not None:
+            self.collect = collect
+        if self.name is None:
+            raise ValueError('A statistic needs a name.')
+
+
+    def collect(self, annotated_text):
+        raise NotImplementedError
+
+
+    def empty(self):
+        '''
+        The total before any partial result has been merged.
+        '''
+        return Counter()
+
+
+    def merge(self, total, partial):
+        '''
+        Merge a `partial` result into `total`, and return the new total.
+        '''
+        total.update(partial)
+        return total
+
+
+class Sizes(Statistic):
+    name = 'sizes'
+
+    def collect(self, annotated_text):
+        return Counter({
+            'documents': 1,
+            'sentences': len(annotated_text.sentences),
+            'tokens': len(annotated_text.tokens),
+            'references': len(annotated_text.references),
+        })
+
+
+class NerTypes(Statistic):
+    name = 'ner_types'
+
+    def collect(self, annotated_text):
+        return Counter(
+            entity['head']['ner']
+            for sentence in annotated_text.sentences
+            for entity in sentence['entities']
+        )
+
+
+class ChainLengths(Statistic):
+    name = 'chain_lengths'
+
+    def collect(self, annotated_text):
+        return Counter(
+            len(coreference['mentions'])
+            for coreference in getattr(annotated_text, 'coreferences', [])
+        )
+
+
+class AidaLinks(Statistic):
+    '''
+    Counts AIDA mentions that were matched to a coreference or NER mention
+    ("matched"), and those for which a new mention had to be created
+    ("created").  Created mentions are the only mentions of references
+    that are neither coreference chains nor named entities.
+    '''
+    name = 'aida_links'
+
+    def collect(self, annotated_text):
+        counts = Counter()
+        coreference_ids = set(
+            id(c) for c in getattr(annotated_text, 'coreferences', []))
+
+        for reference in annotated_text.references:
+            for mention in reference['mentions']:
+                if 'kbIdentifier' not in mention:
+                    continue
+
+                is_created = (
+                    id(reference) not in coreference_ids
+                    and not any(
+                        mention is entity for entity in
+                        annotated_text.sentences[mention['sentence_id']][
+                            'entities']
+                    )
+                )
+                counts['created' if is_created else 'matched'] += 1
+
+        return counts
+
+
+class KbIdentifiers(Statistic):
+    name = 'kb_identifiers'
+
+    def collect(self, annotated_text):
+        return Counter(
+            reference['kbIdentifier']
+            for reference in getattr(
+                annotated_text, 'disambiguated_references', [])
+        )
+
+
+def default_statistics():
+    return [Sizes(), NerTypes(), ChainLengths(), AidaLinks(), KbIdentifiers()]
+
+
+def _check_statistics(statistics):
+    names = [statistic.name for statistic in statistics]
+    if len(set(names)) != len(names):
+        raise ValueError('Statistics must have distinct names.')
+
+
+def collect_document(annotated_text, statistics):
+    '''
+    Return the partial result of each statistic for `annotated_text`, as a
+    list.
+    '''
+    return [statistic.collect(annotated_text) for statistic in statistics]
+
+
+def _merge_into(totals, statistics, partials):
+    for statistic, partial in zip(statistics, partials):
+        totals[statistic.name] = statistic.merge(
+            totals[statistic.name], partial)
+
+
+def collect_statistics(documents, statistics=None):
+    '''
+    Compute `statistics` (by default, the built-in ones) over the
+    AnnotatedText objects in `documents`, in this process.  Returns an
+    OrderedDict mapping the statistics' names to their totals.
+    '''
+    if statistics is None:
+        statistics = default_statistics()
+    _check_statistics(statistics)
+
+    totals = OrderedDict((s.name, s.empty()) for s in statistics)
+    for annotated_text in documents:
+        _merge_into(
+            totals, statistics, collect_document(annotated_text, statistics))
+    return totals
+
+
+# The statistics computed by worker processes.  They are handed to each
+# worker once, when the worker starts.
+_worker_statistics = None
+
+
+def _set_worker_statistics(statistics):
+    global _worker_statistics
+    _worker_statistics = statistics
+
+
+def _collect_in_worker(annotated_text, key):
+    return collect_document(annotated_text, _worker_statistics)
+
+
+def corpus_statistics(
+    pairs, statistics=None, executor='process', workers=None,
+    max_in_flight=None, **kwargs
+):
+    '''
+    Compute `statistics` (by default, the built-in ones) over the documents
+    listed in `pairs`, as (corenlp_path, aida_path) pairs.  Documents are
+    parsed, and their partial results computed, in a pool of workers (see
+    corpus.CorpusLoader), and the partial results are merged here.
+    Keyword arguments are passed on to AnnotatedText.  Returns an
+    OrderedDict mapping the statistics' names to their totals.
+    '''
+    if statistics is None:
+        statistics = default_statistics()
+    _check_statistics(statistics)
+
+    totals = OrderedDict((s.name, s.empty()) for s in statistics)
+    with CorpusLoader(
+        executor, workers, max_in_flight, _set_worker_statistics,
+        (statistics,)
+    ) as loader:
+        for doc_id, partials in loader.iter_contents(
+            iter_pair_contents(pairs), transform=_collect_in_worker, **kwargs
+        ):
+            _merge_into(totals, statistics, partials)
+
+    return totals
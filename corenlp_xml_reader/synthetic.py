@@ -0,0 +1,391 @@
+'''
+Generates synthetic CoreNLP xml, with matching AIDA json, for load and
+scaling tests.  The output can be passed straight to AnnotatedText, or
+written to disk in the same layout as the bundled `data/` directory:
+
+    corenlp_xml, aida_json = generate_document(num_sentences=500, seed=0)
+    article = AnnotatedText(corenlp_xml, aida_json)
+
+The sizes of the generated documents are controlled by:
+
+    num_sentences         number of sentences
+    sentence_length       number of tokens per sentence, including the
+                          full stop that ends each one
+    parse_depth           depth of the constituency parse, below ROOT and S
+    dependency_density    dependency edges per token.  Up to 1, this is the
+                          fraction of tokens attached to the dependency
+                          tree; above 1, extra edges are added between
+                          random tokens (some of which would form cycles)
+    num_coref_chains      number of coreference chains
+    coref_chain_length    number of mentions per coreference chain
+    aida_mention_density  fraction of tokens that begin a named entity
+                          which AIDA disambiguates
+'''
+
+import json
+import os
+import random
+from xml.sax.saxutils import escape
+
+
+DEPENDENCY_TYPES = [
+    'basic-dependencies', 'collapsed-dependencies',
+    'collapsed-ccprocessed-dependencies'
+]
+JSON_DEPENDENCY_KEYS = [
+    'basicDependencies', 'enhancedDependencies',
+    'enhancedPlusPlusDependencies'
+]
+DEPENDENCY_RELATIONS = ['nsubj', 'dobj', 'amod', 'det', 'prep', 'nn', 'conj']
+PHRASE_TAGS = ['NP', 'VP', 'PP', 'ADJP', 'SBAR']
+POS_TAGS = ['NN', 'NNS', 'VB', 'VBD', 'JJ', 'DT', 'IN', 'RB']
+NER_TYPES = ['PERSON', 'LOCATION', 'ORGANIZATION']
+WORDS = [
+    'alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf',
+    'hotel', 'india', 'juliet', 'kilo', 'lima', 'mike', 'november'
+]
+MAX_ENTITY_LENGTH = 3
+MAX_MENTION_LENGTH = 3
+
+
+def _generate_tokens(rng, sentence_length, aida_mention_density, offset):
+    '''
+    Make the tokens for one sentence, as dictionaries, along with the
+    (start, end) token spans of the named entities in it.
+    '''
+    tokens = []
+    for i in range(sentence_length):
+
+        # Like real sentences, these end with a full stop
+        if i == sentence_length - 1:
+            word, pos = '.', '.'
+        else:
+            word, pos = rng.choice(WORDS), rng.choice(POS_TAGS)
+
+        tokens.append({
+            'word': word,
+            'lemma': word,
+            'pos': pos,
+            'ner': 'O',
+            'begin': offset,
+            'end': offset + len(word),
+        })
+        offset += len(word) + 1
+
+    # Place named entities, which are what AIDA will disambiguate.  They
+    # never include the full stop.
+    entities = []
+    num_words = sentence_length - 1
+    i = 0
+    while i < num_words:
+        if rng.random() < aida_mention_density:
+            length = min(rng.randint(1, MAX_ENTITY_LENGTH), num_words - i)
+            ner_type = rng.choice(NER_TYPES)
+            for token in tokens[i:i+length]:
+                token['ner'] = ner_type
+                token['pos'] = 'NNP'
+            entities.append((i, i + length))
+
+            # Leave a gap, so that adjacent entities aren't merged
+            i += length + 1
+        else:
+            i += 1
+
+    return tokens, entities, offset
+
+
+def _generate_parse(rng, tokens, parse_depth):
+    '''
+    Make a constituency parse over `tokens`, with phrases nested
+    `parse_depth` levels deep (where the sentence is long enough).
+    '''
+    def build(start, end, depth):
+        if depth >= parse_depth or end - start < 2:
+            return ' '.join(
+                '(%s %s)' % (tokens[i]['pos'], tokens[i]['word'])
+                for i in range(start, end)
+            )
+
+        # Split into two phrases
+        split = rng.randint(start + 1, end - 1)
+        return ' '.join(
+            '(%s %s)' % (rng.choice(PHRASE_TAGS), build(s, e, depth + 1))
+            for s, e in [(start, split), (split, end)]
+        )
+
+    return '(ROOT (S %s))' % build(0, len(tokens), 0)
+
+
+def _generate_dependencies(rng, sentence_length, dependency_density):
+    '''
+    Make (relation, governor, dependent) triples using 1-based token
+    indices, where a governor of 0 marks the root.
+    '''
+    root = rng.randint(1, sentence_length)
+    edges = [('root', 0, root)]
+
+    # Attach tokens to the tree, each to a token already in the tree
+    attached = [root]
+    others = [i for i in range(1, sentence_length + 1) if i != root]
+    rng.shuffle(others)
+    num_tree_edges = int(round(min(dependency_density, 1) * len(others)))
+    for dependent in others[:num_tree_edges]:
+        governor = rng.choice(attached)
+        edges.append((rng.choice(DEPENDENCY_RELATIONS), governor, dependent))
+        attached.append(dependent)
+
+    # Add extra edges between random tokens
+    num_extra_edges = int(round(
+        max(dependency_density - 1, 0) * sentence_length))
+    for i in range(num_extra_edges):
+        governor = rng.randint(1, sentence_length)
+        dependent = rng.randint(1, sentence_length)
+        if governor != dependent:
+            edges.append(
+                (rng.choice(DEPENDENCY_RELATIONS), governor, dependent))
+
+    return edges
+
+
+def _sentence_xml(sentence_id, tokens, parse, edges):
+    lines = ['<sentence id="%d">' % sentence_id, '<tokens>']
+    for i, token in enumerate(tokens):
+        lines.append(
+            '<token id="%d"><word>%s</word><lemma>%s</lemma>'
+            '<CharacterOffsetBegin>%d</CharacterOffsetBegin>'
+            '<CharacterOffsetEnd>%d</CharacterOffsetEnd>'
+            '<POS>%s</POS><NER>%s</NER><Speaker>PER0</Speaker></token>' % (
+                i + 1, escape(token['word']), escape(token['lemma']),
+                token['begin'], token['end'], token['pos'], token['ner']
+            )
+        )
+    lines.append('</tokens>')
+    lines.append('<parse>%s </parse>' % escape(parse))
+
+    for dependencies_type in DEPENDENCY_TYPES:
+        lines.append('<dependencies type="%s">' % dependencies_type)
+        for relation, governor, dependent in edges:
+            lines.append(
+                '<dep type="%s"><governor idx="%d">%s</governor>'
+                '<dependent idx="%d">%s</dependent></dep>' % (
+                    relation,
+                    governor,
+                    'ROOT' if governor == 0 else
+                        escape(tokens[governor-1]['word']),
+                    dependent,
+                    escape(tokens[dependent-1]['word'])
+                )
+            )
+        lines.append('</dependencies>')
+
+    lines.append('</sentence>')
+    return '\n'.join(lines)
+
+
+def _sentence_json(sentence_id, tokens, parse, edges):
+    dependencies = [
+        {
+            'dep': 'ROOT' if governor == 0 else relation,
+            'governor': governor,
+            'governorGloss': (
+                'ROOT' if governor == 0 else tokens[governor-1]['word']),
+            'dependent': dependent,
+            'dependentGloss': tokens[dependent-1]['word'],
+        }
+        for relation, governor, dependent in edges
+    ]
+
+    sentence = {
+        'index': sentence_id - 1,
+        'parse': parse,
+        'tokens': [
+            {
+                'index': i + 1,
+                'word': token['word'],
+                'originalText': token['word'],
+                'lemma': token['lemma'],
+                'characterOffsetBegin': token['begin'],
+                'characterOffsetEnd': token['end'],
+                'pos': token['pos'],
+                'ner': token['ner'],
+                'speaker': 'PER0',
+            }
+            for i, token in enumerate(tokens)
+        ],
+    }
+    for key in JSON_DEPENDENCY_KEYS:
+        sentence[key] = dependencies
+    return sentence
+
+
+def _generate_coreferences(
+    rng, sentences, num_coref_chains, coref_chain_length
+):
+    '''
+    Make coreference chains, as lists of (sentence_idx, start, end) token
+    spans, using 0-based indices, with `end` one past the last token.  The
+    first mention in each chain is its representative.
+    '''
+    chains = []
+    for chain in range(num_coref_chains):
+        mentions = []
+        for i in range(coref_chain_length):
+            sentence_idx = rng.randrange(len(sentences))
+            tokens = sentences[sentence_idx]
+            length = min(rng.randint(1, MAX_MENTION_LENGTH), len(tokens))
+            start = rng.randint(0, len(tokens) - length)
+            mentions.append((sentence_idx, start, start + length))
+        chains.append(mentions)
+    return chains
+
+
+def _coreference_xml(sentences, chains):
+    lines = ['<coreference>']
+    for mentions in chains:
+        lines.append('<coreference>')
+        for i, (sentence_idx, start, end) in enumerate(mentions):
+            tokens = sentences[sentence_idx]
+            lines.append(
+                '<mention%s><sentence>%d</sentence><start>%d</start>'
+                '<end>%d</end><head>%d</head><text>%s</text></mention>' % (
+                    ' representative="true"' if i == 0 else '',
+                    sentence_idx + 1, start + 1, end + 1, end,
+                    escape(' '.join(t['word'] for t in tokens[start:end]))
+                )
+            )
+        lines.append('</coreference>')
+    lines.append('</coreference>')
+    return '\n'.join(lines)
+
+
+def _coreference_json(sentences, chains):
+    corefs = {}
+    for chain_idx, mentions in enumerate(chains):
+        corefs[str(chain_idx + 1)] = [
+            {
+                'sentNum': sentence_idx + 1,
+                'startIndex': start + 1,
+                'endIndex': end + 1,
+                'headIndex': end,
+                'text': ' '.join(
+                    t['word'] for t in sentences[sentence_idx][start:end]),
+                'isRepresentativeMention': i == 0,
+            }
+            for i, (sentence_idx, start, end) in enumerate(mentions)
+        ]
+    return corefs
+
+
+def generate_document(
+    num_sentences=10,
+    sentence_length=20,
+    parse_depth=4,
+    dependency_density=1.0,
+    num_coref_chains=5,
+    coref_chain_length=3,
+    aida_mention_density=0.1,
+    seed=None,
+    output_format='xml'
+):
+    '''
+    Generate a synthetic document.  Returns (corenlp_xml, aida_json).
+    See the module docstring for a description of the arguments.  Passing
+    the same `seed` produces the same document.  If `output_format` is
+    "json", the CoreNLP output is given in CoreNLP's json format instead 
+    (read it with `AnnotatedText(..., input_format='json')`).
+    '''
+    if output_format not in ('xml', 'json'):
+        raise ValueError('output_format must be one of "xml" or "json".')
+    if sentence_length < 2:
+        raise ValueError('sentence_length must be at least 2.')
+    if num_coref_chains > 0 and num_sentences < 1:
+        raise ValueError('Coreference chains need at least one sentence.')
+
+    rng = random.Random(seed)
+
+    offset = 0
+    sentences = []
+    sentence_outputs = []
+    aida_mentions = []
+    entity_metadata = {}
+    for sentence_idx in range(num_sentences):
+        tokens, entities, offset = _generate_tokens(
+            rng, sentence_length, aida_mention_density, offset)
+        parse = _generate_parse(rng, tokens, parse_depth)
+        edges = _generate_dependencies(
+            rng, sentence_length, dependency_density)
+        sentences.append(tokens)
+        if output_format == 'json':
+            sentence_outputs.append(
+                _sentence_json(sentence_idx + 1, tokens, parse, edges))
+        else:
+            sentence_outputs.append(
+                _sentence_xml(sentence_idx + 1, tokens, parse, edges))
+
+        # Every named entity gets disambiguated by AIDA
+        for start, end in entities:
+            kbid = 'YAGO:Entity_%d' % rng.randrange(num_sentences + 1)
+            begin = tokens[start]['begin']
+            aida_mentions.append({
+                'offset': begin,
+                'length': tokens[end-1]['end'] - begin,
+                'name': ' '.join(t['word'] for t in tokens[start:end]),
+                'bestEntity': {
+                    'kbIdentifier': kbid,
+                    'disambiguationScore': '%.2f' % rng.random(),
+                },
+            })
+            entity_metadata[kbid] = {
+                'type': ['YAGO_wordnet_entity_100001740']}
+
+    chains = _generate_coreferences(
+        rng, sentences, num_coref_chains, coref_chain_length)
+
+    if output_format == 'json':
+        corenlp_xml = json.dumps({
+            'sentences': sentence_outputs,
+            'corefs': _coreference_json(sentences, chains),
+        })
+    else:
+        corenlp_xml = '\n'.join([
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<root>',
+            '<document>',
+            '<sentences>',
+            '\n'.join(sentence_outputs),
+            '</sentences>',
+            _coreference_xml(sentences, chains),
+            '</document>',
+            '</root>',
+        ])
+
+    aida_json = json.dumps({
+        'originalText': ' '.join(
+            t['word'] for tokens in sentences for t in tokens),
+        'mentions': aida_mentions,
+        'entityMetadata': entity_metadata,
+    })
+
+    return corenlp_xml, aida_json
+
+
+def write_document(data_dir, article_id, **kwargs):
+    '''
+    Generate a document and write it as `CoreNLP/<article_id>.xml` and
+    `AIDA/<article_id>.json` within `data_dir`, which is the layout read
+    by corpus.find_corpus_pairs().  Returns the two paths.
+    '''
+    corenlp_xml, aida_json = generate_document(**kwargs)
+
+    paths = []
+    for subdir, ext, content in [
+        ('CoreNLP', '.xml', corenlp_xml), ('AIDA', '.json', aida_json)
+    ]:
+        directory = os.path.join(data_dir, subdir)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, article_id + ext)
+        open(path, 'w').write(content)
+        paths.append(path)
+
+    return tuple(paths)
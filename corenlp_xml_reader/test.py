@@ -1,7 +1,36 @@
+import bz2
+from collections import Counter
+from copy import deepcopy
+import cPickle
+import gc
+import gzip
 import json
+import os
+import pickle
 from os import path
-from unittest import main, TestCase
+import shutil
+from StringIO import StringIO
+import tarfile
+import tempfile
+import threading
+import weakref
+import zipfile
+from unittest import main, skipIf, TestCase
 from annotated_text import AnnotatedText as A
+import archives
+import arrow_tables
+import conllu
+import corpus
+import document_store
+import encoding
+import labels
+import benchmark
+import columnar
+import sources
+import sentence_index
+import statistics
+import synthetic
+from instrumentation import Collector
 
 HERE = path.abspath(path.dirname(__file__))
 AIDA_PATH = path.join(HERE, 'data/AIDA/b670037f5942445d.txt.json')
@@ -27,6 +56,31 @@ def load_unicode_article():
 	)
 
 
+def describe_stored_article(article):
+	'''
+	What a stored and rebuilt document should have kept.
+	'''
+	return (
+		[str(t) for t in article.tokens],
+		[t['lemma'] for t in article.tokens],
+		[(p[0], p[1]['id']) for t in article.tokens for p in t['parents']],
+		[(c[0], c[1]['id']) for t in article.tokens for c in t['children']],
+		[t.get('c_tag') for t in article.tokens],
+		[
+			(r['id'], r.get('kbIdentifier'), r.get('types'), [
+				(m['sentence_id'], m['start'], m['end'], m['head']['id'],
+					m.get('kbIdentifier'), m.get('types'))
+				for m in r['mentions']
+			])
+			for r in article.references
+		],
+		[r['id'] for r in article.disambiguated_references],
+		[[m['start'] for m in t['mentions']] for t in article.tokens],
+		[[r['id'] for r in s['references']] for s in article.sentences],
+		[[e['start'] for e in s['entities']] for s in article.sentences],
+	)
+
+
 
 class TestEntityLinking(TestCase):
 
@@ -103,6 +157,1395 @@ class TestBasicLoad(TestCase):
 		self.assertEqual(expected, actual_repr)
 
 
+class TestParallelParse(TestCase):
+
+	def test_parallel_matches_serial(self):
+		xml = open(CORENLP_PATH).read()
+		aida = open(AIDA_PATH).read()
+		serial = A(xml, aida)
+		parallel = A(xml, aida, processes=2)
+
+		self.assertEqual(len(serial.sentences), len(parallel.sentences))
+		self.assertEqual(
+			[t['word'] for t in serial.tokens],
+			[t['word'] for t in parallel.tokens]
+		)
+		self.assertEqual(
+			[(p[0], p[1]['id']) for t in serial.tokens for p in t['parents']],
+			[(p[0], p[1]['id']) for t in parallel.tokens for p in t['parents']]
+		)
+		self.assertEqual(
+			[r.get('kbIdentifier') for r in serial.references],
+			[r.get('kbIdentifier') for r in parallel.references]
+		)
+
+
+class TestCorpusLoader(TestCase):
+
+	def test_iter_corpus_in_order(self):
+		pairs = corpus.find_corpus_pairs(
+			path.join(DATA_DIR, 'CoreNLP'), path.join(DATA_DIR, 'AIDA'))[:3]
+		expected = [
+			corpus.load(xml_path, aida_path).tokens[0]['word']
+			for xml_path, aida_path in pairs
+		]
+		for executor in ['thread', 'process']:
+			found = [
+				article.tokens[0]['word'] for article in corpus.iter_corpus(
+					pairs, executor=executor, workers=2, max_in_flight=2)
+			]
+			self.assertEqual(found, expected)
+
+		contents = list(corpus.iter_pair_contents(pairs))
+		self.assertEqual(
+			[article_id + '.xml' for article_id, xml, aida in contents],
+			[path.basename(xml_path) for xml_path, aida_path in pairs]
+		)
+		self.assertEqual(contents[0][2], open(pairs[0][1]).read())
+
+	def test_load_async(self):
+		loaded = []
+		with corpus.CorpusLoader('thread', 1, max_in_flight=1) as loader:
+			pending = loader.load_async(
+				CORENLP_PATH, AIDA_PATH, callback=loaded.append)
+			article = pending.get()
+		self.assertEqual(loaded, [article])
+		self.assertEqual(str(article.tokens[0]), ' 0: President (0,9) NNP -')
+
+		# Failures are passed to error_callback, and raised by get()
+		errors = []
+		with corpus.CorpusLoader('thread', 1, max_in_flight=1) as loader:
+			pending = loader.load_async(
+				CORENLP_PATH, callback=loaded.append,
+				error_callback=errors.append, dependencies='none'
+			)
+			with self.assertRaises(ValueError):
+				pending.get()
+		self.assertEqual(loaded, [article])
+		self.assertEqual(len(errors), 1)
+		self.assertTrue(isinstance(errors[0], ValueError))
+
+	def test_load_async_slots(self):
+
+		# Failed loads give their slot back
+		errors = []
+		loaded = []
+		with corpus.CorpusLoader('process', 1, max_in_flight=1) as loader:
+			for dependencies in ['none', 'none', 'basic']:
+				pending = loader.load_async(
+					CORENLP_PATH, callback=loaded.append,
+					error_callback=errors.append, dependencies=dependencies
+				)
+			self.assertTrue(pending.get() is loaded[0])
+		self.assertEqual(len(errors), 2)
+
+		# Without blocking, nothing is loaded while the loader is full
+		started = threading.Event()
+		release = threading.Event()
+		def occupy():
+			started.set()
+			release.wait()
+		with corpus.CorpusLoader('thread', 1, max_in_flight=1) as loader:
+			loader.pool.apply_async(occupy)
+			started.wait()
+			pending = loader.load_async(CORENLP_PATH)
+			self.assertEqual(loader.load_async(CORENLP_PATH, block=False), None)
+			release.set()
+			pending.get()
+			self.assertFalse(
+				loader.load_async(CORENLP_PATH, block=False) is None)
+
+
+class TestBenchmark(TestCase):
+
+	def test_replicate_sentences(self):
+		xml, aida = benchmark.replicate_sentences(
+			open(CORENLP_PATH).read(), 2, open(AIDA_PATH).read())
+		original = load_test_article()
+		replicated = A(xml, aida)
+
+		num_sentences = len(original.sentences)
+		self.assertEqual(len(replicated.sentences), 2 * num_sentences)
+		self.assertEqual(len(replicated.references), 2 * len(original.references))
+
+		# The copy has its own offsets and gets the same AIDA links
+		first = replicated.sentences[0]['tokens'][0]
+		copy = replicated.sentences[num_sentences]['tokens'][0]
+		self.assertEqual(first['word'], copy['word'])
+		self.assertTrue(
+			copy['character_offset_begin'] > 
+			original.tokens[-1]['character_offset_end']
+		)
+		self.assertEqual(
+			sorted(m.get('kbIdentifier') for m in first['mentions']),
+			sorted(m.get('kbIdentifier') for m in copy['mentions'])
+		)
+
+	def test_time_construction(self):
+		article, collector = benchmark.time_construction(
+			open(CORENLP_PATH).read(), open(AIDA_PATH).read())
+		self.assertEqual(collector.phases.keys(), [
+			'beautiful_soup_parse', 'read_all_sentences',
+			'refresh_token_offsets', 'build_coreferences', 'link_references',
+			'read_aida_json'
+		])
+		self.assertEqual(str(article.tokens[0]), ' 0: President (0,9) NNP -')
+
+	def test_benchmark_gc(self):
+		pairs = corpus.find_corpus_pairs(
+			path.join(DATA_DIR, 'CoreNLP'), path.join(DATA_DIR, 'AIDA'))[:2]
+		results = benchmark.benchmark_gc(pairs)
+		self.assertTrue(results['default']['collected_objects'] > 0)
+		self.assertEqual(results['cycle_free']['collected_objects'], 0)
+
+
+class TestMentionSpans(TestCase):
+
+	def test_mentions_are_views(self):
+		article = load_test_article()
+		mentions = [m for r in article.references for m in r['mentions']]
+		mentions += [e for s in article.sentences for e in s['entities']]
+		for mention in mentions:
+			sentence = article.sentences[mention['sentence_id']]
+			self.assertEqual(
+				mention['tokens'],
+				sentence['tokens'][mention['start']:mention['end'] + 1]
+			)
+			self.assertTrue('tokens' in mention)
+			self.assertEqual(mention.get('tokens'), mention['tokens'])
+
+			# The tokens are looked up, rather than stored
+			self.assertFalse('tokens' in mention.keys())
+
+		with self.assertRaises(KeyError):
+			mentions[0]['kbIdentifier_missing']
+
+
+class TestCoreferenceIndex(TestCase):
+
+	def test_matches_links(self):
+		article = load_test_article()
+		index = article.coreference_index
+		for token in article.tokens:
+			self.assertEqual(index.mentions_for_token(token), token['mentions'])
+			references = []
+			for mention in token['mentions']:
+				if mention['reference'] not in references:
+					references.append(mention['reference'])
+			self.assertEqual(index.references_for_token(token), references)
+
+		for sentence in article.sentences:
+			self.assertEqual(
+				index.mentions_in_sentence(sentence['id']), sentence['mentions'])
+			self.assertEqual(
+				index.references_in_sentence(sentence['id']),
+				sentence['references']
+			)
+
+		for reference in article.references:
+			self.assertEqual(
+				index.mentions_for_reference(reference), reference['mentions'])
+			self.assertEqual(
+				[s['id'] for s in index.sentences_for_reference(reference)],
+				sorted(set(m['sentence_id'] for m in reference['mentions']))
+			)
+
+	def test_ner_references(self):
+		article = A(
+			open(CORENLP_PATH).read(), exclude_non_ner_coreferences=True)
+
+		# Every entity is the representative of a reference, or is among a
+		# reference's mentions
+		mentioned = set(
+			(m['sentence_id'], t['id']) for r in article.references
+			for m in r['mentions'] for t in m['tokens']
+		)
+		for sentence in article.sentences:
+			for entity in sentence['entities']:
+				self.assertTrue(
+					(entity['sentence_id'], entity['head']['id']) in mentioned)
+
+		# References made from entities come in document order
+		from_entities = [r for r in article.references
+			if r not in article.coreferences]
+		positions = [
+			(r['representative']['sentence_id'], r['representative']['start'])
+			for r in from_entities
+		]
+		self.assertEqual(positions, sorted(positions))
+
+
+def short_sentence(tokens):
+	return len(tokens) < 25
+
+
+class TestSentenceFilter(TestCase):
+
+	def mentions(self, article):
+		ids = article.source_sentence_ids or range(len(article.sentences))
+		return sorted(
+			(ids[m['sentence_id']], m['start'], m['end'], m.get('kbIdentifier'))
+			for r in article.references for m in r['mentions']
+		)
+
+	def test_filter(self):
+		xml = open(CORENLP_PATH).read()
+		aida = open(AIDA_PATH).read()
+		full = A(xml, aida)
+		article = A(xml, aida, sentence_filter=short_sentence)
+
+		kept = [s['id'] for s in full.sentences if short_sentence(s['tokens'])]
+		self.assertTrue(0 < len(kept) < len(full.sentences))
+		self.assertEqual(article.source_sentence_ids, kept)
+
+		# Kept sentences are renumbered
+		for sentence_id, sentence in enumerate(article.sentences):
+			self.assertEqual(sentence['id'], sentence_id)
+			self.assertTrue(all(
+				t['sentence_id'] == sentence_id for t in sentence['tokens']))
+			self.assertEqual(
+				sentence.as_string(),
+				full.sentences[kept[sentence_id]].as_string()
+			)
+
+		# Coreference and AIDA mentions are those of the kept sentences
+		self.assertEqual(
+			self.mentions(article),
+			[m for m in self.mentions(full) if m[0] in kept]
+		)
+
+		# Workers apply the filter too
+		parallel = A(xml, aida, sentence_filter=short_sentence, processes=2)
+		self.assertEqual(self.mentions(parallel), self.mentions(article))
+
+	def test_unpicklable_filter(self):
+		xml = open(CORENLP_PATH).read()
+		keep = lambda tokens: len(tokens) < 25
+		with self.assertRaises(ValueError):
+			A(xml, sentence_filter=keep, processes=2)
+
+		loader = corpus.CorpusLoader('process', 1)
+		try:
+			with self.assertRaises(ValueError):
+				list(loader.iter_contents(
+					[(None, xml, None)], sentence_filter=keep))
+		finally:
+			loader.close()
+
+		# Any predicate can be used without worker processes
+		self.assertEqual(
+			A(xml, sentence_filter=keep).source_sentence_ids,
+			A(xml, sentence_filter=short_sentence).source_sentence_ids
+		)
+
+	def test_filter_json(self):
+		options = dict(num_sentences=12, aida_mention_density=0.3, seed=5)
+		xml, aida = synthetic.generate_document(**options)
+		corenlp_json, aida = synthetic.generate_document(
+			output_format='json', **options)
+		keep = lambda tokens: tokens[0]['character_offset_begin'] % 2 == 0
+
+		from_xml = A(xml, aida, sentence_filter=keep)
+		from_json = A(
+			corenlp_json, aida, input_format='json', sentence_filter=keep)
+		self.assertEqual(
+			from_xml.source_sentence_ids, from_json.source_sentence_ids)
+		self.assertEqual(self.mentions(from_xml), self.mentions(from_json))
+
+
+class TestTokenFields(TestCase):
+
+	def test_projection(self):
+		corenlp_json, aida = synthetic.generate_document(
+			output_format='json', seed=0)
+		sources = [
+			(open(CORENLP_PATH).read(), 'xml'), (corenlp_json, 'json')]
+		fields = ['word', 'character_offset_begin', 'character_offset_end']
+
+		for source, input_format in sources:
+			full = A(source, input_format=input_format)
+			article = A(source, input_format=input_format, token_fields=fields)
+
+			for token, expected in zip(article.tokens, full.tokens):
+				self.assertFalse('lemma' in token or 'pos' in token)
+				for field in fields:
+					self.assertEqual(token[field], expected[field])
+
+			# Dependencies are still read, but entities need the ner field
+			self.assertEqual(
+				[len(t['parents']) for t in article.tokens],
+				[len(t['parents']) for t in full.tokens]
+			)
+			self.assertEqual(
+				sum(len(s['entities']) for s in article.sentences), 0)
+			str(article.tokens[0])
+
+	def test_projection_without_words(self):
+		article = A(
+			open(CORENLP_PATH).read(), token_fields=['lemma', 'pos'])
+		sentence = article.sentences[0]
+		self.assertEqual(
+			sentence.as_string(), ' '.join(['_'] * len(sentence['tokens'])))
+		str(article)
+
+		out = StringIO()
+		conllu.write_conllu([article], out)
+		first_token = out.getvalue().split('\n')[2].split('\t')
+		self.assertEqual(first_token[1], '_')
+		self.assertEqual(
+			first_token[2], article.sentences[0]['tokens'][0]['lemma'])
+
+	def test_bad_fields(self):
+		xml = open(CORENLP_PATH).read()
+		with self.assertRaises(ValueError):
+			A(xml, token_fields=['word', 'shape'])
+
+		# AIDA mentions are aligned by character offsets
+		with self.assertRaises(ValueError):
+			A(xml, open(AIDA_PATH).read(), token_fields=['word', 'ner'])
+
+
+class TestLabels(TestCase):
+
+	def test_vocabulary(self):
+		vocabulary = labels.LabelVocabulary('test', ['NN', 'VB'])
+		self.assertEqual(vocabulary.id('VB'), 1)
+		self.assertEqual(vocabulary.id(u'JJ'), 2)
+		self.assertEqual(vocabulary.label(2), u'JJ')
+		self.assertEqual(len(vocabulary), 3)
+		self.assertTrue(vocabulary.intern('NN') is vocabulary.label(0))
+		self.assertEqual(vocabulary.intern(None), None)
+
+	def test_labels_shared(self):
+		xml = open(CORENLP_PATH).read()
+		documents = [
+			A(xml), A(xml, processes=2), pickle.loads(pickle.dumps(A(xml), 2))]
+
+		pos = labels.VOCABULARIES['pos']
+		dep = labels.VOCABULARIES['dep']
+		c_tag = labels.VOCABULARIES['c_tag']
+		for article in documents:
+			for token in article.tokens:
+				self.assertTrue(token['pos'] is pos.label(pos.id(token['pos'])))
+				self.assertTrue(token['c_tag'] is c_tag.intern(token['c_tag']))
+				for dep_type, governor in token['parents']:
+					self.assertTrue(dep_type is dep.intern(dep_type))
+
+		# Labels are only shared if asked for
+		article = A(xml, intern_labels=False)
+		self.assertFalse(all(
+			t['pos'] is pos.intern(t['pos']) for t in article.tokens))
+
+
+class TestEncoding(TestCase):
+
+	def test_vocabulary(self):
+		counts = Counter({'the': 5, 'a': 5, 'cat': 2, 'sat': 1})
+		vocabulary = encoding.Vocabulary.from_counts(counts, min_count=2)
+		self.assertEqual(
+			vocabulary.labels, [u'<pad>', u'<unk>', 'a', 'the', 'cat'])
+		self.assertEqual(vocabulary.id('sat'), vocabulary.id(u'<unk>'))
+		self.assertEqual(vocabulary.label(3), 'the')
+
+		vocabulary = encoding.Vocabulary.from_counts(counts, max_size=3)
+		self.assertEqual(len(vocabulary), 3)
+		with self.assertRaises(ValueError):
+			encoding.Vocabulary.from_counts(counts, max_size=1)
+
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			vocabulary_path = path.join(tmp_dir, 'vocabulary.json')
+			vocabulary.save(vocabulary_path)
+			self.assertEqual(
+				encoding.Vocabulary.load(vocabulary_path).labels,
+				vocabulary.labels
+			)
+		finally:
+			shutil.rmtree(tmp_dir)
+
+		vocabulary = encoding.Vocabulary(['x'], reserved=[], unknown=None)
+		with self.assertRaises(KeyError):
+			vocabulary.id('y')
+		with self.assertRaises(ValueError):
+			encoding.Vocabulary(['x'], reserved=[])
+
+	@skipIf(encoding.numpy is None, 'numpy is not installed')
+	def test_encode(self):
+		article = load_test_article()
+		counts = encoding.count_labels(article.sentences)
+		encoder = encoding.Encoder(encoding.build_vocabularies(counts))
+		encoded = encoder.encode(article)
+
+		self.assertEqual(len(encoded['word']), len(article.tokens))
+		offsets = [0]
+		for sentence in article.sentences:
+			offsets.append(offsets[-1] + len(sentence['tokens']))
+		self.assertEqual(list(encoded['sentence_offsets']), offsets)
+		self.assertEqual(list(encoded['document_offsets']),
+			[0, len(article.sentences)])
+		words = encoder.vocabularies['word']
+		self.assertEqual(
+			[words.label(i) for i in encoded['word']],
+			[t['word'] for t in article.tokens]
+		)
+
+		# Tokens outside named entities have the NER label "O"
+		ners = encoder.vocabularies['ner']
+		self.assertEqual(
+			[ners.label(i) for i in encoded['ner']],
+			[t['ner'] or 'O' for t in article.tokens]
+		)
+
+		# Vocabularies can be saved and loaded
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			vocabulary_path = path.join(tmp_dir, 'vocabularies.json')
+			encoder.save(vocabulary_path)
+			loaded = encoding.Encoder.load(vocabulary_path)
+			self.assertEqual(loaded.vocabularies.keys(), encoding.ENCODED_FIELDS)
+			self.assertEqual(
+				list(loaded.encode(article)['lemma']), list(encoded['lemma']))
+		finally:
+			shutil.rmtree(tmp_dir)
+
+	@skipIf(encoding.numpy is None, 'numpy is not installed')
+	def test_encode_corpus(self):
+		pairs = corpus.find_corpus_pairs(
+			path.join(DATA_DIR, 'CoreNLP'), path.join(DATA_DIR, 'AIDA'))[:3]
+		counts = encoding.count_corpus(pairs, executor='thread', workers=2)
+		encoder = encoding.Encoder(encoding.build_vocabularies(counts))
+
+		documents = [corpus.load(*pair) for pair in pairs]
+		expected = list(encoder.iter_batches(documents, batch_size=2))
+		found = list(encoding.encode_corpus(
+			pairs, encoder, batch_size=2, workers=2))
+		self.assertEqual(len(found), 2)
+		for batch, expected_batch in zip(found, expected):
+			for key in expected_batch:
+				self.assertEqual(list(batch[key]), list(expected_batch[key]))
+		self.assertEqual(list(found[0]['document_offsets'][-1:]),
+			[len(documents[0].sentences) + len(documents[1].sentences)])
+
+		# Sentence streams are encoded in batches of sentences
+		sentences = documents[0].sentences
+		batches = list(encoder.iter_sentence_batches(sentences, batch_size=4))
+		self.assertEqual(len(batches), -(-len(sentences) // 4))
+		self.assertEqual(
+			sum(len(batch['word']) for batch in batches),
+			len(documents[0].tokens)
+		)
+
+
+def count_verbs(annotated_text):
+	return Counter(t['pos'] for t in annotated_text.tokens
+		if t['pos'].startswith('VB'))
+
+
+class TestStatistics(TestCase):
+
+	def test_collect(self):
+		article = load_test_article()
+		totals = statistics.collect_statistics([article, article])
+		self.assertEqual(totals.keys(), [
+			'sizes', 'ner_types', 'chain_lengths', 'aida_links',
+			'kb_identifiers'
+		])
+		self.assertEqual(totals['sizes']['documents'], 2)
+		self.assertEqual(totals['sizes']['tokens'], 2 * len(article.tokens))
+		self.assertEqual(
+			sum(totals['chain_lengths'].values()), 2 * len(article.coreferences))
+		self.assertEqual(
+			sum(totals['kb_identifiers'].values()),
+			2 * len(article.disambiguated_references)
+		)
+
+		# A mention is created for an AIDA mention that matches none
+		xml = open(CORENLP_PATH).read()
+		token = [t for t in A(xml).tokens if not t['mentions']][0]
+		aida = json.dumps({
+			'mentions': [{
+				'offset': token['character_offset_begin'],
+				'length': len(token['word']),
+				'bestEntity': {
+					'kbIdentifier': 'YAGO:X', 'disambiguationScore': '0.5'}
+			}],
+			'entityMetadata': {'YAGO:X': {'type': ['YAGO_thing']}}
+		})
+		totals = statistics.collect_statistics([A(xml, aida)])
+		self.assertEqual(totals['aida_links'], Counter({'created': 1}))
+		self.assertEqual(totals['kb_identifiers'], Counter({'YAGO:X': 1}))
+
+	def test_corpus_statistics(self):
+		pairs = corpus.find_corpus_pairs(
+			path.join(DATA_DIR, 'CoreNLP'), path.join(DATA_DIR, 'AIDA'))[:3]
+		chosen = [
+			statistics.NerTypes(), statistics.KbIdentifiers(),
+			statistics.Statistic('verbs', count_verbs)
+		]
+		expected = statistics.collect_statistics(
+			[corpus.load(*pair) for pair in pairs], chosen)
+		self.assertTrue(expected['verbs']['VBD'] > 0)
+
+		totals = statistics.corpus_statistics(pairs, chosen, workers=2)
+		self.assertEqual(totals, expected)
+
+		with self.assertRaises(ValueError):
+			statistics.collect_statistics([], [chosen[0], chosen[0]])
+
+
+class TestIncrementalReparse(TestCase):
+
+	def describe(self, article):
+		return (
+			[str(t) for t in article.tokens],
+			[t['lemma'] for t in article.tokens],
+			[(p[0], p[1]['id']) for t in article.tokens for p in t['parents']],
+			[
+				(r['id'], r.get('kbIdentifier'), [
+					(m['sentence_id'], m['start'], m['end'], m['head']['id'])
+					for m in r['mentions']
+				])
+				for r in article.references
+			],
+			[[m['start'] for m in t['mentions']] for t in article.tokens],
+			[[r['id'] for r in s['references']] for s in article.sentences],
+		)
+
+	def test_hash_file(self):
+		expected = A(open(CORENLP_PATH).read(), hash_sentences=True)
+		article = A(
+			open(CORENLP_PATH, 'rb'), hash_sentences=True, keep_text=False)
+		self.assertEqual(len(article.sentences), len(expected.sentences))
+		self.assertEqual(article.sentence_hashes, expected.sentence_hashes)
+
+	def test_reuse_sentences(self):
+		xml = open(CORENLP_PATH).read()
+		aida = open(AIDA_PATH).read()
+
+		# Change a lemma in the third sentence
+		sentence_start = xml.index('<sentence id="3"')
+		lemma_start = xml.index('<lemma>', sentence_start) + len('<lemma>')
+		changed_xml = xml[:lemma_start] + 'changed-' + xml[lemma_start:]
+
+		for previous in [
+			A(xml, aida, hash_sentences=True),
+			pickle.loads(pickle.dumps(A(xml, aida, hash_sentences=True), 2)),
+			A(xml, aida, hash_sentences=True, cycle_free=True),
+		]:
+			old_sentences = list(previous.sentences)
+			collector = Collector()
+			article = A(changed_xml, aida, previous=previous,
+				instrumentation=collector)
+
+			self.assertEqual(
+				collector.counters['reused_sentences'], len(old_sentences) - 1)
+			self.assertTrue(article.sentences[0] is old_sentences[0])
+			self.assertFalse(article.sentences[2] is old_sentences[2])
+			self.assertEqual(len(article.sentence_hashes), len(old_sentences))
+			self.assertEqual(
+				self.describe(article), self.describe(A(changed_xml, aida)))
+
+	def test_previous_must_match(self):
+		xml = open(CORENLP_PATH).read()
+		with self.assertRaises(ValueError):
+			A(xml, previous=A(xml))
+		with self.assertRaises(ValueError):
+			A(xml, previous=A(xml, hash_sentences=True), dependencies='basic')
+
+
+class TestSentenceIndex(TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.path = path.join(self.tmp_dir, 'article.xml')
+		shutil.copy(CORENLP_PATH, self.path)
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def test_random_access(self):
+		article = load_test_article()
+		document = sentence_index.IndexedDocument(self.path)
+		self.assertTrue(path.exists(self.path + '.idx'))
+		self.assertEqual(len(document), len(article.sentences))
+
+		for sentence_id in reversed(range(len(document))):
+			sentence = document.sentence(sentence_id)
+			expected = article.sentences[sentence_id]
+			self.assertEqual(sentence['id'], sentence_id)
+			self.assertEqual(
+				[str(t) for t in sentence['tokens']],
+				[str(t) for t in expected['tokens']]
+			)
+
+		self.assertEqual(
+			[s['id'] for s in document.sentences(1, 3)], [1, 2])
+		self.assertTrue(document.coreference_xml().startswith('<coreference>'))
+		self.assertTrue(document.coreference_xml().endswith('</coreference>'))
+		with self.assertRaises(IndexError):
+			document.sentence(len(document))
+
+	def test_stale_index(self):
+		index = sentence_index.load_index(self.path)
+		with open(self.path, 'ab') as f:
+			f.write('\n')
+		self.assertFalse(index.is_current(self.path))
+		with self.assertRaises(ValueError):
+			sentence_index.load_index(self.path, rebuild=False)
+		rebuilt = sentence_index.load_index(self.path)
+		self.assertEqual(rebuilt.sentences, index.sentences)
+
+		# Rewrites that keep the size and modification time are noticed too
+		index = sentence_index.load_index(self.path)
+		mtime = os.stat(self.path).st_mtime
+		xml = open(self.path).read()
+		with open(self.path, 'wb') as f:
+			f.write(xml.replace('<sentences>', '<sentences> ', 1)[:-1])
+		os.utime(self.path, (mtime, mtime))
+		self.assertFalse(index.is_current(self.path))
+
+	def test_unsupported_options(self):
+		document = sentence_index.IndexedDocument(
+			self.path, dependencies='basic', token_fields=['word'])
+		self.assertFalse('lemma' in document.sentence(0)['tokens'][0])
+		with self.assertRaises(ValueError):
+			sentence_index.IndexedDocument(self.path, cycle_free=True)
+		self.assertTrue(
+			sentence_index.load_index(self.path, rebuild=False).is_current(
+				self.path))
+
+
+class TestDocumentStore(TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.store = document_store.DocumentStore(
+			path.join(self.tmp_dir, 'corpus.db'))
+
+	def tearDown(self):
+		self.store.close()
+		shutil.rmtree(self.tmp_dir)
+
+	def test_round_trip(self):
+		article = load_test_article()
+		unicode_article = load_unicode_article()
+		self.store.add_many(
+			[('article', article), ('unicode', unicode_article)],
+			batch_size=1
+		)
+		self.assertEqual(self.store.doc_ids(), ['article', 'unicode'])
+
+		rebuilt = self.store.document('article')
+		self.assertEqual(
+			describe_stored_article(rebuilt), describe_stored_article(article))
+		self.assertEqual(
+			describe_stored_article(self.store.document('unicode')),
+			describe_stored_article(unicode_article)
+		)
+
+		# Named entities that aren't in a coreference chain are the
+		# mentions of their own references
+		entities = [
+			e for s in rebuilt.sentences for e in s['entities']
+			if 'reference' in e
+		]
+		self.assertTrue(entities)
+		for entity in entities:
+			self.assertTrue(entity['reference']['mentions'][0] is entity)
+
+		# Storing a document again replaces it
+		self.store.add(article, 'article')
+		self.assertEqual(len(self.store), 2)
+		self.store.remove('unicode')
+		self.assertEqual(self.store.doc_ids(), ['article'])
+		with self.assertRaises(KeyError):
+			self.store.document('unicode')
+
+	def test_sentences_mentioning(self):
+		article = load_test_article()
+		self.store.add(article, 'article')
+		found = list(self.store.sentences_mentioning('YAGO:Carlos_Menem'))
+		self.assertEqual(
+			[(doc_id, s['id']) for doc_id, s in found],
+			[('article', 0), ('article', 2)]
+		)
+		self.assertEqual(
+			[str(t) for t in found[1][1]['tokens']],
+			[str(t) for t in article.sentences[2]['tokens']]
+		)
+
+
+class TestColumnar(TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	@skipIf(columnar.numpy is None, 'numpy is not installed')
+	def test_round_trip(self):
+		article = load_test_article()
+		unicode_article = load_unicode_article()
+		with columnar.ColumnarWriter(self.tmp_dir) as writer:
+			writer.write(article, 'article')
+			writer.write(unicode_article, 'unicode')
+			with self.assertRaises(ValueError):
+				writer.write(article, 'article')
+
+		corpus = columnar.ColumnarCorpus(self.tmp_dir)
+		self.assertEqual(len(corpus), 2)
+		self.assertEqual(corpus.index('unicode'), 1)
+
+		self.assertEqual(
+			describe_stored_article(corpus.document(0)),
+			describe_stored_article(article)
+		)
+		self.assertEqual(
+			describe_stored_article(corpus.document(1)),
+			describe_stored_article(unicode_article)
+		)
+
+		# Columns are sliced per document
+		tokens = corpus.document_tokens(1)
+		self.assertEqual(
+			[corpus.label('word', i) for i in tokens['word']],
+			[t['word'] for t in unicode_article.tokens]
+		)
+		sentence_offsets = [0]
+		for sentence in unicode_article.sentences:
+			sentence_offsets.append(
+				sentence_offsets[-1] + len(sentence['tokens']))
+		self.assertEqual(list(tokens['sentence_offsets']), sentence_offsets)
+
+		sentence = corpus.sentence(1, 2)
+		self.assertEqual(
+			[str(t) for t in sentence['tokens']],
+			[str(t) for t in unicode_article.sentences[2]['tokens']]
+		)
+		with self.assertRaises(IndexError):
+			corpus.sentence(0, len(article.sentences))
+
+	@skipIf(columnar.numpy is None, 'numpy is not installed')
+	def test_same_options(self):
+		xml = open(CORENLP_PATH).read()
+		with columnar.ColumnarWriter(self.tmp_dir) as writer:
+			writer.write(A(xml), 'first')
+			with self.assertRaises(ValueError):
+				writer.write(A(xml, dependencies='basic'), 'second')
+
+	@skipIf(columnar.numpy is None, 'numpy is not installed')
+	def test_freeze(self):
+		article = load_test_article()
+		corpus = columnar.freeze([('article', article)])
+		self.assertEqual(corpus.doc_id(0), 'article')
+		self.assertEqual(
+			describe_stored_article(corpus.document(0)),
+			describe_stored_article(article)
+		)
+
+		# The buffers are read-only
+		with self.assertRaises(ValueError):
+			corpus.columns['word'][0] = 0
+		with self.assertRaises(ValueError):
+			corpus.strings['word'].blob[0] = 0
+
+		with self.assertRaises(ValueError):
+			columnar.freeze([(None, article)])
+
+
+class TestCycleFree(TestCase):
+
+	def test_no_garbage_cycles(self):
+		xml = open(CORENLP_PATH).read()
+		aida = open(AIDA_PATH).read()
+		gc.collect()
+		was_enabled = gc.isenabled()
+		gc.disable()
+		try:
+			article = A(xml, aida, cycle_free=True)
+			del article
+			self.assertEqual(gc.collect(), 0)
+		finally:
+			if was_enabled:
+				gc.enable()
+
+	def test_same_document(self):
+		article = load_test_article()
+		cycle_free = A(
+			open(CORENLP_PATH).read(), open(AIDA_PATH).read(), cycle_free=True)
+		self.assertEqual(
+			[str(t) for t in article.tokens], [str(t) for t in cycle_free.tokens])
+
+		# Back-links are weak, but still compare equal to what they point to
+		token = cycle_free.sentences[0]['tokens'][1]
+		relation, governor = token['parents'][0]
+		self.assertTrue(governor == cycle_free.sentences[0]['tokens'][2])
+		self.assertTrue(any(child == token for r, child in governor['children']))
+		mention = cycle_free.sentences[0]['tokens'][0]['mentions'][0]
+		self.assertTrue(mention in mention['reference']['mentions'])
+		self.assertEqual(
+			[t['mentions'][0]['reference'].get('kbIdentifier')
+				for t in article.tokens if t['mentions']],
+			[t['mentions'][0]['reference'].get('kbIdentifier')
+				for t in cycle_free.tokens if t['mentions']]
+		)
+
+		# Weak links can't be pickled, so they are pickled as strong links
+		# and weakened again when unpickled
+		copy = pickle.loads(pickle.dumps(cycle_free, 2))
+		self.assertTrue(isinstance(
+			copy.tokens[1]['parents'][0][1], weakref.ProxyType))
+		self.assertEqual(copy.tokens[1]['parents'][0][1]['id'], 2)
+
+	def test_pickle_stays_cycle_free(self):
+		xml = open(CORENLP_PATH).read()
+		aida = open(AIDA_PATH).read()
+		gc.collect()
+		was_enabled = gc.isenabled()
+		gc.disable()
+		try:
+			article = A(xml, aida, cycle_free=True)
+			pickled = cPickle.dumps(article, 2)
+			copies = [cPickle.loads(pickled), deepcopy(article)]
+
+			# Pickling and copying leave the original's links weak
+			self.assertTrue(isinstance(
+				article.tokens[1]['parents'][0][1], weakref.ProxyType))
+			for copy in copies:
+				self.assertEqual(
+					[str(t) for t in copy.tokens],
+					[str(t) for t in article.tokens]
+				)
+
+			del article, copies
+			self.assertEqual(gc.collect(), 0)
+			self.assertEqual(gc.garbage, [])
+		finally:
+			if was_enabled:
+				gc.enable()
+
+
+class TestInstrumentation(TestCase):
+
+	def test_counters(self):
+		collector = Collector()
+		article = A(
+			open(CORENLP_PATH).read(), open(AIDA_PATH).read(),
+			instrumentation=collector
+		)
+		counters = collector.counters
+		self.assertEqual(counters['sentences'], len(article.sentences))
+		self.assertEqual(counters['tokens'], len(article.tokens))
+		self.assertEqual(
+			counters['dependency_edges'],
+			sum(len(t['parents']) for t in article.tokens)
+		)
+		self.assertTrue('cycle_rejected_edges' in counters)
+
+		# Counts made in worker processes are passed back
+		parallel_collector = Collector()
+		A(
+			open(CORENLP_PATH).read(), open(AIDA_PATH).read(),
+			instrumentation=parallel_collector, processes=2
+		)
+		self.assertEqual(parallel_collector.counters, counters)
+		self.assertTrue(
+			'read_sentences_in_parallel' in parallel_collector.phases)
+
+	def test_callback(self):
+		events = []
+		A(
+			open(CORENLP_PATH).read(),
+			instrumentation=lambda *event: events.append(event)
+		)
+		phases = [name for kind, name, value in events if kind == 'phase']
+		self.assertEqual(phases, [
+			'beautiful_soup_parse', 'read_all_sentences',
+			'refresh_token_offsets', 'build_coreferences', 'link_references'
+		])
+
+
+class TestMemoryReport(TestCase):
+
+	def test_memory_report(self):
+		article = load_test_article()
+		report = article.memory_report()
+
+		self.assertEqual(report['total'], sum(report['layers'].values()))
+		for layer in ['tokens', 'constituency', 'dependencies', 'mentions']:
+			self.assertTrue(report['layers'][layer] > 0)
+
+		# The soup is far larger than the rest of the document
+		self.assertEqual(report['large_objects'][0]['attribute'], 'soup')
+
+		# Nothing is flagged if the threshold is not reached
+		report = article.memory_report(large_object_threshold=10**12)
+		self.assertEqual(report['large_objects'], [])
+
+
+class TestSynthetic(TestCase):
+
+	def test_generate_document(self):
+		xml, aida = synthetic.generate_document(
+			num_sentences=6, sentence_length=15, parse_depth=3,
+			dependency_density=1.5, num_coref_chains=4, coref_chain_length=3,
+			aida_mention_density=0.2, seed=0
+		)
+		article = A(xml, aida)
+		self.assertEqual(len(article.sentences), 6)
+		self.assertEqual(len(article.tokens), 90)
+		self.assertEqual(len(article.coreferences), 4)
+		self.assertTrue(len(article.disambiguated_references) > 0)
+
+		# The same seed gives the same document
+		self.assertEqual(
+			synthetic.generate_document(seed=1),
+			synthetic.generate_document(seed=1)
+		)
+
+	def test_write_document(self):
+		data_dir = tempfile.mkdtemp()
+		try:
+			synthetic.write_document(data_dir, 'synthetic.txt', seed=0)
+			pairs = corpus.find_corpus_pairs(
+				path.join(data_dir, 'CoreNLP'), path.join(data_dir, 'AIDA'))
+			self.assertEqual(len(pairs), 1)
+			article = corpus.load(*pairs[0])
+			self.assertEqual(len(article.sentences), 10)
+		finally:
+			shutil.rmtree(data_dir)
+
+
+class TestCoreNLPJson(TestCase):
+
+	def test_matches_xml(self):
+		options = dict(
+			num_sentences=8, dependency_density=1.5, aida_mention_density=0.2,
+			seed=2
+		)
+		xml, aida = synthetic.generate_document(**options)
+		corenlp_json, aida = synthetic.generate_document(
+			output_format='json', **options)
+
+		for dependencies in ['basic', 'collapsed-ccprocessed']:
+			from_xml = A(xml, aida, dependencies=dependencies, initial_offset=3)
+			from_json = A(corenlp_json, aida, input_format='json',
+				dependencies=dependencies, initial_offset=3)
+
+			self.assertEqual(
+				[str(t) for t in from_xml.tokens],
+				[str(t) for t in from_json.tokens]
+			)
+			self.assertEqual(
+				[(p[0], p[1]['id']) for t in from_xml.tokens for p in t['parents']],
+				[(p[0], p[1]['id']) for t in from_json.tokens for p in t['parents']]
+			)
+			self.assertEqual(
+				[t['c_parent']['c_tag'] for t in from_xml.tokens],
+				[t['c_parent']['c_tag'] for t in from_json.tokens]
+			)
+
+			references = lambda article: [
+				(r['id'], r.get('kbIdentifier'),
+					[(m['sentence_id'], m['start'], m['end']) for m in r['mentions']])
+				for r in article.references
+			]
+			self.assertEqual(references(from_xml), references(from_json))
+
+	def test_input_format(self):
+		with self.assertRaises(ValueError):
+			A('{}', input_format='yaml')
+		self.assertEqual(A('{}', input_format='json').sentences, [])
+
+
+class TestInputSources(TestCase):
+
+	def assert_same_article(self, article, expected):
+		self.assertEqual(
+			[str(t) for t in article.tokens], [str(t) for t in expected.tokens])
+		self.assertEqual(
+			[r.get('kbIdentifier') for r in article.references],
+			[r.get('kbIdentifier') for r in expected.references]
+		)
+
+	def test_from_path(self):
+		expected = load_test_article()
+		for use_mmap in [True, False]:
+			article = A.from_path(CORENLP_PATH, AIDA_PATH, use_mmap=use_mmap)
+			self.assert_same_article(article, expected)
+
+			# By default neither the text nor the soup is kept
+			self.assertEqual(article.text, None)
+			self.assertEqual(article.soup, None)
+
+	def test_from_bytes_and_file(self):
+		expected = load_unicode_article()
+		xml = open(UNICODE_CORENLP_PATH, 'rb').read()
+		aida = open(UNICODE_AIDA_PATH).read()
+		self.assert_same_article(A.from_bytes(xml, aida), expected)
+		self.assert_same_article(
+			A.from_file(open(UNICODE_CORENLP_PATH, 'rb'), open(UNICODE_AIDA_PATH)),
+			expected
+		)
+
+		# The text is kept if asked for
+		article = A.from_bytes(xml, keep_text=True)
+		self.assertTrue(article.text is xml)
+
+		# Keeping the text doesn't use up a file before it is parsed
+		for article in [
+			A(open(UNICODE_CORENLP_PATH, 'rb'), open(UNICODE_AIDA_PATH)),
+			A.from_file(open(UNICODE_CORENLP_PATH, 'rb'), keep_text=True),
+			A.from_path(UNICODE_CORENLP_PATH, use_mmap=False, keep_text=True),
+		]:
+			self.assertEqual(len(article.sentences), len(expected.sentences))
+			self.assertEqual(article.text, xml.decode('utf8'))
+
+
+class TestCompressedInput(TestCase):
+
+	def compress(self, compression, content):
+		if compression == 'gzip':
+			buf = StringIO()
+			f = gzip.GzipFile(fileobj=buf, mode='wb')
+			f.write(content)
+			f.close()
+			return buf.getvalue()
+		return bz2.compress(content)
+
+	def test_compressed_input(self):
+		expected = load_test_article()
+		xml = open(CORENLP_PATH, 'rb').read()
+		aida = open(AIDA_PATH, 'rb').read()
+		for compression in ['gzip', 'bz2']:
+			article = A(
+				self.compress(compression, xml),
+				self.compress(compression, aida)
+			)
+			self.assertEqual(
+				[str(t) for t in article.tokens],
+				[str(t) for t in expected.tokens]
+			)
+			self.assertEqual(
+				[r.get('kbIdentifier') for r in article.references],
+				[r.get('kbIdentifier') for r in expected.references]
+			)
+
+	def test_concatenated_streams(self):
+		xml = open(CORENLP_PATH, 'rb').read()
+		middle = len(xml) // 2
+		for compression in ['gzip', 'bz2']:
+			compressed = (
+				self.compress(compression, xml[:middle])
+				+ self.compress(compression, xml[middle:])
+			)
+			self.assertEqual(sources.read_bytes(compressed), xml)
+
+	def test_compressed_corpus_files(self):
+		data_dir = tempfile.mkdtemp()
+		try:
+			os.makedirs(path.join(data_dir, 'CoreNLP'))
+			os.makedirs(path.join(data_dir, 'AIDA'))
+			xml_path = path.join(data_dir, 'CoreNLP', 'article.txt.xml.gz')
+			aida_path = path.join(data_dir, 'AIDA', 'article.txt.json.bz2')
+			open(xml_path, 'wb').write(
+				self.compress('gzip', open(CORENLP_PATH).read()))
+			open(aida_path, 'wb').write(
+				self.compress('bz2', open(AIDA_PATH).read()))
+
+			pairs = corpus.find_corpus_pairs(
+				path.join(data_dir, 'CoreNLP'), path.join(data_dir, 'AIDA'))
+			self.assertEqual(pairs, [(xml_path, aida_path)])
+
+			article = A.from_path(xml_path, aida_path)
+			self.assertEqual(
+				len(article.disambiguated_references),
+				len(load_test_article().disambiguated_references)
+			)
+		finally:
+			shutil.rmtree(data_dir)
+
+
+class TestArchives(TestCase):
+
+	ARTICLE_IDS = ['b670037f5942445d.txt', 'b6700d50238b23dd.txt']
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def make_tar(self, name, subdirs):
+		archive_path = path.join(self.tmp_dir, name)
+		tar_file = tarfile.open(archive_path, 'w:gz')
+		for article_id in self.ARTICLE_IDS:
+			for subdir in subdirs:
+				ext = '.xml' if subdir == 'CoreNLP' else '.json'
+				fname = path.join(subdir, article_id + ext)
+				tar_file.add(path.join(DATA_DIR, fname), fname)
+		tar_file.close()
+		return archive_path
+
+	def check_articles(self, found, with_aida=True):
+		self.assertEqual([article_id for article_id, a in found], self.ARTICLE_IDS)
+		for article_id, article in found:
+			expected = corpus.load(
+				path.join(DATA_DIR, 'CoreNLP', article_id + '.xml'),
+				path.join(DATA_DIR, 'AIDA', article_id + '.json')
+			)
+			self.assertEqual(
+				[str(t) for t in article.tokens],
+				[str(t) for t in expected.tokens]
+			)
+			self.assertEqual(
+				bool(article.disambiguated_references) if with_aida else False,
+				with_aida
+			)
+
+	def test_single_tar(self):
+		archive_path = self.make_tar('corpus.tar.gz', ['CoreNLP', 'AIDA'])
+		self.check_articles(list(archives.iter_archive(archive_path, workers=2)))
+
+		# AIDA members can be ignored
+		found = list(archives.iter_archive(
+			archive_path, with_aida=False, executor='thread', workers=1))
+		self.check_articles(found, with_aida=False)
+
+	def test_two_archives(self):
+		corenlp_archive = self.make_tar('corenlp.tar.gz', ['CoreNLP'])
+		aida_archive = self.make_tar('aida.tar.gz', ['AIDA'])
+		found = list(archives.iter_archive(
+			corenlp_archive, aida_archive, workers=2))
+		self.check_articles(found)
+
+	def test_zip(self):
+		archive_path = path.join(self.tmp_dir, 'corpus.zip')
+		zip_file = zipfile.ZipFile(archive_path, 'w')
+		for article_id in self.ARTICLE_IDS:
+			zip_file.write(
+				path.join(DATA_DIR, 'AIDA', article_id + '.json'),
+				'AIDA/' + article_id + '.json'
+			)
+			zip_file.write(
+				path.join(DATA_DIR, 'CoreNLP', article_id + '.xml'),
+				'CoreNLP/' + article_id + '.xml'
+			)
+		zip_file.close()
+
+		pairs = list(archives.iter_archive_pairs(archive_path))
+		self.assertEqual([p[0] for p in pairs], self.ARTICLE_IDS)
+		found = list(archives.iter_archive(archive_path, executor='thread'))
+		self.check_articles(found)
+
+	def test_max_pending(self):
+
+		# Without AIDA members, articles are yielded once max_pending
+		# others are waiting
+		archive_path = self.make_tar('corenlp.tar.gz', ['CoreNLP'])
+		pairs = archives.iter_archive_pairs(archive_path, max_pending=0)
+		self.assertEqual(next(pairs)[::2], (self.ARTICLE_IDS[0], None))
+		self.assertEqual(
+			[(p[0], p[2]) for p in pairs], [(self.ARTICLE_IDS[1], None)])
+
+		# All of the CoreNLP members, then all of the AIDA members
+		archive_path = path.join(self.tmp_dir, 'by_kind.tar')
+		tar_file = tarfile.open(archive_path, 'w')
+		for subdir, ext in [('CoreNLP', '.xml'), ('AIDA', '.json')]:
+			for article_id in self.ARTICLE_IDS:
+				fname = path.join(subdir, article_id + ext)
+				tar_file.add(path.join(DATA_DIR, fname), fname)
+		tar_file.close()
+
+		pairs = list(archives.iter_archive_pairs(archive_path))
+		self.assertTrue(all(p[2] is not None for p in pairs))
+		with self.assertRaises(ValueError):
+			list(archives.iter_archive_pairs(archive_path, max_pending=1))
+
+
+class TestArrowTables(TestCase):
+
+	def test_document_columns(self):
+		article = load_test_article()
+		tables = arrow_tables.document_columns(article, 'doc')
+		self.assertEqual(tables.keys(), arrow_tables.TABLES.keys())
+
+		tokens = tables['tokens']
+		self.assertEqual(len(tokens['word']), len(article.tokens))
+		self.assertEqual(tokens['word'][0], 'President')
+		self.assertEqual(set(tokens['doc_id']), set(['doc']))
+
+		# One root per sentence, plus one row per governor of each token
+		dependencies = tables['dependencies']
+		self.assertEqual(dependencies['governor_id'].count(-1),
+			len(article.sentences))
+		self.assertEqual(len(dependencies['relation']),
+			len(article.sentences) + sum(len(t['parents']) for t in article.tokens))
+
+		# Every token is a leaf of its sentence's constituency tree
+		constituents = tables['constituents']
+		self.assertEqual(
+			len([t for t in constituents['token_id'] if t is not None]),
+			len(article.tokens)
+		)
+
+		self.assertEqual(len(tables['references']['reference_id']),
+			len(article.references))
+		self.assertEqual(
+			set(tables['aida_links']['kb_identifier']),
+			set(m['kbIdentifier'] for r in article.references
+				for m in r['mentions'] if 'kbIdentifier' in m)
+		)
+
+		# Mentions without a head have no head id
+		article.references[0]['mentions'][0]['head'] = None
+		mentions = arrow_tables.document_columns(article, 'doc')['mentions']
+		self.assertEqual(mentions['head_id'][0], None)
+
+	@skipIf(arrow_tables.pyarrow is None, 'pyarrow is not installed')
+	def test_export_corpus(self):
+		import pyarrow.parquet
+		pairs = corpus.find_corpus_pairs(
+			path.join(DATA_DIR, 'CoreNLP'), path.join(DATA_DIR, 'AIDA'))[:2]
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			num_documents = arrow_tables.export_corpus(
+				pairs, tmp_dir, batch_size=100, executor='thread', workers=2)
+			self.assertEqual(num_documents, 2)
+
+			tokens = pyarrow.parquet.read_table(
+				path.join(tmp_dir, 'tokens.parquet'))
+			expected = sum(len(corpus.load(*pair).tokens) for pair in pairs)
+			self.assertEqual(tokens.num_rows, expected)
+			self.assertEqual(
+				set(tokens.column('doc_id').to_pylist()),
+				set(corpus.split_article_id(path.basename(p[0]), '.xml')
+					for p in pairs)
+			)
+		finally:
+			shutil.rmtree(tmp_dir)
+
+	@skipIf(arrow_tables.pyarrow is None, 'pyarrow is not installed')
+	def test_record_batches_dictionary_encoded(self):
+		import pyarrow
+		batches = arrow_tables.to_record_batches(load_test_article())
+		word_type = batches['tokens'].schema.field('word').type
+		self.assertTrue(pyarrow.types.is_dictionary(word_type))
+
+
+class TestConllu(TestCase):
+
+	def test_sentence_columns(self):
+		article = load_test_article()
+		lines = conllu.sentence_lines(article.sentences[0], ['ner', 'offsets'])
+		self.assertEqual(lines[0], u'# sent_id = 1')
+		self.assertEqual(lines[1], u'# text = ' + article.sentences[0].as_string())
+		self.assertEqual(lines[-1], u'')
+
+		rows = [line.split(u'\t') for line in lines[2:-1]]
+		self.assertEqual(len(rows), len(article.sentences[0]['tokens']))
+		self.assertTrue(all(len(row) == 12 for row in rows))
+		self.assertEqual(rows[0][:3], [u'1', u'President', u'President'])
+		self.assertEqual(rows[0][10:], [u'_', u'0-9'])
+
+		# Exactly one token hangs off the root
+		root_rows = [row for row in rows if row[6] == u'0']
+		self.assertEqual(len(root_rows), 1)
+		self.assertEqual(root_rows[0][7], u'root')
+		root_id = int(root_rows[0][0]) - 1
+		self.assertTrue(article.sentences[0]['tokens'][root_id]
+			is article.sentences[0]['root'])
+
+	def test_tree(self):
+		xml = open(CORENLP_PATH).read()
+		for dependencies in ['basic', 'collapsed-ccprocessed']:
+			article = A(xml, dependencies=dependencies)
+			for sentence in article.sentences:
+				rows = [
+					line.split(u'\t')
+					for line in conllu.sentence_lines(sentence)[2:-1]
+				]
+				heads = dict((int(row[0]), int(row[6])) for row in rows)
+				self.assertEqual(heads.values().count(0), 1)
+
+				# Every token reaches the root, without cycles
+				for token_id in heads:
+					seen = set()
+					while token_id != 0:
+						self.assertFalse(token_id in seen)
+						seen.add(token_id)
+						token_id = heads[token_id]
+
+				for row, token in zip(rows, sentence['tokens']):
+					deps = row[8].split(u'|')
+					self.assertEqual(
+						len(deps),
+						max(1, len(token['parents'])
+							+ (token is sentence['root']))
+					)
+					if dependencies == 'basic' and token['parents']:
+						self.assertEqual(
+							int(row[6]), token['parents'][0][1]['id'] + 1)
+
+	def test_write_buffered(self):
+		article = load_test_article()
+		expected = StringIO()
+		num_sentences = conllu.write_conllu([article], expected, ['kb', 'coref'])
+		self.assertEqual(num_sentences, len(article.sentences))
+
+		# Tiny buffers, or writing sentences one by one, give the same output
+		found = StringIO()
+		conllu.write_conllu(article.sentences, found, ['kb', 'coref'], 10)
+		self.assertEqual(found.getvalue(), expected.getvalue())
+
+		output = expected.getvalue().decode('utf8')
+		self.assertTrue(output.startswith(u'# global.columns = ID FORM'))
+		self.assertTrue(u'YAGO:' in output)
+
+		with self.assertRaises(ValueError):
+			conllu.write_conllu([article], StringIO(), ['speaker'])
+
+	def test_convert_corpus(self):
+		pairs = corpus.find_corpus_pairs(
+			path.join(DATA_DIR, 'CoreNLP'), path.join(DATA_DIR, 'AIDA'))[:2]
+		out = StringIO()
+		num_sentences = conllu.convert_corpus(
+			pairs, out, executor='thread', workers=2)
+		output = out.getvalue().decode('utf8')
+		self.assertEqual(output.count(u'# newdoc id = '), 2)
+		self.assertEqual(output.count(u'# sent_id = '), num_sentences)
+
+	def sent_ids(self, out):
+		return [
+			line[len(u'# sent_id = '):]
+			for line in out.getvalue().decode('utf8').split(u'\n')
+			if line.startswith(u'# sent_id = ')
+		]
+
+	def test_unique_sent_ids(self):
+		article = load_test_article()
+		unicode_article = load_unicode_article()
+		num_sentences = len(article.sentences) + len(unicode_article.sentences)
+
+		out = StringIO()
+		conllu.write_conllu(
+			[('first', article), ('second', unicode_article)], out)
+		sent_ids = self.sent_ids(out)
+		self.assertEqual(len(set(sent_ids)), num_sentences)
+		self.assertEqual(sent_ids[0], u'first-1')
+		self.assertEqual(sent_ids[-1], u'second-%d' % len(
+			unicode_article.sentences))
+
+		# Without document ids, sentences are numbered through the file
+		out = StringIO()
+		conllu.write_conllu([article, unicode_article], out)
+		self.assertEqual(
+			self.sent_ids(out),
+			[unicode(i) for i in range(1, num_sentences + 1)]
+		)
+
+
 class TestUnicodeTokens(TestCase):
 
 	def test_unicode_tokens(self):
@@ -73,5 +73,8 @@ setup(
 		'data/CoreNLP/*',
 		'data/raw-text/*',
 	]},
-	install_requires=['bs4']
+	# The xml is fed to BeautifulSoup in chunks through its html.parser
+	# tree builder, whose internals change between releases (see
+	# corenlp_xml_reader/sources.py), so only tested releases are allowed
+	install_requires=['beautifulsoup4>=4.9,<4.10']
 )